@@ -0,0 +1,222 @@
+import json
+import threading
+from datetime import timedelta
+from time import mktime, time
+
+from programs import InvalidProgramArgumentsException, ProgramList, compile_timeline
+
+# most upcoming fires looked at in one pass
+MAX_FIRES_PER_PASS = 20
+
+# frames of each timeline checked, spread evenly from its first frame to its last
+VALIDATION_SAMPLES = 50
+
+class AlarmPreparer(object):
+	'''
+	Validates every alarm a lead time before it fires, so anything that would stop it running cleanly is found and
+	reported while there is still time to fix it, rather than at wakeup time. For each upcoming fire of an enabled
+	timer it:
+		- builds the program command exactly as the timer's crontab entry will request it, which checks its arguments
+			(and, for a playlist, that the playlist still exists and each step's arguments)
+		- compiles every timeline the command plays and checks a sample of its frames, spread over the whole program,
+			are valid colors
+		- checks the LED process is alive, beating and showing frames, and that its render worker is running
+
+	This is validation only. Nothing is precomputed or handed to the LED process, which compiles the timeline itself
+	when the alarm fires. That only takes a few ms, and its frame ring is flushed whenever the program changes. Each
+	fire is validated once, and again if its timer changes. It runs on a thread of the web worker, so it never competes with the LED process's frame
+	loop.
+	'''
+
+	def __init__(self, logger, fire_index, refresh_fire_index, build_program_task, supervisor, num_pixels, lead_s=600, check_interval_s=10):
+		'''
+		Arguments:
+			fire_index (timer.FireTimeIndex) - index of upcoming timer fires. Its clock is the time alarms are prepared by.
+			refresh_fire_index (function) - rebuilds the index if the timer store changed
+			build_program_task (function) - makes the ProgramTask for a program name and dict of URL parameters. Raises
+				InvalidProgramArgumentsException if the parameters aren't valid.
+			supervisor (watchdog.ProgramSupervisor) - owner of the LED process
+			num_pixels (int) - number of pixels on the strip
+			(opt) lead_s (int/float) - how long before a fire it is prepared
+			(opt) check_interval_s (int/float) - how often upcoming fires are looked for
+		'''
+		self.logger = logger
+		self.fire_index = fire_index
+		self.refresh_fire_index = refresh_fire_index
+		self.build_program_task = build_program_task
+		self.supervisor = supervisor
+		self.num_pixels = num_pixels
+		self.lead_s = lead_s
+		self.check_interval_s = check_interval_s
+
+		# (timer id, fire time) -> (timer as it was prepared, result)
+		self._results = {}
+		self._lock = threading.Lock()
+		self._stop_event = threading.Event()
+		self._thread = None
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name='alarm-preparer')
+		self._thread.daemon = True
+		self._thread.start()
+
+	def stop(self):
+		'''Stop looking for alarms to prepare. Safe to call more than once.'''
+		self._stop_event.set()
+
+	def prepare_due(self, now=None):
+		'''
+		Prepare every fire due within the lead time that hasn't been prepared yet.
+
+		Arguments:
+			(opt) now (datetime) - local time to look ahead from. Defaults to the current time of the index's clock.
+
+		Returns:
+			(list[dict]) - results of the fires prepared by this call
+		'''
+		if now is None:
+			now = self.fire_index.clock.now()
+
+		self.refresh_fire_index()
+
+		prepared = []
+		upcoming = set()
+		horizon = now + timedelta(seconds=self.lead_s)
+		fires = self.fire_index.next_fires(now, MAX_FIRES_PER_PASS)
+		if len(fires) == MAX_FIRES_PER_PASS:
+			# fires after the last one looked at are left for a later pass
+			horizon = min(horizon, fires[-1][0])
+
+		for fire_time, timer in fires:
+			if fire_time > horizon:
+				break
+
+			key = (timer.timer_id, fire_time)
+			upcoming.add(key)
+			timer_json = json.dumps(timer.to_storage_json(), sort_keys=True)
+			with self._lock:
+				if key in self._results and self._results[key][0] == timer_json:
+					continue
+
+			result = self.prepare(fire_time, timer)
+			with self._lock:
+				self._results[key] = (timer_json, result)
+			prepared.append(result)
+
+		with self._lock:
+			for key in self._results.keys():
+				# results are kept for a lead time after their fire so they can still be checked after the alarm.
+				# Those of fires no longer coming up, from timers deleted, disabled or moved, are dropped.
+				if key[1] < now - timedelta(seconds=self.lead_s) or (now < key[1] <= horizon and key not in upcoming):
+					del self._results[key]
+
+		return prepared
+
+	def prepare(self, fire_time, timer):
+		'''
+		Prepare one fire of a timer.
+
+		Arguments:
+			fire_time (datetime) - local time the timer fires at
+			timer (timer.Timer) - timer firing
+
+		Returns:
+			(dict) - what was checked and any problems found
+		'''
+		start = time()
+		result = {
+			"timerId": timer.timer_id,
+			"program": timer.program_to_launch,
+			"fireTime": fire_time.isoformat(),
+			"preparedAt": self.fire_index.clock.now().replace(microsecond=0).isoformat(),
+			"framesChecked": 0
+		}
+
+		problems = []
+		try:
+			query_dict = dict((name, str(value)) for name, value in timer.launch_arguments(mktime(fire_time.timetuple())).iteritems())
+			task = self.build_program_task(timer.program_to_launch, query_dict)
+			result["framesChecked"] = self._validate_timelines(task, problems)
+
+		except InvalidProgramArgumentsException as e:
+			problems.append(e.message)
+
+		except Exception as e:
+			self.logger.error('Error preparing timer {}'.format(timer.timer_id), exc_info=True)
+			problems.append('could not be prepared: {}'.format(e))
+
+		problems.extend(self.supervisor.check_output())
+
+		result["ok"] = not problems
+		result["problems"] = problems
+		result["prepareMs"] = round((time() - start) * 1000.0, 1)
+
+		if problems:
+			self.logger.error('Timer {} firing at {} will not run cleanly: {}'.format(timer.timer_id, result["fireTime"], '; '.join(problems)))
+		else:
+			self.logger.info('Prepared timer {} firing at {} in {} ms'.format(timer.timer_id, result["fireTime"], result["prepareMs"]))
+
+		return result
+
+	def result_for(self, timer_id, fire_time):
+		'''
+		Returns:
+			(dict) - result of preparing a fire, or None if it hasn't been prepared
+		'''
+		with self._lock:
+			if (timer_id, fire_time) in self._results:
+				return self._results[(timer_id, fire_time)][1]
+
+		return None
+
+	def to_json(self):
+		with self._lock:
+			prepared = sorted([result for timer_json, result in self._results.itervalues()], key=lambda x: x["fireTime"])
+
+		return {
+			"leadS": self.lead_s,
+			"prepared": prepared
+		}
+
+	def _validate_timelines(self, task, problems):
+		'''
+		Compile the timelines a program command plays and check a sample of each one's frames. Other programs' frames
+		depend on when they are shown, so they can't be checked ahead of time.
+
+		Arguments:
+			task (ProgramTask) - command the timer will send
+			problems (list[string]) - problems found are added to it
+
+		Returns:
+			(int) - frames checked
+		'''
+		if task.program == 'playlist':
+			steps = [(x['program'], x['arg_dict']) for x in task.arg_dict['steps']]
+		else:
+			steps = [(task.program, task.arg_dict)]
+
+		frames = 0
+		for program, arg_dict in steps:
+			if program not in ProgramList.timeline_programs:
+				continue
+
+			timeline = compile_timeline(program, self.num_pixels, arg_dict)
+			last_index = timeline.frame_count - 1
+			samples = min(VALIDATION_SAMPLES, timeline.frame_count)
+			for i in range(samples):
+				index = int(round(i * last_index / float(samples - 1))) if samples > 1 else 0
+				red, green, blue, pixel_count = timeline.frame_at_index(index, exact=True)
+				frames += 1
+				if not all(0 <= x <= 255 for x in (red, green, blue)) or pixel_count < 0 or pixel_count > self.num_pixels:
+					problems.append('frame {} of {} is not a valid color: {}'.format(index, program, (red, green, blue, pixel_count)))
+					break
+
+		return frames
+
+	def _run(self):
+		# the first pass waits an interval too, so the service has finished starting up
+		while not self._stop_event.wait(self.check_interval_s):
+			try:
+				self.prepare_due()
+			except Exception:
+				self.logger.error('Error preparing upcoming alarms', exc_info=True)
@@ -0,0 +1,53 @@
+from datetime import datetime
+import time
+
+class SystemClock(object):
+	'''Wall clock used in production'''
+
+	def time(self):
+		'''Returns the current time (float) in epoch seconds'''
+		return time.time()
+
+	def now(self):
+		'''Returns the current local time (datetime)'''
+		return datetime.now()
+
+	def sleep(self, seconds):
+		'''Block for a number of seconds'''
+		time.sleep(seconds)
+
+class VirtualClock(object):
+	'''
+	Clock that only moves when something sleeps on it, and then jumps straight to the end of the sleep. Programs and
+	alarm schedules run against it take the same steps as they would in real time, with the same frame for every
+	deadline, but a 30 minute wakeup finishes as fast as its frames can be computed.
+
+	It is meant for one thread driving a program or schedule. Other threads only read it.
+	'''
+
+	def __init__(self, start=None):
+		'''
+		Arguments:
+			(opt) start (float) - epoch seconds the clock starts at. Defaults to the current wall clock time.
+		'''
+		self._now = time.time() if start is None else float(start)
+
+	def time(self):
+		'''Returns the current virtual time (float) in epoch seconds'''
+		return self._now
+
+	def now(self):
+		'''Returns the current virtual local time (datetime)'''
+		return datetime.fromtimestamp(self._now)
+
+	def sleep(self, seconds):
+		'''Move the clock forward a number of seconds without blocking'''
+		self.advance(seconds)
+
+	def advance(self, seconds):
+		'''Move the clock forward a number of seconds. Negative durations are ignored, since time never goes back.'''
+		self._now += max(0, seconds)
+
+	def advance_to(self, timestamp):
+		'''Move the clock forward to an epoch time, if it is in the future'''
+		self._now = max(self._now, float(timestamp))
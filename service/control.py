@@ -0,0 +1,172 @@
+import socket
+import SocketServer
+import threading
+
+from programs import InvalidProgramArgumentsException
+from watchdog import ProgramNotRunningException, UnknownZoneException
+
+# ends every reply, which is what the app's SocketClient reads up to
+END_OF_REPLY = '@#$'
+
+# longest command accepted. Longer lines are answered with an error and the connection is closed.
+MAX_LINE_LENGTH = 1024
+
+class ControlServer(object):
+	'''
+	Persistent TCP control port for interactive control, e.g. dragging a color picker. Each command is one line of
+	text and is handed straight to the LED process, skipping the HTTP parsing, routing and process scan of the REST
+	API. Connections are kept open so a stream of commands pays for a single round trip each.
+
+	Commands (answered with 'ok' or 'error <message>', then a line holding END_OF_REPLY):
+		color <red> <green> <blue>        - show a color. Changes it in place if single_color is already running.
+		brightness <pct>                  - set the global brightness, from 0 to 100
+		program <name> [<param>=<value>]  - run a program, with the same parameters as GET /programs/<name>
+		zone <zone> <name> [<param>=<value>] - run a program in one zone (see zones.py)
+		ping                              - check the connection
+	'''
+
+	def __init__(self, logger, supervisor, build_program_task, host, port, idle_timeout_s=300):
+		'''
+		Arguments:
+			supervisor (ProgramSupervisor) - owner of the LED process
+			build_program_task (function) - makes the ProgramTask for a program name and dict of URL parameters. Raises
+				InvalidProgramArgumentsException if the parameters aren't valid.
+			host (string) - address to listen on
+			port (int) - port to listen on
+			(opt) idle_timeout_s (int/float) - a connection that sends nothing for this long is closed
+		'''
+		self.logger = logger
+		self.supervisor = supervisor
+		self.build_program_task = build_program_task
+		self.host = host
+		self.port = port
+		self.idle_timeout_s = idle_timeout_s
+
+		self._server = None
+		self._thread = None
+
+	def start(self):
+		'''
+		Start listening.
+
+		Raises:
+			socket.error - if the port can't be bound, e.g. it is held by another worker
+		'''
+		self._server = _ControlTCPServer((self.host, self.port), _ControlHandler, self)
+		self._thread = threading.Thread(target=self._server.serve_forever, args=(0.1,), name='control-port')
+		self._thread.daemon = True
+		self._thread.start()
+		self.logger.info('Listening for control commands on {}:{}'.format(self.host, self.port))
+
+	def close(self):
+		'''Stop listening. Safe to call more than once.'''
+		# taken first, since a second shutdown signal can call this again while the first call waits on shutdown()
+		server, self._server = self._server, None
+		if server is not None:
+			server.shutdown()
+			server.server_close()
+
+	def handle_command(self, line):
+		'''
+		Carry out a command.
+
+		Arguments:
+			line (string) - command without its line ending
+
+		Returns:
+			(string) - reply line
+		'''
+		items = line.split()
+		if not items:
+			return 'error empty command'
+
+		command = items[0].lower()
+		try:
+			if command == 'color':
+				try:
+					red, green, blue = [int(x) for x in items[1:]]
+					if not all(0 <= x <= 255 for x in (red, green, blue)):
+						raise ValueError
+				except ValueError:
+					return 'error usage: color <red> <green> <blue>, each from 0 to 255'
+
+				params = {'red': red, 'green': green, 'blue': blue}
+				try:
+					# no restart or crossfade, so the color follows the picker from the next frame
+					self.supervisor.update_parameters('single_color', params)
+				except ProgramNotRunningException:
+					self.supervisor.send(self.build_program_task('single_color', params))
+
+			elif command == 'brightness':
+				try:
+					brightness_pct = int(items[1])
+					if len(items) != 2 or brightness_pct < 0 or brightness_pct > 100:
+						raise ValueError
+				except (IndexError, ValueError):
+					return 'error usage: brightness <pct>, from 0 to 100'
+
+				self.supervisor.set_brightness_pct(brightness_pct)
+
+			elif command in ['program', 'zone']:
+				zone = items.pop(1) if command == 'zone' and len(items) > 1 else None
+				if len(items) < 2:
+					return 'error usage: program <name> [<param>=<value> ...] or zone <zone> <name> [<param>=<value> ...]'
+
+				try:
+					query_dict = dict(x.split('=', 1) for x in items[2:])
+				except ValueError:
+					return 'error parameters must be given as <param>=<value>'
+
+				task = self.build_program_task(items[1], query_dict)
+				task.zone = zone
+				self.supervisor.send(task)
+
+			elif command != 'ping':
+				return 'error unknown command {}'.format(command)
+
+			return 'ok'
+
+		except (InvalidProgramArgumentsException, UnknownZoneException) as e:
+			return 'error {}'.format(e.message)
+
+		except Exception:
+			self.logger.error('Error handling control command {!r}'.format(line), exc_info=True)
+			return 'error handling command'
+
+class _ControlTCPServer(SocketServer.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+	def __init__(self, address, handler_class, control):
+		self.control = control
+		SocketServer.ThreadingTCPServer.__init__(self, address, handler_class)
+
+class _ControlHandler(SocketServer.StreamRequestHandler):
+	'''Serves one client connection, answering each command line in turn'''
+
+	def setup(self):
+		self.timeout = self.server.control.idle_timeout_s
+		SocketServer.StreamRequestHandler.setup(self)
+
+		# replies are tiny, so send each one at once rather than waiting to fill a packet
+		self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+	def handle(self):
+		control = self.server.control
+		try:
+			while True:
+				line = self.rfile.readline(MAX_LINE_LENGTH + 1)
+				if not line:
+					break
+
+				if len(line) > MAX_LINE_LENGTH:
+					self.wfile.write('error command longer than {} bytes\n{}\n'.format(MAX_LINE_LENGTH, END_OF_REPLY))
+					break
+
+				self.wfile.write('{}\n{}\n'.format(control.handle_command(line.strip()), END_OF_REPLY))
+
+		except socket.timeout:
+			pass
+
+		except socket.error as e:
+			control.logger.info('Control connection from {} closed: {}'.format(self.client_address[0], e))
@@ -0,0 +1,221 @@
+import errno
+import httplib
+import json
+import socket
+import threading
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from Queue import LifoQueue, Empty, Full
+from time import time
+
+class NodeConnectionPool(object):
+	'''Pool of keep-alive HTTP connections to one sunrise node'''
+
+	def __init__(self, host, port, size=2, timeout_s=2):
+		'''
+		Initialize a connection pool
+
+		Arguments:
+			host (string) - host name or IP address of the node
+			port (int) - port the node's service listens on
+			(opt) size (int) - maximum number of idle connections kept open
+			(opt) timeout_s (int/float) - socket timeout for each request
+		'''
+		self.host = host
+		self.port = port
+		self.timeout_s = timeout_s
+		self._idle = LifoQueue(size)
+
+	def _new_connection(self):
+		return httplib.HTTPConnection(self.host, self.port, timeout=self.timeout_s)
+
+	def _release_connection(self, conn):
+		try:
+			self._idle.put_nowait(conn)
+		except Full:
+			conn.close()
+
+	def _send(self, conn, method, path, encoded_body, headers, reused=False):
+		'''
+		Raises:
+			StaleConnection - a reused connection had been closed by the node before it read the request
+			httplib.HTTPException, socket.error
+		'''
+		try:
+			conn.request(method, path, encoded_body, headers)
+			if reused and not conn.sock.recv(1, socket.MSG_PEEK):
+				# closed without a byte of response, so the node closed the connection while it was idle
+				raise StaleConnection()
+
+		except socket.timeout:
+			# the node may be working on the request, so it must not be sent again
+			raise
+
+		except socket.error as e:
+			if reused and e.errno in (errno.ECONNRESET, errno.EPIPE):
+				# reset before a byte of response, which is how a node that closed the idle connection answers
+				raise StaleConnection()
+			raise
+
+		resp = conn.getresponse()
+		data = resp.read()
+
+		if resp.getheader('connection', '').lower() == 'close':
+			conn.close()
+		else:
+			self._release_connection(conn)
+
+		return resp.status, json.loads(data) if data else None
+
+	def request(self, method, path, body=None):
+		'''
+		Send a request to the node.
+
+		Arguments:
+			method (string) - HTTP method
+			path (string) - path including any query string
+			(opt) body (dict) - JSON body
+
+		Raises:
+			httplib.HTTPException, socket.error
+
+		Returns:
+			tuple
+				status (int) - HTTP status code
+				payload (dict) - decoded JSON response, or None if the response was empty
+		'''
+		headers = {}
+		encoded_body = None
+		if body is not None:
+			encoded_body = json.dumps(body)
+			headers['Content-Type'] = 'application/json'
+
+		try:
+			conn = self._idle.get_nowait()
+		except Empty:
+			conn = self._new_connection()
+			return self._send(conn, method, path, encoded_body, headers)
+
+		try:
+			return self._send(conn, method, path, encoded_body, headers, reused=True)
+
+		except StaleConnection:
+			# the node closed the idle connection without reading the request, so it is safe to send it again once
+			conn.close()
+			return self._send(self._new_connection(), method, path, encoded_body, headers)
+
+		except (httplib.HTTPException, socket.error):
+			# the node may have received the request, so it isn't retried
+			conn.close()
+			raise
+
+	def close(self):
+		while True:
+			try:
+				self._idle.get_nowait().close()
+			except Empty:
+				break
+
+class Coordinator(object):
+	'''Fans requests out to a group of peer sunrise nodes concurrently and aggregates the results'''
+
+	def __init__(self, logger, peers, timeout_s=2, pool_size=2):
+		'''
+		Initialize the coordinator
+
+		Arguments:
+			peers (list) - list of 'host:port' strings for the peer nodes
+			(opt) timeout_s (int/float) - time allowed for each node to respond
+			(opt) pool_size (int) - idle keep-alive connections kept per node
+		'''
+		self.logger = logger
+		self.timeout_s = timeout_s
+
+		self.pools = {}
+		for peer in peers:
+			host, port = peer.rsplit(':', 1)
+			self.pools[peer] = NodeConnectionPool(host, int(port), pool_size, timeout_s)
+
+		self._workers = None
+		self._workers_lock = threading.Lock()
+
+	@property
+	def peers(self):
+		return sorted(self.pools.keys())
+
+	def _get_workers(self):
+		# created lazily so the threads belong to the process serving requests
+		with self._workers_lock:
+			if self._workers is None:
+				self._workers = ThreadPool(max(1, len(self.pools)))
+
+			return self._workers
+
+	def _request_node(self, peer, method, path, body):
+		start = time()
+		try:
+			status, payload = self.pools[peer].request(method, path, body)
+			return {"status": status, "response": payload, "elapsedMs": round((time() - start) * 1000.0, 1)}
+
+		except (httplib.HTTPException, socket.error, ValueError) as e:
+			self.logger.warning('Request {} {} to node {} failed: {}'.format(method, path, peer, str(e)))
+			return {"error": str(e) or e.__class__.__name__, "elapsedMs": round((time() - start) * 1000.0, 1)}
+
+	def start_fan_out(self, method, path, body=None):
+		'''
+		Send the same request to every peer node at once without waiting for the responses.
+
+		Arguments:
+			method (string) - HTTP method
+			path (string) - path including any query string
+			(opt) body (dict) - JSON body
+
+		Returns:
+			(dict) - pending result per peer to pass to collect
+		'''
+		workers = self._get_workers()
+		pending = {}
+		for peer in self.pools:
+			pending[peer] = workers.apply_async(self._request_node, (peer, method, path, body))
+
+		return pending
+
+	def collect(self, pending):
+		'''
+		Wait for the responses to a fan out.
+
+		Arguments:
+			pending (dict) - pending results from start_fan_out
+
+		Returns:
+			(dict) - result per peer. Each result has 'status' and 'response' on success or 'error' on failure,
+				plus 'elapsedMs'.
+		'''
+		# each node has its own socket timeout, so the overall wait only needs a little slack on top of it
+		deadline = time() + self.timeout_s * 2 + 1
+		results = {}
+		for peer, async_result in pending.iteritems():
+			try:
+				results[peer] = async_result.get(max(0, deadline - time()))
+			except TimeoutError:
+				results[peer] = {"error": "timed out", "elapsedMs": self.timeout_s * 1000.0}
+
+		return results
+
+	def fan_out(self, method, path, body=None):
+		'''Send the same request to every peer node at once and wait for the results (see start_fan_out and collect)'''
+		return self.collect(self.start_fan_out(method, path, body))
+
+	def close(self):
+		with self._workers_lock:
+			if self._workers is not None:
+				self._workers.terminate()
+				self._workers = None
+
+		for pool in self.pools.itervalues():
+			pool.close()
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class StaleConnection(Exception):
+	pass
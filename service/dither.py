@@ -0,0 +1,51 @@
+# golden ratio conjugate, used to spread the starting error of each pixel evenly over one level
+PHASE_STEP = 0.6180339887
+
+class TemporalDither(object):
+	'''
+	Sigma-delta temporal dithering. Frames are computed with fractional color values and each output frame is
+	quantized to whole levels, carrying the rounding error of every pixel channel into its next output frame. Over a
+	few output frames the average level shown matches the fractional value, so fades at the dim end move in steps
+	much finer than one level instead of jumping a whole level at a time.
+
+	Whole values are always shown exactly, so frames without fractional values look the same dithered or not.
+	'''
+
+	def __init__(self, num_pixels):
+		'''
+		Arguments:
+			num_pixels (int) - number of pixels on the strip
+		'''
+		self.num_pixels = num_pixels
+
+		# error carried per pixel channel, always in [-0.5, 0.5). Each pixel starts at a different phase so pixels
+		# showing the same fractional color don't all step up on the same output frame, which would flicker.
+		self._error = []
+		for i in range(num_pixels):
+			phase = (i * PHASE_STEP) % 1.0 - 0.5
+			self._error.extend([phase, phase, phase])
+
+	def quantize(self, data, scale=1.0):
+		'''
+		Quantize a frame for one output frame.
+
+		Arguments:
+			data (list[ColorObject]) - frame with color values from 0 to 255, which may be fractional
+			(opt) scale (float) - brightness applied before quantizing, so dimmed output keeps its precision
+
+		Returns:
+			(list[int]) - whole red, green, blue levels for each pixel in turn
+		'''
+		error = self._error
+		levels = [0] * (self.num_pixels * 3)
+
+		i = 0
+		for color in data:
+			for value in (color.r, color.g, color.b):
+				target = value * scale + error[i]
+				level = int(target + 0.5)
+				error[i] = target - level
+				levels[i] = level
+				i += 1
+
+		return levels
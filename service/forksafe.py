@@ -0,0 +1,37 @@
+import logging
+import threading
+from contextlib import contextmanager
+
+@contextmanager
+def logging_locks_held():
+	'''
+	Hold the logging module's lock and every handler's lock while a child process is forked from a multithreaded one,
+	e.g. the LED process from a web worker with request, pool and monitor threads. No other thread can then be part
+	way through writing a log record when the child is made, so the handlers' streams are left in a consistent state.
+	'''
+	logging._acquireLock()
+	handlers = _live_handlers()
+	try:
+		for handler in handlers:
+			handler.acquire()
+
+		yield
+
+	finally:
+		for handler in reversed(handlers):
+			handler.release()
+		logging._releaseLock()
+
+def reset_logging_locks():
+	'''
+	Give the logging module and every handler fresh locks. Called first thing in a forked child: its copies of the locks
+	were taken by the thread that forked it, which doesn't exist in the child, so they would never be released and its
+	first log call would block forever.
+	'''
+	logging._lock = threading.RLock()
+	for handler in _live_handlers():
+		handler.createLock()
+
+def _live_handlers():
+	'''Returns (list[logging.Handler]) - every handler that hasn't been garbage collected'''
+	return [ref() for ref in logging._handlerList if ref() is not None]
@@ -0,0 +1,214 @@
+import multiprocessing
+import os
+import signal
+from Queue import Empty
+from time import sleep, time
+
+from forksafe import logging_locks_held, reset_logging_locks
+from timeline import FRAME_INTERVAL_S
+
+class FrameRing(object):
+	'''
+	Ring of upcoming frames in shared memory. A RenderWorker fills it ahead of time and the LED process copies out the
+	frame due at each deadline, so how long a frame takes to render doesn't delay the output.
+
+	There is one writer and one reader. The writer marks a slot empty, writes its pixels and then publishes the frame
+	index and generation, and the reader checks both before and after copying, so it never uses a torn frame.
+	Bumping the generation flushes every frame in the ring.
+	'''
+
+	def __init__(self, num_pixels, size=32):
+		'''
+		Initialize the ring. Must be created before the LED process is started.
+
+		Arguments:
+			num_pixels (int) - number of pixels in a frame
+			(opt) size (int) - number of frames the ring holds, i.e. how far ahead frames are rendered
+		'''
+		self.num_pixels = num_pixels
+		self.size = size
+		self._pixels = multiprocessing.Array('d', size * num_pixels * 3, lock=False)
+		self._slot_index = multiprocessing.Array('l', [-1] * size, lock=False)
+		self._slot_generation = multiprocessing.Array('l', size, lock=False)
+
+		self.generation = multiprocessing.Value('l', 0, lock=False)
+
+		# last frame index the LED process took, so the worker knows which slots are free
+		self.read_index = multiprocessing.Value('l', -1, lock=False)
+
+		# frames the LED process found rendered in the ring, and frames it had to render itself
+		self.hits = multiprocessing.Value('l', 0, lock=False)
+		self.misses = multiprocessing.Value('l', 0, lock=False)
+
+	def flush(self):
+		'''Discard every frame in the ring. Only called from the LED process.'''
+		self.generation.value += 1
+		return self.generation.value
+
+	def write(self, generation, index, values):
+		'''
+		Store a frame. Only called from the render worker.
+
+		Arguments:
+			generation (int) - generation the frame was rendered for
+			index (int) - frame index
+			values (list[float]) - red, green and blue of each pixel in turn
+		'''
+		slot = index % self.size
+		start = slot * self.num_pixels * 3
+
+		self._slot_index[slot] = -1
+		self._pixels[start:start + len(values)] = values
+		self._slot_generation[slot] = generation
+		self._slot_index[slot] = index
+
+	def read(self, index):
+		'''
+		Take a frame. Only called from the LED process.
+
+		Arguments:
+			index (int) - frame index
+
+		Returns:
+			(list[float]) - red, green and blue of each pixel in turn, or None if the frame isn't in the ring
+		'''
+		slot = index % self.size
+		start = slot * self.num_pixels * 3
+		generation = self.generation.value
+
+		values = None
+		if self._slot_index[slot] == index and self._slot_generation[slot] == generation:
+			values = self._pixels[start:start + self.num_pixels * 3]
+			if self._slot_index[slot] != index or self._slot_generation[slot] != generation:
+				# overwritten while it was being copied
+				values = None
+
+		self.read_index.value = index
+		if values is None:
+			self.misses.value += 1
+		else:
+			self.hits.value += 1
+
+		return values
+
+	def to_json(self):
+		return {
+			"framesAhead": self.size,
+			"hits": self.hits.value,
+			"misses": self.misses.value
+		}
+
+class RenderWorker(object):
+	'''
+	Process that renders the frames of the timeline being played into a FrameRing, running ahead of the LED process
+	by up to the size of the ring. It can run on another core, so rendering never competes with the output loop.
+
+	It is forked directly rather than through multiprocessing.Process, which doesn't let the daemonic LED process have
+	children of its own.
+	'''
+
+	def __init__(self, logger, ring):
+		'''
+		Arguments:
+			ring (FrameRing) - ring to fill
+		'''
+		self.logger = logger
+		self.ring = ring
+		self.commands = multiprocessing.Queue()
+		self.pid = None
+		self.exitcode = None
+		self._owner_pid = None
+
+	def start(self):
+		self._owner_pid = os.getpid()
+		with logging_locks_held():
+			self.pid = os.fork()
+
+		if self.pid == 0:
+			reset_logging_locks()
+			exitcode = 0
+			try:
+				self._run()
+			except Exception:
+				self.logger.error('Render worker failed', exc_info=True)
+				exitcode = 1
+			finally:
+				# skip the exit handlers inherited from the LED process, such as the strip's cleanup
+				os._exit(exitcode)
+
+	def is_alive(self):
+		if self.exitcode is None:
+			pid, status = os.waitpid(self.pid, os.WNOHANG)
+			if pid != 0:
+				self.exitcode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+		return self.exitcode is None
+
+	def stop(self, timeout_s):
+		'''Stop the worker, killing it if it hasn't exited within timeout_s of being sent SIGTERM'''
+		if not self.is_alive():
+			return
+
+		os.kill(self.pid, signal.SIGTERM)
+		deadline = time() + timeout_s
+		while self.is_alive() and time() < deadline:
+			sleep(0.005)
+
+		if self.is_alive():
+			os.kill(self.pid, signal.SIGKILL)
+			os.waitpid(self.pid, 0)
+
+	def render(self, timeline, start_index, exact):
+		'''
+		Start rendering a timeline, discarding whatever was rendered before. Called from the LED process.
+
+		Arguments:
+			timeline (Timeline) - timeline to render
+			start_index (int) - first frame to render
+			exact (boolean) - render fractional colors, see Timeline.frame_at_index
+		'''
+		self.ring.read_index.value = start_index - 1
+		self.commands.put_nowait((self.ring.flush(), timeline, start_index, exact))
+
+	def cancel(self):
+		'''Stop rendering and discard whatever was rendered, e.g. when a new program preempts the timeline'''
+		self.commands.put_nowait((self.ring.flush(), None, 0, False))
+
+	def _run(self):
+		# the LED process handles the signals. SIGTERM is how it stops this process.
+		signal.signal(signal.SIGTERM, signal.SIG_DFL)
+		signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+		generation, timeline, next_index, exact = (0, None, 0, False)
+		while os.getppid() == self._owner_pid:
+			if timeline is not None:
+				# the LED process may have skipped ahead, e.g. after a stall
+				next_index = max(next_index, self.ring.read_index.value + 1)
+
+			# nothing to render until the LED process catches up or sends another timeline
+			idle = timeline is None or next_index >= timeline.frame_count or next_index - self.ring.read_index.value >= self.ring.size
+
+			try:
+				if idle:
+					command = self.commands.get(timeout=FRAME_INTERVAL_S / 2)
+				else:
+					command = self.commands.get_nowait()
+
+				generation, timeline, next_index, exact = command
+				continue
+
+			except Empty:
+				pass
+
+			if not idle:
+				self.ring.write(generation, next_index, self._render_frame(timeline, next_index, exact))
+				next_index += 1
+
+	def _render_frame(self, timeline, index, exact):
+		'''
+		Returns:
+			(list[float]) - red, green and blue of each pixel in turn for a frame of a timeline
+		'''
+		red, green, blue, pixel_count = timeline.frame_at_index(index, exact)
+		pixel_count = min(max(pixel_count, 0), self.ring.num_pixels)
+		return [red, green, blue] * pixel_count + [0, 0, 0] * (self.ring.num_pixels - pixel_count)
@@ -0,0 +1,84 @@
+import multiprocessing
+
+from timeline import FRAME_INTERVAL_S
+
+class FrameTiming(object):
+	'''
+	Ring of the times the most recent frames were sent to the strip, kept in shared memory so the LED process can
+	write it every frame while the service reads it to report frame cadence and jitter.
+	'''
+
+	def __init__(self, size=1200):
+		'''
+		Initialize the frame timing ring. Must be created before the LED process is started.
+
+		Arguments:
+			(opt) size (int) - number of frame times kept. The default is two minutes of frames.
+		'''
+		self.size = size
+		self._times = multiprocessing.Array('d', size, lock=False)
+		self._count = multiprocessing.Value('l', 0, lock=False)
+
+	def record(self, sent_at):
+		'''
+		Record a frame. Only called from the LED process.
+
+		Arguments:
+			sent_at (float) - time the frame was sent
+		'''
+		self._times[self._count.value % self.size] = sent_at
+		self._count.value += 1
+
+	def recent_times(self, since=None):
+		'''
+		Arguments:
+			(opt) since (float) - only include frames sent at or after this time
+
+		Returns:
+			(list) - frame send times, oldest first
+		'''
+		count = self._count.value
+		# the oldest slot is skipped since it is the next one the LED process overwrites
+		times = [self._times[i % self.size] for i in range(max(0, count - self.size + 1), count)]
+		if since is not None:
+			times = [x for x in times if x >= since]
+
+		return times
+
+	def summary(self, since=None):
+		'''
+		Summarize the frame cadence. Jitter is how far each interval between frames was from the frame interval.
+
+		Arguments:
+			(opt) since (float) - only include frames sent at or after this time
+
+		Returns:
+			(dict) - frame count, mean interval, p50/p95/p99/max jitter in milliseconds and the number of late frames
+				(those sent more than half a frame late)
+		'''
+		times = self.recent_times(since)
+		resp = {"frames": len(times), "expectedIntervalMs": FRAME_INTERVAL_S * 1000.0}
+		if len(times) < 2:
+			return resp
+
+		intervals = [times[i] - times[i-1] for i in range(1, len(times))]
+		jitter = sorted(abs(x - FRAME_INTERVAL_S) for x in intervals)
+
+		resp.update({
+			"windowS": round(times[-1] - times[0], 3),
+			"meanIntervalMs": round(sum(intervals) / len(intervals) * 1000.0, 3),
+			"jitterP50Ms": round(percentile(jitter, 50) * 1000.0, 3),
+			"jitterP95Ms": round(percentile(jitter, 95) * 1000.0, 3),
+			"jitterP99Ms": round(percentile(jitter, 99) * 1000.0, 3),
+			"jitterMaxMs": round(jitter[-1] * 1000.0, 3),
+			"lateFrames": len([x for x in intervals if x > FRAME_INTERVAL_S * 1.5])
+		})
+		return resp
+
+def percentile(ordered, pct):
+	'''Nearest-rank percentile of an already sorted list'''
+	if not ordered:
+		return 0.0
+
+	rank = int(round(pct / 100.0 * len(ordered) + 0.5)) - 1
+	return ordered[max(0, min(rank, len(ordered) - 1))]
@@ -0,0 +1,177 @@
+'''
+Compact binary recording of the frames a program sends to the strip.
+
+File layout:
+	header - 4 byte magic 'SRFT', 1 byte format version, 2 byte pixel count (little endian)
+	body - zlib stream of records, each an 8 byte float timestamp (seconds since the first frame)
+		followed by 3 bytes of r, g, b per pixel
+'''
+import struct
+import zlib
+
+MAGIC = 'SRFT'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBH')
+TIMESTAMP = struct.Struct('<d')
+
+class TraceRecorder(object):
+	'''Writes frames to a trace file as they are sent'''
+
+	def __init__(self, filename, num_pixels, max_frames=None):
+		'''
+		Initialize a recorder
+
+		Arguments:
+			filename (string) - trace file to write
+			num_pixels (int) - number of pixels in each frame
+			(opt) max_frames (int) - stop recording after this many frames
+		'''
+		self.filename = filename
+		self.num_pixels = num_pixels
+		self.max_frames = max_frames
+		self.frame_count = 0
+
+		self._start_time = None
+		self._compressor = zlib.compressobj(9)
+		self._file = open(filename, 'wb')
+		self._file.write(HEADER.pack(MAGIC, FORMAT_VERSION, num_pixels))
+
+	@property
+	def is_full(self):
+		return self.max_frames is not None and self.frame_count >= self.max_frames
+
+	def record(self, timestamp, data):
+		'''
+		Record a frame.
+
+		Arguments:
+			timestamp (float) - time the frame was sent in seconds
+			data (list[ColorObject]) - the frame
+		'''
+		if self._file is None or self.is_full:
+			return
+
+		if self._start_time is None:
+			self._start_time = timestamp
+
+		pixels = bytearray(self.num_pixels * 3)
+		for i in range(0, self.num_pixels):
+			pixels[i*3] = data[i].r
+			pixels[i*3 + 1] = data[i].g
+			pixels[i*3 + 2] = data[i].b
+
+		self._file.write(self._compressor.compress(TIMESTAMP.pack(timestamp - self._start_time) + str(pixels)))
+		self.frame_count += 1
+
+	def close(self):
+		if self._file is not None:
+			self._file.write(self._compressor.flush())
+			self._file.close()
+			self._file = None
+
+def read_trace(filename):
+	'''
+	Read a trace file.
+
+	Raises:
+		InvalidTraceException
+
+	Returns:
+		tuple
+			num_pixels (int) - number of pixels in each frame
+			frames (list) - list of (timestamp, bytearray of r, g, b per pixel) tuples
+	'''
+	with open(filename, 'rb') as f:
+		header = f.read(HEADER.size)
+		body = f.read()
+
+	try:
+		magic, version, num_pixels = HEADER.unpack(header)
+	except struct.error:
+		raise InvalidTraceException('{} is too short to be a trace file'.format(filename))
+
+	if magic != MAGIC or version != FORMAT_VERSION:
+		raise InvalidTraceException('{} is not a version {} trace file'.format(filename, FORMAT_VERSION))
+
+	raw = zlib.decompress(body)
+	record_size = TIMESTAMP.size + num_pixels * 3
+	if len(raw) % record_size != 0:
+		raise InvalidTraceException('{} is truncated'.format(filename))
+
+	frames = []
+	for offset in range(0, len(raw), record_size):
+		timestamp = TIMESTAMP.unpack_from(raw, offset)[0]
+		frames.append((timestamp, bytearray(raw[offset + TIMESTAMP.size:offset + record_size])))
+
+	return num_pixels, frames
+
+def diff_traces(expected, actual):
+	'''
+	Compare two traces frame by frame.
+
+	Arguments:
+		expected (tuple) - (num_pixels, frames) as returned by read_trace
+		actual (tuple) - (num_pixels, frames) as returned by read_trace
+
+	Returns:
+		(dict) - summary of the differences
+	'''
+	expected_pixels, expected_frames = expected
+	actual_pixels, actual_frames = actual
+
+	summary = {
+		'expectedFrames': len(expected_frames),
+		'actualFrames': len(actual_frames),
+		'pixelCountMatches': expected_pixels == actual_pixels,
+		'mismatchedFrames': 0,
+		'firstMismatchedFrame': None,
+		'maxChannelError': 0,
+		'maxChannelErrorFrame': None,
+		'maxTimingDriftS': 0.0,
+		'finalTimingDriftS': 0.0
+	}
+
+	if not summary['pixelCountMatches']:
+		return summary
+
+	for i in range(0, min(len(expected_frames), len(actual_frames))):
+		expected_time, expected_data = expected_frames[i]
+		actual_time, actual_data = actual_frames[i]
+
+		drift = actual_time - expected_time
+		if abs(drift) > abs(summary['maxTimingDriftS']):
+			summary['maxTimingDriftS'] = drift
+		summary['finalTimingDriftS'] = drift
+
+		if expected_data != actual_data:
+			summary['mismatchedFrames'] += 1
+			if summary['firstMismatchedFrame'] is None:
+				summary['firstMismatchedFrame'] = i
+
+			error = max(abs(a - b) for a, b in zip(expected_data, actual_data))
+			if error > summary['maxChannelError']:
+				summary['maxChannelError'] = error
+				summary['maxChannelErrorFrame'] = i
+
+	return summary
+
+def traces_match(summary, max_drift_s=None):
+	'''
+	Returns boolean indicating if a diff summary shows the same frames.
+
+	Arguments:
+		summary (dict) - summary from diff_traces
+		(opt) max_drift_s (float) - largest tolerated timing drift. Timing is ignored if not provided.
+	'''
+	if not summary['pixelCountMatches'] or summary['expectedFrames'] != summary['actualFrames'] or summary['mismatchedFrames'] > 0:
+		return False
+
+	if max_drift_s is not None and abs(summary['maxTimingDriftS']) > max_drift_s:
+		return False
+
+	return True
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class InvalidTraceException(Exception):
+	pass
@@ -0,0 +1,133 @@
+import math
+
+from timeline import Timeline
+
+MIN_KELVIN = 1000
+MAX_KELVIN = 12000
+
+class KelvinTable(object):
+	'''
+	Lookup table from color temperature to RGB, computed once so a frame's color is found with a table lookup and a
+	linear interpolation rather than the logarithms and powers of the blackbody approximation.
+	'''
+
+	def __init__(self, min_kelvin=MIN_KELVIN, max_kelvin=MAX_KELVIN, step_kelvin=10):
+		'''
+		Build the table
+
+		Arguments:
+			(opt) min_kelvin (int) - lowest color temperature in the table
+			(opt) max_kelvin (int) - highest color temperature in the table
+			(opt) step_kelvin (int) - color temperature between entries
+		'''
+		self.min_kelvin = min_kelvin
+		self.max_kelvin = max_kelvin
+		self.step_kelvin = step_kelvin
+		self._colors = [blackbody_rgb(k) for k in range(min_kelvin, max_kelvin + step_kelvin, step_kelvin)]
+
+	def rgb(self, kelvin):
+		'''
+		Arguments:
+			kelvin (int/float) - color temperature. Clamped to the range of the table.
+
+		Returns:
+			tuple
+				red (float), green (float), blue (float) - color from 0 to 255 at full brightness
+		'''
+		position = (min(max(kelvin, self.min_kelvin), self.max_kelvin) - self.min_kelvin) / float(self.step_kelvin)
+		idx = min(int(position), len(self._colors) - 2)
+		weight = position - idx
+
+		low = self._colors[idx]
+		high = self._colors[idx + 1]
+		return (
+			low[0] + (high[0] - low[0]) * weight,
+			low[1] + (high[1] - low[1]) * weight,
+			low[2] + (high[2] - low[2]) * weight
+		)
+
+class KelvinTimeline(Timeline):
+	'''
+	Sunrise timeline that moves along a color temperature curve while the intensity rises. The temperature moves
+	evenly in mireds (1,000,000 / kelvin), which looks even to the eye, and the intensity eases in so the first
+	minutes stay dim. Like Timeline, each frame depends only on its index so the sunrise can be played from any point.
+	'''
+
+	def __init__(self, table, start_kelvin, end_kelvin, brightness_pct, ramp_frames, hold_frames, num_pixels):
+		'''
+		Compile a timeline
+
+		Arguments:
+			table (KelvinTable) - color temperature lookup table
+			start_kelvin (int) - color temperature at the start of the sunrise
+			end_kelvin (int) - color temperature at the end of the sunrise
+			brightness_pct (int) - intensity at the end of the sunrise, from 0 to 100
+			ramp_frames (int) - number of frames the sunrise takes
+			hold_frames (int) - number of frames the end color is held for afterwards
+			num_pixels (int) - number of pixels on the strip
+		'''
+		self.table = table
+		self.num_pixels = num_pixels
+		self.ramp_frames = max(1, ramp_frames)
+		self.frame_count = self.ramp_frames + hold_frames
+
+		self._start_mired = 1000000.0 / start_kelvin
+		self._end_mired = 1000000.0 / end_kelvin
+		self._brightness = brightness_pct / 100.0
+
+	def frame_at_index(self, index, exact=False):
+		'''
+		Get a frame of the timeline.
+
+		Arguments:
+			index (int) - frame index from 0 to frame_count - 1
+			(opt) exact (boolean) - return fractional colors rather than rounding them to whole levels, for dithering
+
+		Returns:
+			tuple
+				red (int/float), green (int/float), blue (int/float) - color of the lit pixels
+				pixel_count (int) - number of lit pixels
+		'''
+		fraction = min(float(index) / self.ramp_frames, 1.0)
+		mired = self._start_mired + (self._end_mired - self._start_mired) * fraction
+		scale = self._brightness * fraction * fraction
+
+		red, green, blue = self.table.rgb(1000000.0 / mired)
+		red, green, blue = red * scale, green * scale, blue * scale
+		if not exact:
+			red, green, blue = int(round(red)), int(round(green)), int(round(blue))
+
+		return red, green, blue, self.num_pixels
+
+def blackbody_rgb(kelvin):
+	'''
+	Approximate the color of a blackbody at a color temperature (Tanner Helland's fit to the CIE 1964 10 degree
+	color matching functions).
+
+	Arguments:
+		kelvin (int/float) - color temperature from 1000 to 40000
+
+	Returns:
+		tuple
+			red (float), green (float), blue (float) - color from 0 to 255
+	'''
+	temp = kelvin / 100.0
+
+	if temp <= 66:
+		red = 255.0
+		green = 99.4708025861 * math.log(temp) - 161.1195681661
+	else:
+		red = 329.698727446 * math.pow(temp - 60, -0.1332047592)
+		green = 288.1221695283 * math.pow(temp - 60, -0.0755148492)
+
+	if temp >= 66:
+		blue = 255.0
+	elif temp <= 19:
+		blue = 0.0
+	else:
+		blue = 138.5177312231 * math.log(temp - 10) - 305.0447927307
+
+	return tuple(min(max(x, 0.0), 255.0) for x in (red, green, blue))
+
+# built when the service starts, before the LED process is forked from it
+KELVIN_TABLE = KelvinTable()
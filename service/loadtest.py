@@ -0,0 +1,530 @@
+'''
+Load generator for the sunrise REST API.
+
+Drives concurrent clients against a service and reports throughput and latency percentiles per endpoint, along
+with the LED process's frame timing while under load, to check that API traffic doesn't disturb the frame cadence.
+Slow clients that trickle their requests a byte at a time can be added to show how each serving mode copes with
+clients on a bad Wi-Fi link.
+
+Clients send a named mix of traffic, picking each action at random by weight with a fixed seed so runs are
+repeatable:
+	app     - the app polling /programs, /timers and /time
+	colors  - color picker drags, each a quick burst of /programs/single_color requests
+	timers  - timer create, read, disable, enable and delete
+	mixed   - mostly polling with the occasional color drag and timer change
+	control-colors - the same color drags sent over the persistent control port (see control.py) instead of REST,
+	          to compare the two. --drag-interval 0 sends the colors back to back to measure throughput.
+
+With --launch the service is started for the run with a simulated strip, a temporary timers file and a crontab
+stand-in, so it can be run anywhere. Otherwise it runs against an already running service.
+
+Examples:
+	python loadtest.py --launch --serving-mode sync --mix mixed --clients 10 --duration 30
+	python loadtest.py --launch --serving-mode threaded --mix app --clients 10 --slow-clients 2 --baseline 10
+	python loadtest.py --host 192.168.1.20 --port 8081 --path /programs --path /timers
+	python loadtest.py --launch --mix control-colors --clients 1 --drag-interval 0
+'''
+import argparse
+import httplib
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_PATHS = ['/programs', '/timers', '/time']
+
+# run before the load starts so the frame timing is measured against a sunrise
+DEFAULT_PROGRAM = '/programs/wakeup?multiplier=30'
+
+# time between requests while a color picker is being dragged
+COLOR_DRAG_INTERVAL_S = 0.03
+
+# line that ends each control port reply, see control.py
+CONTROL_END_OF_REPLY = '@#$'
+
+class LatencyRecorder(object):
+	'''Thread-safe collection of request latencies grouped by endpoint'''
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self.latencies = {}
+		self.errors = {}
+
+	def record(self, endpoint, latency_s, ok=True):
+		with self._lock:
+			self.latencies.setdefault(endpoint, []).append(latency_s)
+			if not ok:
+				self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+	def summary(self, duration_s):
+		'''
+		Summarize the recorded latencies.
+
+		Arguments:
+			duration_s (float) - length of the run used to calculate throughput
+
+		Returns:
+			(dict) - per endpoint count, errors, requests per second and p50/p95/p99 latency in milliseconds
+		'''
+		with self._lock:
+			resp = {}
+			for endpoint, latencies in self.latencies.iteritems():
+				ordered = sorted(latencies)
+				resp[endpoint] = {
+					'count': len(ordered),
+					'errors': self.errors.get(endpoint, 0),
+					'rps': len(ordered) / duration_s,
+					'p50_ms': percentile(ordered, 50) * 1000.0,
+					'p95_ms': percentile(ordered, 95) * 1000.0,
+					'p99_ms': percentile(ordered, 99) * 1000.0
+				}
+
+			return resp
+
+def percentile(ordered, pct):
+	'''Nearest-rank percentile of an already sorted list'''
+	if not ordered:
+		return 0.0
+
+	rank = int(round(pct / 100.0 * len(ordered) + 0.5)) - 1
+	return ordered[max(0, min(rank, len(ordered) - 1))]
+
+class ApiClient(object):
+	'''Keep-alive connection to the service that records the latency of every request'''
+
+	def __init__(self, host, port, recorder, timeout_s=30):
+		self.host = host
+		self.port = port
+		self.recorder = recorder
+		self.timeout_s = timeout_s
+		self._conn = httplib.HTTPConnection(host, port, timeout=timeout_s)
+
+	def request(self, method, path, body=None, endpoint=None):
+		'''
+		Send a request.
+
+		Arguments:
+			method (string) - HTTP method
+			path (string) - path including any query string
+			(opt) body (dict) - JSON body
+			(opt) endpoint (string) - name the latency is recorded under. Defaults to the path without its query string.
+
+		Returns:
+			tuple
+				status (int) - HTTP status code, or None if the request failed
+				payload (dict) - decoded JSON response, or None
+		'''
+		if endpoint is None:
+			endpoint = path.split('?')[0]
+		endpoint = '{} {}'.format(method, endpoint)
+
+		headers = {}
+		encoded_body = None
+		if body is not None:
+			encoded_body = json.dumps(body)
+			headers['Content-Type'] = 'application/json'
+
+		start = time.time()
+		try:
+			self._conn.request(method, path, encoded_body, headers)
+			resp = self._conn.getresponse()
+			data = resp.read()
+			self.recorder.record(endpoint, time.time() - start, resp.status < 500)
+
+		except (httplib.HTTPException, socket.error):
+			self.recorder.record(endpoint, time.time() - start, False)
+			self.close()
+			self._conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout_s)
+			return None, None
+
+		try:
+			return resp.status, json.loads(data) if data else None
+		except ValueError:
+			return resp.status, None
+
+	def close(self):
+		self._conn.close()
+
+class ControlClient(object):
+	'''Persistent connection to the service's control port that records the latency of every command'''
+
+	def __init__(self, host, port, recorder, timeout_s=30):
+		self.host = host
+		self.port = port
+		self.recorder = recorder
+		self.timeout_s = timeout_s
+		self._sock = None
+		self._file = None
+
+	def command(self, line, endpoint=None):
+		'''
+		Send a command and wait for its reply.
+
+		Arguments:
+			line (string) - command without its line ending
+			(opt) endpoint (string) - name the latency is recorded under. Defaults to the command name.
+
+		Returns:
+			(string) - reply line, or None if the command failed
+		'''
+		if endpoint is None:
+			endpoint = 'control {}'.format(line.split()[0])
+
+		start = time.time()
+		try:
+			if self._sock is None:
+				self._sock = socket.create_connection((self.host, self.port), self.timeout_s)
+				self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+				self._file = self._sock.makefile('rb')
+
+			self._sock.sendall(line + '\n')
+			reply = self._file.readline().rstrip('\n')
+			end_of_reply = self._file.readline().rstrip('\n')
+			if end_of_reply != CONTROL_END_OF_REPLY:
+				raise socket.error('connection closed')
+
+			self.recorder.record(endpoint, time.time() - start, reply.startswith('ok'))
+			return reply
+
+		except socket.error:
+			self.recorder.record(endpoint, time.time() - start, False)
+			self.close()
+			return None
+
+	def close(self):
+		if self._sock is not None:
+			self._file.close()
+			self._sock.close()
+			self._sock = None
+
+#################### TRAFFIC MIXES #########################
+def poll_programs(client, rng):
+	client.request('GET', '/programs')
+
+def poll_timers(client, rng):
+	client.request('GET', '/timers')
+
+def poll_time(client, rng):
+	client.request('GET', '/time')
+
+def drag_colors(rng):
+	'''Colors a color picker passes through while being dragged, as a list of (red, green, blue)'''
+	red, green, blue = rng.randint(0, 255), rng.randint(0, 255), rng.randint(0, 255)
+	colors = []
+	for i in range(rng.randint(10, 40)):
+		red = max(0, min(255, red + rng.randint(-8, 8)))
+		green = max(0, min(255, green + rng.randint(-8, 8)))
+		blue = max(0, min(255, blue + rng.randint(-8, 8)))
+		colors.append((red, green, blue))
+
+	return colors
+
+def color_drag(client, rng):
+	'''A color picker being dragged, sending a new color every few tens of milliseconds'''
+	for red, green, blue in drag_colors(rng):
+		client.request('GET', '/programs/single_color?red={}&green={}&blue={}'.format(red, green, blue))
+		if COLOR_DRAG_INTERVAL_S > 0:
+			time.sleep(COLOR_DRAG_INTERVAL_S)
+
+def control_color_drag(client, rng):
+	'''The same color picker drag sent over the control port'''
+	for red, green, blue in drag_colors(rng):
+		client.command('color {} {} {}'.format(red, green, blue))
+		if COLOR_DRAG_INTERVAL_S > 0:
+			time.sleep(COLOR_DRAG_INTERVAL_S)
+
+def timer_crud(client, rng):
+	'''Create a timer, read it, toggle it and delete it again'''
+	timer_id = 'loadtest-{}'.format(rng.randint(0, 10**9))
+	timer = {
+		'timerId': timer_id,
+		'triggerHour': rng.randint(0, 23),
+		'triggerMinute': rng.randint(0, 59),
+		'timerSchedule': rng.sample(['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat'], rng.randint(1, 7)),
+		'programToLaunch': 'wakeup',
+		'isEnabled': True,
+		'arguments': {'multiplier': 30}
+	}
+	client.request('POST', '/timers', timer)
+	client.request('GET', '/timers/{}'.format(timer_id), endpoint='/timers/<id>')
+	client.request('GET', '/timers/{}/disable'.format(timer_id), endpoint='/timers/<id>/disable')
+	client.request('GET', '/timers/{}/enable'.format(timer_id), endpoint='/timers/<id>/enable')
+	client.request('DELETE', '/timers/{}'.format(timer_id), endpoint='/timers/<id>')
+
+# name -> list of (weight, action)
+MIXES = {
+	'app': [(4, poll_programs), (4, poll_timers), (1, poll_time)],
+	'colors': [(1, color_drag)],
+	'timers': [(1, timer_crud)],
+	'mixed': [(8, poll_programs), (8, poll_timers), (2, poll_time), (1, color_drag), (1, timer_crud)],
+	'control-colors': [(1, control_color_drag)]
+}
+
+# mixes sent over the control port rather than the REST API
+CONTROL_MIXES = ['control-colors']
+
+def path_mix(paths):
+	'''Mix that requests each of a list of paths with equal weight'''
+	def get_path(path):
+		return lambda client, rng: client.request('GET', path)
+
+	return [(1, get_path(path)) for path in paths]
+
+def choose_action(mix, rng):
+	total = sum(weight for weight, action in mix)
+	pick = rng.uniform(0, total)
+	for weight, action in mix:
+		pick -= weight
+		if pick <= 0:
+			return action
+
+	return mix[-1][1]
+
+def client_loop(host, port, mix, recorder, stop_event, seed, think_s, timeout_s, control_port=None):
+	'''Run actions from a mix over a keep-alive connection (to the control port if given) until told to stop'''
+	rng = random.Random(seed)
+	if control_port is None:
+		client = ApiClient(host, port, recorder, timeout_s)
+	else:
+		client = ControlClient(host, control_port, recorder, timeout_s)
+	while not stop_event.is_set():
+		choose_action(mix, rng)(client, rng)
+		if think_s > 0:
+			stop_event.wait(think_s)
+
+	client.close()
+
+def slow_client_loop(host, port, stop_event, byte_interval_s):
+	'''Hold a connection open by sending a request one byte at a time'''
+	request_bytes = 'GET /programs HTTP/1.1\r\nHost: {}\r\n\r\n'.format(host)
+	while not stop_event.is_set():
+		try:
+			sock = socket.create_connection((host, port))
+			for byte in request_bytes:
+				if stop_event.is_set():
+					break
+				sock.send(byte)
+				time.sleep(byte_interval_s)
+			sock.close()
+		except socket.error:
+			time.sleep(byte_interval_s)
+
+def run_load(host, port, mix, clients, slow_clients, duration_s, byte_interval_s=0.5, timeout_s=30, think_s=0, seed=0, control_port=None):
+	'''
+	Run a load test against a service.
+
+	Arguments:
+		mix (list) - list of (weight, action) the clients pick from, e.g. one of MIXES
+		(opt) think_s (float) - pause between each client's actions
+		(opt) seed (int) - seed for the clients' random choices. Client i uses seed + i.
+		(opt) control_port (int) - send the mix to the control port instead, for the mixes in CONTROL_MIXES
+
+	Returns:
+		(dict) - per endpoint summary from LatencyRecorder.summary
+	'''
+	recorder = LatencyRecorder()
+	stop_event = threading.Event()
+
+	threads = [threading.Thread(target=client_loop, args=(host, port, mix, recorder, stop_event, seed + i, think_s, timeout_s, control_port)) for i in range(clients)]
+	threads += [threading.Thread(target=slow_client_loop, args=(host, port, stop_event, byte_interval_s)) for i in range(slow_clients)]
+	for t in threads:
+		t.daemon = True
+		t.start()
+
+	time.sleep(duration_s)
+	stop_event.set()
+	for t in threads:
+		t.join(timeout_s)
+
+	return recorder.summary(duration_s)
+
+def fetch_frame_timing(host, port, since):
+	'''
+	Returns:
+		(dict) - the LED process's frame timing since a given time, as reported by /status
+	'''
+	conn = httplib.HTTPConnection(host, port, timeout=30)
+	try:
+		conn.request('GET', '/status?framesSince={}'.format(since))
+		return json.loads(conn.getresponse().read())['renderer']['frameTiming']
+	finally:
+		conn.close()
+
+def send_request(host, port, path):
+	conn = httplib.HTTPConnection(host, port, timeout=30)
+	try:
+		conn.request('GET', path)
+		return conn.getresponse().status
+	finally:
+		conn.close()
+
+class LaunchedService(object):
+	'''
+	The service run under gunicorn for a load test, with a simulated strip, a temporary timers file and a crontab
+	stand-in, all in a temporary directory that is removed when it stops.
+	'''
+
+	# stands in for crontab(1): 'crontab [-u user] -l' prints the saved table and 'crontab [-u user] file' replaces it
+	CRONTAB_STAND_IN = '\n'.join([
+		'#!/bin/sh',
+		'TABLE="$(dirname "$0")/crontab.txt"',
+		'for arg in "$@"; do LAST="$arg"; done',
+		'case " $* " in',
+		'	*" -l "*) cat "$TABLE" 2>/dev/null ;;',
+		'	*) cp "$LAST" "$TABLE" ;;',
+		'esac',
+		''
+	])
+
+	def __init__(self, port, serving_mode, threads=8, control_port=0):
+		'''
+		Arguments:
+			port (int) - port to serve on
+			serving_mode (string) - 'sync' or 'threaded' (see serving.ServingMode)
+			(opt) threads (int) - request threads in threaded mode
+			(opt) control_port (int) - port for the control channel. 0 turns it off.
+		'''
+		self.port = port
+		self.control_port = control_port
+		self.serving_mode = serving_mode
+		self.threads = threads
+		self.work_dir = None
+		self.process = None
+
+	def start(self, ready_timeout_s=30):
+		self.work_dir = tempfile.mkdtemp(prefix='sunrise-loadtest-')
+		run_dir = os.path.join(self.work_dir, 'svc')
+		os.mkdir(run_dir)
+		# the service logs to ../logs relative to where it runs
+		os.mkdir(os.path.join(self.work_dir, 'logs'))
+
+		with open(os.path.join(run_dir, 'timers.json'), 'w') as f:
+			f.write('{}')
+
+		crontab_command = os.path.join(self.work_dir, 'crontab')
+		with open(crontab_command, 'w') as f:
+			f.write(self.CRONTAB_STAND_IN)
+		os.chmod(crontab_command, 0755)
+
+		service_dir = os.path.dirname(os.path.abspath(__file__))
+		env = dict(os.environ)
+		env['PYTHONPATH'] = os.pathsep.join([service_dir] + [x for x in [env.get('PYTHONPATH')] if x])
+		env['SUNRISE_STRIP_BACKEND'] = 'simulated'
+		env['SUNRISE_SERVING_MODE'] = self.serving_mode
+		env['SUNRISE_CRONTAB_COMMAND'] = crontab_command
+		env['SUNRISE_CONTROL_PORT'] = str(self.control_port)
+
+		args = [sys.executable, '-m', 'gunicorn.app.wsgiapp', '-w', '1', '-b', '127.0.0.1:{}'.format(self.port)]
+		if self.serving_mode == 'threaded':
+			args += ['-k', 'gthread', '--threads', str(self.threads)]
+		args.append('sunrise:app')
+
+		self.log_file = open(os.path.join(self.work_dir, 'logs', 'gunicorn.log'), 'w')
+		self.process = subprocess.Popen(args, cwd=run_dir, env=env, stdout=self.log_file, stderr=subprocess.STDOUT)
+
+		deadline = time.time() + ready_timeout_s
+		while time.time() < deadline:
+			if self.process.poll() is not None:
+				raise ServiceLaunchException('Service exited with code {}. See {}'.format(self.process.returncode, self.log_file.name))
+			try:
+				if send_request('127.0.0.1', self.port, '/time') == 200:
+					return
+			except (httplib.HTTPException, socket.error):
+				pass
+			time.sleep(.2)
+
+		self.stop()
+		raise ServiceLaunchException('Service did not respond within {} seconds'.format(ready_timeout_s))
+
+	def stop(self, timeout_s=10):
+		if self.process is not None and self.process.poll() is None:
+			self.process.send_signal(signal.SIGTERM)
+			deadline = time.time() + timeout_s
+			while self.process.poll() is None and time.time() < deadline:
+				time.sleep(.05)
+			if self.process.poll() is None:
+				self.process.kill()
+				self.process.wait()
+
+		if self.work_dir is not None:
+			self.log_file.close()
+			shutil.rmtree(self.work_dir, ignore_errors=True)
+			self.work_dir = None
+
+def print_summary(summary):
+	print('{:<40} {:>8} {:>7} {:>9} {:>9} {:>9} {:>9}'.format('endpoint', 'count', 'errors', 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+	for endpoint in sorted(summary):
+		s = summary[endpoint]
+		print('{:<40} {:>8} {:>7} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(endpoint, s['count'], s['errors'], s['rps'], s['p50_ms'], s['p95_ms'], s['p99_ms']))
+
+def print_frame_timing(label, timing):
+	if timing.get('frames', 0) < 2:
+		print('{:<12} {} frames'.format(label, timing.get('frames', 0)))
+		return
+
+	print('{:<12} {:>6} frames  mean interval {:>6.1f} ms  jitter p50 {:>6.1f}  p95 {:>6.1f}  p99 {:>6.1f}  max {:>6.1f} ms  late {}'.format(
+		label, timing['frames'], timing['meanIntervalMs'], timing['jitterP50Ms'], timing['jitterP95Ms'], timing['jitterP99Ms'], timing['jitterMaxMs'], timing['lateFrames']))
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class ServiceLaunchException(Exception):
+	pass
+
+
+if __name__ == '__main__':
+	arg_parser = argparse.ArgumentParser(description='Load test the sunrise REST API')
+	arg_parser.add_argument('--host', default='localhost')
+	arg_parser.add_argument('--port', type=int, default=8081)
+	arg_parser.add_argument('--launch', action='store_true', help='start the service for the run with a simulated strip, temporary timers file and crontab stand-in')
+	arg_parser.add_argument('--serving-mode', default='sync', choices=['sync', 'threaded'], help='serving mode of a launched service')
+	arg_parser.add_argument('--clients', type=int, default=10, help='number of concurrent keep-alive clients')
+	arg_parser.add_argument('--slow-clients', type=int, default=0, help='number of clients trickling their requests')
+	arg_parser.add_argument('--duration', type=float, default=30, help='length of the run in seconds')
+	arg_parser.add_argument('--mix', default='app', choices=sorted(MIXES), help='traffic mix the clients send')
+	arg_parser.add_argument('--path', action='append', dest='paths', help='endpoint to GET instead of a mix (repeatable)')
+	arg_parser.add_argument('--think', type=float, default=0, help='pause in seconds between each client\'s actions')
+	arg_parser.add_argument('--seed', type=int, default=0, help='seed for the clients\' random choices')
+	arg_parser.add_argument('--program', default=DEFAULT_PROGRAM, help='program request sent before the run so frame timing is measured against it')
+	arg_parser.add_argument('--baseline', type=float, default=0, help='seconds of frame timing to measure with no load before the run')
+	arg_parser.add_argument('--control-port', type=int, default=8082, help='control port the control-colors mix is sent to')
+	arg_parser.add_argument('--drag-interval', type=float, default=COLOR_DRAG_INTERVAL_S, help='seconds between the colors of a color drag')
+	args = arg_parser.parse_args()
+	COLOR_DRAG_INTERVAL_S = args.drag_interval
+
+	service = None
+	if args.launch:
+		args.host = '127.0.0.1'
+		service = LaunchedService(args.port, args.serving_mode, control_port=args.control_port)
+		service.start()
+
+	try:
+		if args.program:
+			send_request(args.host, args.port, args.program)
+
+		if args.baseline > 0:
+			baseline_start = time.time()
+			time.sleep(args.baseline)
+			baseline_timing = fetch_frame_timing(args.host, args.port, baseline_start)
+
+		mix = path_mix(args.paths) if args.paths else MIXES[args.mix]
+		load_start = time.time()
+		control_port = args.control_port if args.mix in CONTROL_MIXES and not args.paths else None
+		summary = run_load(args.host, args.port, mix, args.clients, args.slow_clients, args.duration, think_s=args.think, seed=args.seed, control_port=control_port)
+		load_timing = fetch_frame_timing(args.host, args.port, load_start)
+
+		print_summary(summary)
+		print('')
+		if args.baseline > 0:
+			print_frame_timing('idle', baseline_timing)
+		print_frame_timing('under load', load_timing)
+
+	finally:
+		if service is not None:
+			service.stop()
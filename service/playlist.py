@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+
+from programs import ProgramList
+from timer import write_file_atomically
+
+class Playlists(object):
+	'''Object defining the collection of saved playlists'''
+
+	# serializes reads and read-modify-write cycles on the playlist file when requests are served from several threads
+	_store_lock = threading.RLock()
+
+	def __init__(self, logger, playlist_file):
+		self.logger = logger
+		self.playlist_file = playlist_file
+
+	def add_or_modify_playlist(self, playlist):
+		with self._store_lock:
+			playlist_dict = self.read_playlists_from_file()
+			playlist_dict[playlist.playlist_id] = playlist
+			self.write_playlists_to_file(playlist_dict)
+
+		return playlist
+
+	def delete_playlist(self, playlist_id):
+		with self._store_lock:
+			playlist_dict = self.read_playlists_from_file()
+			if playlist_id not in playlist_dict:
+				raise PlaylistNotFound()
+
+			playlist_dict.pop(playlist_id)
+			self.write_playlists_to_file(playlist_dict)
+
+	def read_playlists_from_file(self):
+		'''
+		Read playlists from the playlist file into a dictionary
+
+		Returns:
+			playlist_dict (dict) - dictionary of playlists. Empty if none have been saved yet.
+		'''
+		with self._store_lock:
+			if not os.path.exists(self.playlist_file):
+				return {}
+
+			with open(self.playlist_file, 'r') as f:
+				playlist_dict = json.loads(f.read())
+
+		for playlist_id in playlist_dict.iterkeys():
+			playlist_dict[playlist_id] = Playlist.from_json(playlist_dict[playlist_id])
+
+		return playlist_dict
+
+	def write_playlists_to_file(self, playlist_dict):
+		'''
+		Write all playlists to the playlist file.
+
+		Arguments:
+			playlist_dict (dict) - dictionary of playlists
+		'''
+		for playlist_id in playlist_dict.iterkeys():
+			playlist_dict[playlist_id] = playlist_dict[playlist_id].to_json()
+
+		write_file_atomically(self.playlist_file, json.dumps(playlist_dict, indent=4))
+
+	def get_playlist_by_id(self, playlist_id):
+		'''
+		Get a specific playlist from the playlist file based on playlist_id.
+
+		Arguments:
+			playlist_id (string) - id of the desired playlist
+
+		Raises:
+			PlaylistNotFound
+
+		Returns:
+			Playlist object for the desired playlist
+		'''
+		try:
+			return self.read_playlists_from_file()[playlist_id]
+
+		except KeyError:
+			raise PlaylistNotFound()
+
+
+class Playlist(object):
+	'''
+	Object defining a playlist: programs the LED process runs back to back, each for a set time, e.g. a wakeup
+	followed by warm white for 20 minutes and then blackout.
+	'''
+
+	def __init__(self, playlist_id, steps, loop=False):
+		'''
+		Initialize a playlist object.
+
+		Arguments:
+			playlist_id (string) - ID/name of the playlist
+			steps (list) - list of dicts with 'program' (name of the program to run), optional 'arguments' (dictionary
+				of URL parameter arguments, as for GET /programs/<program>) and 'durationS' (seconds to run it for).
+				Timeline programs run to their end if durationS is left out. Other programs need one, other than the
+				last step of a playlist that doesn't loop, which then runs until another program is requested.
+			(opt) loop (boolean) - start again from the first step after the last one
+
+		Raises:
+			InvalidPlaylistException
+		'''
+		self.playlist_id = playlist_id
+		self.loop = bool(loop)
+
+		if not isinstance(steps, list) or not steps:
+			raise InvalidPlaylistException("steps must be a list of at least one program")
+
+		self.steps = []
+		for i, step in enumerate(steps):
+			if not isinstance(step, dict):
+				raise InvalidPlaylistException("step {} must be a dictionary with a program".format(i))
+
+			program = step.get('program')
+			if program not in ProgramList.valid_programs or program == 'playlist':
+				raise InvalidPlaylistException("step {}: {} is not a valid program for a playlist".format(i, program))
+
+			arguments = step.get('arguments')
+			if arguments is not None and not isinstance(arguments, dict):
+				raise InvalidPlaylistException("step {}: arguments must be key/value pairs".format(i))
+
+			duration_s = step.get('durationS')
+			if duration_s is not None:
+				if isinstance(duration_s, bool) or not isinstance(duration_s, (int, long, float)) or duration_s <= 0:
+					raise InvalidPlaylistException("step {}: durationS must be a number of seconds greater than 0".format(i))
+
+			elif program not in ProgramList.timeline_programs and program != 'wakeup_demo' and (self.loop or i < len(steps) - 1):
+				raise InvalidPlaylistException("step {}: {} needs a durationS, since it doesn't end by itself".format(i, program))
+
+			self.steps.append({'program': program, 'arguments': arguments, 'durationS': duration_s})
+
+	@classmethod
+	def from_json(cls, json_dict):
+		'''
+		Instantiate playlist object from the json representation.
+
+		Arguments:
+			json_dict (dict) - dictionary representation of the playlist
+
+		Returns:
+			(Playlist) - playlist object from the provided data
+		'''
+		return Playlist(json_dict['playlistId'], json_dict['steps'], json_dict.get('loop', False))
+
+	def to_json(self):
+		'''
+		Output the json format of the playlist, used both for storage and for showing to client
+
+		Returns:
+			(dict) - dict for storage as json
+		'''
+		return {
+			'playlistId': self.playlist_id,
+			'steps': self.steps,
+			'loop': self.loop
+		}
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class PlaylistNotFound(Exception):
+	pass
+
+class InvalidPlaylistException(Exception):
+	pass
@@ -0,0 +1,87 @@
+import multiprocessing
+
+class PowerLimiter(object):
+	'''
+	Estimates the current each frame draws from the supply and, when it would exceed a budget, scales the whole frame
+	down by the same factor so it fits, keeping its colors and fades intact. Longer strips can then run on a supply
+	that couldn't light every pixel at full white.
+
+	The model is linear, like the LEDs: each channel draws ma_per_channel at level 255 and proportionally less below
+	it, and each pixel's driver chip draws idle_ma_per_pixel even when dark. The estimate and limit are kept in
+	shared memory so the service can report them.
+	'''
+
+	def __init__(self, num_pixels, ma_per_channel=20.0, idle_ma_per_pixel=1.0, budget_ma=0):
+		'''
+		Initialize the limiter. Must be created before the LED process is started.
+
+		Arguments:
+			num_pixels (int) - number of pixels on the strip
+			(opt) ma_per_channel (float) - current one color channel of a pixel draws at full level, in mA
+			(opt) idle_ma_per_pixel (float) - current a dark pixel draws, in mA
+			(opt) budget_ma (int/float) - most current the strip may draw, in mA. 0 only estimates.
+		'''
+		self.num_pixels = num_pixels
+		self.ma_per_channel = ma_per_channel
+		self.idle_ma_per_pixel = idle_ma_per_pixel
+		self.budget_ma = budget_ma
+
+		self._ma_per_level = ma_per_channel / 255.0
+		self._idle_ma = idle_ma_per_pixel * num_pixels
+
+		# estimated draw of the last frame as the program computed it, and as it was sent after limiting
+		self.estimated_ma = multiprocessing.Value('d', 0.0, lock=False)
+		self.limited_ma = multiprocessing.Value('d', 0.0, lock=False)
+		self.peak_estimated_ma = multiprocessing.Value('d', 0.0, lock=False)
+
+		# program frames checked, and those scaled down to fit the budget
+		self.frames = multiprocessing.Value('l', 0, lock=False)
+		self.limited_frames = multiprocessing.Value('l', 0, lock=False)
+
+		# color objects of the last frame estimated and the sum of their levels. Programs holding a color send the same
+		# objects every frame, so their sum is only computed once.
+		self._last_frame = []
+		self._level_sum = 0.0
+
+	def limit(self, data, brightness=1.0):
+		'''
+		Estimate a frame's draw and find the scale that keeps it within the budget. Only called from the LED process.
+
+		Arguments:
+			data (list[ColorObject]) - frame with color values from 0 to 255
+			(opt) brightness (float) - global brightness the frame is sent at, from 0 to 1
+
+		Returns:
+			(float) - factor from 0 to 1 to scale the frame by
+		'''
+		# programs replace color objects rather than modifying them, so comparing the objects (by identity, since they
+		# don't define equality) is enough to tell the frame hasn't changed
+		if data != self._last_frame:
+			self._last_frame = list(data)
+			self._level_sum = sum([x.r + x.g + x.b for x in data])
+
+		estimated_ma = self._idle_ma + self._level_sum * brightness * self._ma_per_level
+
+		scale = 1.0
+		if self.budget_ma and estimated_ma > self.budget_ma:
+			scale = max(0.0, (self.budget_ma - self._idle_ma) / (estimated_ma - self._idle_ma))
+			self.limited_frames.value += 1
+
+		self.estimated_ma.value = estimated_ma
+		self.limited_ma.value = self._idle_ma + (estimated_ma - self._idle_ma) * scale
+		self.peak_estimated_ma.value = max(self.peak_estimated_ma.value, estimated_ma)
+		self.frames.value += 1
+
+		return scale
+
+	def to_json(self):
+		return {
+			"budgetMa": self.budget_ma,
+			"maPerChannel": self.ma_per_channel,
+			"idleMaPerPixel": self.idle_ma_per_pixel,
+			"estimatedMa": round(self.estimated_ma.value, 1),
+			"limitedMa": round(self.limited_ma.value, 1),
+			"peakEstimatedMa": round(self.peak_estimated_ma.value, 1),
+			"frames": self.frames.value,
+			"limitedFrames": self.limited_frames.value
+		}
@@ -0,0 +1,139 @@
+from collections import OrderedDict
+import struct
+import threading
+import zlib
+
+from programs import compile_timeline
+from timeline import FRAME_INTERVAL_S
+
+class PreviewFormat(object):
+	json = 'json'
+	png = 'png'
+
+	all = [json, png]
+
+class TimelinePreviews(object):
+	'''
+	Renders downsampled previews of timeline programs, e.g. to show what a wakeup with a given multiplier looks like
+	before a timer is saved. Only the sampled frames are computed, since any frame of a timeline can be found from its
+	index, so a preview costs the same for a 1 minute and a 60 minute program. Nothing is sent to the strip and it
+	runs in the web worker, so the LED process's frame loop isn't disturbed.
+
+	Previews are kept in a small least recently used cache, so the app asking for the same one again is answered
+	straight from memory. It is safe to use from several request threads.
+	'''
+
+	def __init__(self, num_pixels, cache_size=32):
+		'''
+		Arguments:
+			num_pixels (int) - number of pixels on the strip
+			(opt) cache_size (int) - number of previews kept
+		'''
+		self.num_pixels = num_pixels
+		self.cache_size = cache_size
+		self._cache = OrderedDict()
+		self._lock = threading.Lock()
+
+	def get(self, program, arg_dict, samples, preview_format=PreviewFormat.json, height=1):
+		'''
+		Get a preview of a program.
+
+		Arguments:
+			program (string) - one of ProgramList.timeline_programs
+			arg_dict (dict) - program arguments, as sent to the LED process
+			samples (int) - number of frames to sample, evenly spread over the program. Fewer are returned if the
+				program has fewer frames.
+			(opt) preview_format (string) - one of PreviewFormat.all
+			(opt) height (int) - rows of the PNG. Each row shows a stretch of the strip, so the rows lit show how
+				many pixels the program lights.
+
+		Returns:
+			(dict) - JSON preview for PreviewFormat.json
+			(string) - PNG image for PreviewFormat.png
+		'''
+		key = (program, tuple(sorted((k, v) for k, v in arg_dict.iteritems() if k != 'start_time')), samples, preview_format, height)
+		with self._lock:
+			if key in self._cache:
+				value = self._cache.pop(key)
+				self._cache[key] = value
+				return value
+
+		frames, duration_s = self._sample_frames(program, arg_dict, samples)
+		if preview_format == PreviewFormat.png:
+			value = self._render_png(frames, height)
+		else:
+			value = {
+				"program": program,
+				"durationS": round(duration_s, 1),
+				"numPixels": self.num_pixels,
+				"samples": [{"offsetS": round(offset_s, 1), "red": r, "green": g, "blue": b, "pixelCount": count} for offset_s, r, g, b, count in frames]
+			}
+
+		with self._lock:
+			self._cache[key] = value
+			while len(self._cache) > self.cache_size:
+				self._cache.popitem(last=False)
+
+		return value
+
+	def _sample_frames(self, program, arg_dict, samples):
+		'''
+		Returns:
+			tuple
+				frames (list) - (offset s, red, green, blue, pixel count) of each sampled frame
+				duration_s (float) - length of the program
+		'''
+		timeline = compile_timeline(program, self.num_pixels, arg_dict)
+		last_index = timeline.frame_count - 1
+		samples = min(samples, timeline.frame_count)
+
+		frames = []
+		for i in range(samples):
+			index = int(round(i * last_index / float(samples - 1))) if samples > 1 else 0
+			red, green, blue, pixel_count = timeline.frame_at_index(index)
+			frames.append((index * FRAME_INTERVAL_S, int(red), int(green), int(blue), min(max(int(pixel_count), 0), self.num_pixels)))
+
+		return frames, timeline.duration_s
+
+	def _render_png(self, frames, height):
+		'''
+		Draw sampled frames as an image with a column per frame, going from the start of the program on the left to
+		its end on the right. A row is lit if the first pixel of the stretch of strip it shows is lit.
+		'''
+		if not frames:
+			# a program with no frames, e.g. with a multiplier of 0, shows as a single dark column
+			frames = [(0.0, 0, 0, 0, 0)]
+
+		rows = []
+		for row in range(height):
+			first_pixel = row * self.num_pixels / height
+			line = bytearray()
+			for offset_s, red, green, blue, pixel_count in frames:
+				line.extend((red, green, blue) if first_pixel < pixel_count else (0, 0, 0))
+			rows.append(line)
+
+		return encode_png(len(frames), height, rows)
+
+def encode_png(width, height, rows):
+	'''
+	Encode an 8 bit RGB image as a PNG.
+
+	Arguments:
+		width (int) - image width in pixels
+		height (int) - image height in pixels
+		rows (list[bytearray]) - red, green and blue bytes of each pixel, one row at a time from the top
+
+	Returns:
+		(string) - PNG file contents
+	'''
+	def chunk(chunk_type, data):
+		return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data) & 0xffffffff)
+
+	# each row starts with filter type 0 (none)
+	raw = ''.join('\x00' + str(row) for row in rows)
+	return ''.join([
+		'\x89PNG\r\n\x1a\n',
+		chunk('IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)),
+		chunk('IDAT', zlib.compress(raw, 9)),
+		chunk('IEND', '')
+	])
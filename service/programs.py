@@ -1,14 +1,85 @@
-from time import sleep
+from time import time
+import gc
 import multiprocessing
-from Queue import Empty, Full
+import os
+import signal
+from Queue import Empty, Queue
 import random
+import threading
 
-import rpi_ws281x as rpi
+from clock import SystemClock
+from dither import TemporalDither
+from forksafe import reset_logging_locks
+from framering import RenderWorker
+from kelvin import KelvinTimeline, KELVIN_TABLE
+from strips import StripBackend, create_strip
+from timeline import Timeline, FRAME_INTERVAL_S
+
+# largest garbage collection threshold, so that generation is never collected automatically
+NEVER_COLLECT_THRESHOLD = 2**31 - 1
 
 class ProgramList(object):
-	valid_programs = ["wakeup", "wakeup_demo", "single_color", "changing_color", "blackout", "sleepy_time"]
+	valid_programs = ["wakeup", "wakeup_demo", "kelvin_sunrise", "single_color", "changing_color", "blackout", "sleepy_time", "playlist"]
+	
+	# programs played from a deterministic timeline, which accept a start_time for synchronized or resumed playback
+	timeline_programs = ["wakeup", "kelvin_sunrise", "sleepy_time"]
+	
+	# programs locked to a start_time: the timeline programs, and playlists, whose steps start at set times after it
+	clocked_programs = timeline_programs + ["playlist"]
 	current_program_filename = 'current_program.txt'
 
+# frames per minute of multiplier, used for the wakeup program and changing_color program
+BASE_MULTIPLIER = 60
+
+# r, g, b, led pct, transition time ratio from this to next
+WAKEUP_SEQUENCE = [
+	(0,0,0,10,1),	# black
+	(0,0,10,15,1),	# dark blue
+	(2,0,15,20,1),	# purple
+	(7,0,10,25,1),	# reddish purple
+	(20,1,0,30,1),	# blood orange
+	(50,6,0,40,1),	# orange
+	(70,15,0,50,1),	# yellow
+	(70,15,2,60,2),	# warm white
+	(255,200,100,100,5), # white
+	(255,200,100,100,0)	# white
+]
+
+SLEEPY_TIME_SEQUENCE = [
+	(128,0,0,100,1),
+	(0,0,0,100,0)
+]
+
+def compile_timeline(program, num_pixels, arg_dict=None):
+	'''
+	Compile the timeline a timeline program plays. Shared by the programs themselves and anything that needs their
+	frames without running them, like previews.
+	
+	Arguments:
+		program (string) - one of ProgramList.timeline_programs
+		num_pixels (int) - number of pixels on the strip
+		(opt) arg_dict (dict) - program arguments. start_time is ignored, since it only sets where playback starts.
+	
+	Returns:
+		(Timeline) - the program's frames
+	'''
+	arg_dict = dict(arg_dict or {})
+	arg_dict.pop('start_time', None)
+	
+	if program == 'wakeup':
+		return Timeline.from_program_sequence(WAKEUP_SEQUENCE, arg_dict.get('multiplier', 30), BASE_MULTIPLIER, num_pixels)
+	
+	elif program == 'sleepy_time':
+		return Timeline.from_program_sequence(SLEEPY_TIME_SEQUENCE, arg_dict.get('multiplier', 5), 600, num_pixels)
+	
+	elif program == 'kelvin_sunrise':
+		ramp_frames = int(arg_dict.get('multiplier', 30) * 60 / FRAME_INTERVAL_S)
+		
+		# hold the end color for the same share of the program as the wakeup program holds white
+		return KelvinTimeline(KELVIN_TABLE, arg_dict.get('start_kelvin', 1800), arg_dict.get('end_kelvin', 6500), arg_dict.get('brightness_pct', 100), ramp_frames, ramp_frames * 5 / 8, num_pixels)
+	
+	raise ValueError('{} is not a timeline program'.format(program))
+
 class ColorObject(object):
 	'''Object for defining RGB color'''
 	def __init__(self, r, g, b):
@@ -18,48 +89,312 @@ class ColorObject(object):
 		
 class ProgramTask(object):
 	'''Object for defining a program to run'''
-	def __init__(self, program, arg_dict=None):
+	def __init__(self, program, arg_dict=None, zone=None):
 		self.program = program
 		
+		# name of the zone to run the program in (see zones.py), or None for the whole strip
+		self.zone = zone
+		
+		# version of the live parameters when the task was sent. Updates made after it apply to the program it starts.
+		self.params_version = 0
+		
 		if arg_dict is None:
 			self.arg_dict = {}
 		else:
 			self.arg_dict = arg_dict
 
-class BaseProgram(multiprocessing.Process):
+class CommandStats(object):
+	'''Counts of the commands the LED process has handled, kept in shared memory so the service can report them'''
+	def __init__(self):
+		self.received = multiprocessing.Value('l', 0, lock=False)
+		self.coalesced = multiprocessing.Value('l', 0, lock=False)
+		self.program_starts = multiprocessing.Value('l', 0, lock=False)
+	
+	def to_json(self):
+		return {
+			"received": self.received.value,
+			"coalesced": self.coalesced.value,
+			"programStarts": self.program_starts.value
+		}
+
+class LiveParameters(object):
+	'''
+	Parameters the service can change while a program runs, plus the global brightness, kept in shared memory and
+	read by the LED process at frame time.
 	
-	def __init__(self, logger, queue, num_pixels):
+	There is a single writer (the service) which writes the values before bumping the version, so the LED process can
+	read without a lock. A read that races a write sees the new version on the next frame and picks up the rest of it.
+	'''
+	
+	# program -> parameters that can be changed while it runs
+	program_parameters = {
+		'single_color': ['red', 'green', 'blue'],
+		'changing_color': ['dwell_time_ms', 'transition_time_ms', 'brightness_scale_pct']
+	}
+	
+	names = sorted(set(name for x in program_parameters.values() for name in x))
+	
+	def __init__(self):
+		self.version = multiprocessing.Value('l', 0, lock=False)
+		self.program = multiprocessing.Array('c', 32, lock=False)
+		self._values = multiprocessing.Array('l', len(self.names), lock=False)
+		self._changed_in = multiprocessing.Array('l', len(self.names), lock=False)
+		
+		# 0 to 255, applied with the strip's own brightness setting
+		self.brightness = multiprocessing.Value('l', 255, lock=False)
+	
+	def update(self, program, params):
 		'''
-		Initialize a program
+		Change parameters of a program. Only called from the service.
 		
 		Arguments:
-			stop_event (multiprocessing.Event) - event for this subprocess being notified that it should cleanup and exit
+			program (string) - program the parameters are for
+			params (dict) - parameter name -> integer value
+			
+		Returns:
+			(int) - the new version
 		'''
-		super(BaseProgram, self).__init__()
-		self.daemon = True
+		version = self.version.value + 1
+		self.program.value = program
+		for name, value in params.iteritems():
+			i = self.names.index(name)
+			self._values[i] = value
+			self._changed_in[i] = version
 		
+		self.version.value = version
+		return version
+	
+	def changes_since(self, program, version):
+		'''
+		Get the parameters changed for a program since a version. Only called from the LED process.
+		
+		Returns:
+			tuple
+				version (int) - version to pass next time
+				changes (dict) - parameter name -> value
+		'''
+		current_version = self.version.value
+		if current_version == version or self.program.value != program:
+			return current_version, {}
+		
+		changes = {}
+		for name in self.program_parameters.get(program, []):
+			i = self.names.index(name)
+			if self._changed_in[i] > version:
+				changes[name] = self._values[i]
+		
+		return current_version, changes
+
+class ProgramRunner(object):
+	'''
+	Runs the programs on a set of pixels, taking the commands for them from a queue. BaseProgram runs one on the whole
+	strip as the LED process, and ZoneProgram runs one for each zone on threads of that process.
+	'''
+	
+	def __init__(self, logger, queue, num_pixels, crossfade_ms=500, strip_backend=StripBackend.ws281x, recorder=None, heartbeat=None, stop_event=None, frame_timing=None, command_stats=None, live_parameters=None, dither_hz=0, frame_ring=None, clock=None, zones=None, power_limiter=None):
+		'''
+		Initialize a program
+		
+		Arguments:
+			(opt) crossfade_ms (int) - time over which each new program fades in from the last transmitted frame. 0 cuts straight over.
+			(opt) strip_backend (string) - one of StripBackend.valid_backends
+			(opt) recorder (frametrace.TraceRecorder) - records every frame sent to the strip
+			(opt) heartbeat (multiprocessing.Value) - shared double set to the current time by the frame loop so a supervisor can detect stalls
+			(opt) stop_event (multiprocessing.Event) - event for this subprocess being notified that it should cleanup and exit.
+				It is checked every frame so it preempts whatever program is running.
+			(opt) frame_timing (frametiming.FrameTiming) - shared ring the time of every frame sent is recorded to
+			(opt) command_stats (CommandStats) - shared counts of the commands received, coalesced and started
+			(opt) live_parameters (LiveParameters) - shared parameters read at frame time so programs can be adjusted while they run
+			(opt) dither_hz (int) - rate frames are re-sent at with temporal dithering between program frames, so fades move
+				in steps finer than one level. 0 sends each program frame once, rounded to whole levels.
+			(opt) frame_ring (framering.FrameRing) - shared ring a render worker process fills with the upcoming frames of
+				timeline programs, so the output loop only copies out the frame due
+			(opt) clock (clock.SystemClock/clock.VirtualClock) - clock that frames are timed and waited on. A virtual
+				clock plays the same frames without waiting for them, so whole programs can be run in moments.
+			(opt) zones (list[zones.Zone]) - ranges of pixels that can each run a program of their own
+			(opt) power_limiter (power.PowerLimiter) - estimates the current of every frame and scales frames down to
+				fit the supply
+		'''
 		self.logger = logger
 		self.queue = queue
 		self.num_pixels = num_pixels
 		
-		# used for wakeup program and changing_color program
-		self.base_multiplier = 60
+		self.base_multiplier = BASE_MULTIPLIER
+		
+		# programs run on a 100 ms frame clock, so the crossfade is expressed as a number of frames
+		self.crossfade_frames = int(round(crossfade_ms / 100.0))
+		self.last_frame = [ColorObject(0,0,0) for i in range(self.num_pixels)]
+		self._fade_from = None
+		self._fade_frame = 0
+		self._task_started_at = None
 		
+		# recorded runs (trace_tool) and runs on a virtual clock aren't what the strip is showing, so they leave the
+		# current program file alone rather than writing one into the working directory
+		self.publishes_current_program = recorder is None and clock is None
 		self._set_current_program("None")
 		
-		self.strip = rpi.PixelStrip(self.num_pixels, 10)
-		self.strip.begin()
+		# the strip is created when the process runs so the hardware is only ever opened by the process driving it
+		self.strip_backend = strip_backend
+		self.strip = None
+		self.recorder = recorder
+		self.heartbeat = heartbeat
+		self.frame_timing = frame_timing
+		
+		if command_stats is None:
+			self.command_stats = CommandStats()
+		else:
+			self.command_stats = command_stats
+		
+		self.live_parameters = live_parameters
+		self._params_version = 0
+		self._applied_brightness = None
+		
+		# with dithering, programs compute fractional colors and the frame showing is re-quantized for every output frame
+		self.dither_hz = dither_hz
+		if dither_hz > 0:
+			self.dither = TemporalDither(self.num_pixels)
+		else:
+			self.dither = None
+		self._dither_scale = 1.0
+		
+		self.power_limiter = power_limiter
+		self._power_scale = 1.0
+		
+		# brightness last set on the strip, which starts at full brightness. Tracked here so the frame loop doesn't
+		# read it back from the driver every frame.
+		self._strip_brightness = 255
+		
+		# programs keep fractional colors when something downstream (dithering) can show them
+		self.exact_colors = self.dither is not None
+		self._showing = None
+		self._shown_at = None
+		
+		# the render worker is started with the process, since it is a process of its own
+		self.frame_ring = frame_ring
+		self.render_worker = None
+		
+		# the heartbeat and the task pickup latency stay on the wall clock, since they are measured against other processes
+		if clock is None:
+			self.clock = SystemClock()
+		else:
+			self.clock = clock
+		
+		# latest command for each zone, waiting to be handed to the program running in that zone
+		self.zones = zones or []
+		self._zone_tasks = {}
+		
+		# zone programs and the frame they draw into, made the first time zones are composed and reused after that
+		self._zone_runners = None
+		self._zone_frame = None
+		
+		# latest-wins mailbox. Commands are drained off the queue into here and a newer command replaces one that
+		# hasn't started yet, so a burst of commands (e.g. from dragging a color picker) starts the newest one only.
+		self._pending_task = None
+		
+		# end of the playlist step running, which ends the program running in it like a new command would
+		self._step_deadline = None
+		
+		if stop_event is None:
+			self.stop_event = multiprocessing.Event()
+		else:
+			self.stop_event = stop_event
+		
+		# set by the signal handlers. They can't set stop_event themselves since its lock may be held by the frame loop they interrupted.
+		self._stop_signalled = False
+		self._owner_pid = None
 	
 	def _exit_gracefully(self):
 		'''Exit the subprocess when instructed. Should only be called if the whole service is coming down.'''
+		self.quit_blackout()
 		self.strip._cleanup()
 		self._set_current_program("None")
 		
+		if self.render_worker is not None:
+			self.render_worker.stop(FRAME_INTERVAL_S)
+		
+	def _handle_stop_signal(self, signum, frame):
+		'''Treat SIGTERM and SIGINT like a stop command so the strip is blanked before the process exits'''
+		self._stop_signalled = True
+		
+	def _should_stop(self):
+		if self._owner_pid is not None and os.getppid() != self._owner_pid:
+			# the worker that owned this process was killed outright. Don't outlive it, since this process still
+			# holds the worker's listening socket and would leave a second program fighting over the strip.
+			self.logger.error('Parent process {} is gone'.format(self._owner_pid))
+			return True
+		
+		return self._stop_signalled or self.stop_event.is_set()
+		
+	def _beat(self):
+		'''Tell the supervisor this process is still making progress'''
+		if self.heartbeat is not None:
+			self.heartbeat.value = time()
+	
 	def _set_current_program(self, program):
 		self.current_program = program
+		if not self.publishes_current_program:
+			return
+		
 		with open(ProgramList.current_program_filename, 'w') as f:
 			f.write(self.current_program)
 		
+	def _start_program(self, program):
+		'''Record the newly started program and crossfade into it from whatever frame is currently showing'''
+		self._set_current_program(program)
+		self.command_stats.program_starts.value += 1
+		
+		if self.crossfade_frames > 0:
+			self._fade_from = list(self.last_frame)
+			self._fade_frame = 0
+	
+	def _crossfade(self, data):
+		'''
+		Blend a frame with the frame showing when the current program started.
+		
+		Arguments:
+			data (list[ColorObject]) - frame produced by the current program
+			
+		Returns:
+			(list[ColorObject]) - the frame to transmit
+		'''
+		self._fade_frame += 1
+		if self._fade_frame >= self.crossfade_frames:
+			self._fade_from = None
+			return data
+		
+		weight = float(self._fade_frame) / float(self.crossfade_frames)
+		blended = []
+		for i in range(0, len(data)):
+			from_color = self._fade_from[i]
+			to_color = data[i]
+			blended.append(ColorObject(
+				self._level(from_color.r + (to_color.r - from_color.r) * weight),
+				self._level(from_color.g + (to_color.g - from_color.g) * weight),
+				self._level(from_color.b + (to_color.b - from_color.b) * weight)
+			))
+		
+		return blended
+	
+	def _level(self, value):
+		'''Round a computed color value to a whole level, unless dithering will take care of the fraction'''
+		if self.exact_colors:
+			return value
+		return int(round(value))
+	
+	def _poll_parameters(self):
+		'''
+		Returns:
+			(dict) - live parameters changed for the running program since it was requested or they were last polled
+		'''
+		if self.live_parameters is None:
+			return {}
+		
+		self._params_version, changes = self.live_parameters.changes_since(self.current_program, self._params_version)
+		if changes:
+			self.logger.info('Updating {} with {}'.format(self.current_program, changes))
+		
+		return changes
+	
 	def _send_data(self, data):
 		'''
 		Send a data packet to the pixels.
@@ -67,35 +402,206 @@ class BaseProgram(multiprocessing.Process):
 		Arguments:
 			data (list[ColorObject]) - list of color objects to be transmitted to pixels
 		'''
-		for i in range(0,len(data)):
-			# note the ordering of RBG in the mapping. Not sure how to make the library do that for me in the PixelStrip function
-			self.strip.setPixelColorRGB(i,data[i].r, data[i].b, data[i].g)
+		if self._fade_from is not None:
+			data = self._crossfade(data)
+		
+		if self.live_parameters is not None and self.live_parameters.brightness.value != self._applied_brightness:
+			self._applied_brightness = self.live_parameters.brightness.value
+			if self.dither is None:
+				# the strip scales every pixel itself as it sends them, so brightness costs nothing per frame
+				self._set_strip_brightness(self._applied_brightness)
+			else:
+				# the strip's scaling would round dithered levels away, so scale before dithering instead
+				self._dither_scale = self._applied_brightness / 255.0
+		
+		if self.power_limiter is not None:
+			self._limit_power(data)
+		
+		self._show(data)
+		
+		if self.frame_timing is not None:
+			self.frame_timing.record(self.clock.time())
+		
+		# programs replace the color objects in their data list rather than modifying them, so a shallow copy is enough
+		self.last_frame = list(data)
+		
+		if self._task_started_at is not None:
+			self.logger.info('First frame of {} sent {:.1f} ms after the task was picked up'.format(self.current_program, (time() - self._task_started_at) * 1000.0))
+			self._task_started_at = None
+		
+	def _limit_power(self, data):
+		'''
+		Scale a frame down, on top of the global brightness, if it would draw more current than the supply budget.
+		
+		Arguments:
+			data (list[ColorObject]) - list of color objects about to be transmitted to pixels
+		'''
+		brightness = 255 if self._applied_brightness is None else self._applied_brightness
+		scale = self.power_limiter.limit(data, brightness / 255.0)
+		
+		if self.dither is None:
+			# rounded down so the frame sent never draws more than the budget
+			self._set_strip_brightness(int(brightness * scale))
+		else:
+			# applied with the brightness before dithering, so it holds for every output frame until the next frame
+			self._power_scale = scale
+	
+	def _set_strip_brightness(self, brightness):
+		'''Set the brightness the strip scales every pixel by as it sends them, if it changed'''
+		if brightness != self._strip_brightness:
+			self.strip.setBrightness(brightness)
+			self._strip_brightness = brightness
+	
+	def _show(self, data):
+		'''
+		Transmit a frame to the pixels, quantizing it first if dithering.
+		
+		Arguments:
+			data (list[ColorObject]) - list of color objects to be transmitted to pixels
+		'''
+		if self.dither is None:
+			for i in range(0,len(data)):
+				# note the ordering of RBG in the mapping. Not sure how to make the library do that for me in the PixelStrip function
+				self.strip.setPixelColorRGB(i,data[i].r, data[i].b, data[i].g)
+			shown = data
+		else:
+			levels = self.dither.quantize(data, self._dither_scale * self._power_scale)
+			for i in range(0,len(data)):
+				self.strip.setPixelColorRGB(i, levels[i*3], levels[i*3 + 2], levels[i*3 + 1])
+			shown = None
 		
 		self.strip.show()
+		self._shown_at = self.clock.time()
+		self._showing = data
+		self._beat()
+		
+		if self.recorder is not None:
+			if shown is None:
+				shown = [ColorObject(levels[i*3], levels[i*3 + 1], levels[i*3 + 2]) for i in range(0, len(data))]
+			self.recorder.record(self._shown_at, shown)
+	
+	def _hold_frame(self, duration_s):
+		'''
+		Wait for the next program frame. When dithering, the frame showing is re-sent at dither_hz until then.
+		
+		Arguments:
+			duration_s (float) - time until the next program frame
+		'''
+		if self._step_deadline is not None:
+			# wake for the end of a playlist step, so the next step starts right on it rather than up to a frame late
+			duration_s = min(duration_s, self._step_deadline - self.clock.time())
+		
+		if self.dither is None:
+			self.clock.sleep(max(0, duration_s))
+			return
 		
+		deadline = self.clock.time() + duration_s
+		interval = 1.0 / self.dither_hz
+		next_show = self._shown_at + interval
+		
+		# leave the last slot before the deadline to the next program frame
+		while next_show < deadline - interval / 2.0:
+			self.clock.sleep(max(0, next_show - self.clock.time()))
+			self._show(self._showing)
+			
+			# if an output frame ran late, carry on from it rather than sending a burst to catch up
+			next_show = max(next_show + interval, self._shown_at + interval / 2.0)
+		
+		self.clock.sleep(max(0, deadline - self.clock.time()))
+	
+	def _receive_task(self, task):
+		'''
+		Put a command taken off the queue in the mailbox, replacing any command still waiting there. Each zone has a
+		mailbox of its own, so a command for a zone only replaces a command waiting for the same zone.
+		'''
+		self.queue.task_done()
+		self.command_stats.received.value += 1
+		
+		if self._pending_task is not None and self._pending_task.program == 'KILL':
+			# nothing supersedes a shutdown
+			self.command_stats.coalesced.value += 1
+			return
+		
+		if task.zone is not None:
+			if task.zone in self._zone_tasks:
+				self.command_stats.coalesced.value += 1
+			self._zone_tasks[task.zone] = task
+			
+			if self.current_program != 'zones' or self._pending_task is not None:
+				# composite the zones in place of the program running or waiting to start on the whole strip
+				if self._pending_task is not None and self._pending_task.program != 'zones':
+					self.command_stats.coalesced.value += 1
+				self._pending_task = ProgramTask('zones')
+			return
+		
+		if self._pending_task is not None:
+			self.command_stats.coalesced.value += 1
+		
+		# a program for the whole strip takes over every zone
+		self._zone_tasks = {}
+		self._pending_task = task
+	
+	def _drain_queue(self):
+		'''Move every command waiting on the queue into the mailbox'''
+		while True:
+			try:
+				self._receive_task(self.queue.get_nowait())
+			except Empty:
+				break
+	
+	def _next_task(self):
+		'''
+		Take the latest command, waiting up to a frame for one to arrive.
+		
+		Raises:
+			Empty
+		'''
+		if self._pending_task is None:
+			self._receive_task(self.queue.get(timeout=FRAME_INTERVAL_S))
+		
+		self._drain_queue()
+		task = self._pending_task
+		self._pending_task = None
+		return task
+	
 	def _check_for_task(self):
-		'''Returns boolean indicating if new task was found on the queue'''
-		try:
-			task = self.queue.get_nowait()
-			self.queue.task_done()
-			self.queue.put_nowait(task)
-			self.logger.info('Detected new task on queue')
+		'''Returns boolean indicating if new task was found on the queue or the process was told to stop'''
+		if self._should_stop():
 			return True
-
-		except Empty:
-			return False
+		
+		had_task = self._pending_task is not None
+		self._drain_queue()
+		if self._pending_task is not None:
+			if not had_task:
+				self.logger.info('Detected new task on queue')
+			return True
+		
+		if self._step_deadline is not None and self.clock.time() >= self._step_deadline:
+			return True
+		
+		return False
 	
 	
 	def run(self):
+		'''Run the programs commanded until told to stop'''
+		self._beat()
+		
 		while True:
+			if self._should_stop():
+				self.logger.info('Received stop event so exiting this process.')
+				self._exit_gracefully()
+				break
+			
 			try:
-				next_task = self.queue.get_nowait()
-				self.queue.task_done()
+				# block rather than poll so a new task is picked up as soon as it lands.
+				# the timeout is one frame so a stop event is still noticed promptly while idle.
+				next_task = self._next_task()
+				self._task_started_at = time()
+				self._params_version = next_task.params_version
 			
 				if next_task.program == 'KILL':
 					# Received kill task so exit
 					self.logger.info('Received shutdown command so exiting this process.')
-					self.quit_blackout()
 					self._exit_gracefully()
 					break
 					
@@ -114,7 +620,7 @@ class BaseProgram(multiprocessing.Process):
 					if exited_normally:
 						# if we weren't given a new task that caused us to abandon the program early, then
 						# queue up the blackout program since that is our base resting state
-						self.queue.put_nowait(ProgramTask('blackout'))
+						self._pending_task = ProgramTask('blackout')
 					
 				elif next_task.program == 'wakeup':
 					exited_normally = self.wakeup(**next_task.arg_dict)
@@ -122,36 +628,52 @@ class BaseProgram(multiprocessing.Process):
 					if exited_normally:
 						# if we weren't given a new task that caused us to abandon the program early, then
 						# queue up the blackout program since that is our base resting state
-						self.queue.put_nowait(ProgramTask('blackout'))
+						self._pending_task = ProgramTask('blackout')
+					
+				elif next_task.program == 'kelvin_sunrise':
+					exited_normally = self.kelvin_sunrise(**next_task.arg_dict)
+					
+					if exited_normally:
+						self._pending_task = ProgramTask('blackout')
+					
+				elif next_task.program == 'playlist':
+					exited_normally = self.playlist(**next_task.arg_dict)
+					
+					if exited_normally:
+						self._pending_task = ProgramTask('blackout')
+					
+				elif next_task.program == 'zones':
+					self.compose_zones()
 					
 			except Empty:
-				# Queue is empty so let's sleep for a second before checking again.
+				# Queue stayed empty for a frame so check again.
 				# Realistically, shouldn't really get here since paradigm is to always be executing a program, even if it's blackout
-				sleep(1)
+				self._beat()
 			
 	
 	# definition of individual programs
 	def quit_blackout(self):
 		'''Program to turn all LEDs to black briefly before the subprocess is killed.'''
 		self._set_current_program('quit_blackout')
+		self._fade_from = None
 		self.logger.info('Starting Program: {}'.format(self.current_program))
 		
 		data = [ColorObject(0,0,0) for i in range(self.num_pixels)]
 		for i in range(0,5):
 			self._send_data(data)
-			sleep(.01)
+			self.clock.sleep(.01)
 		
 		self.logger.info('Exiting Program: {}'.format(self.current_program))
 
 	def blackout(self):
 		'''Program to turn all LEDs to black and keep them there.'''
-		self._set_current_program('blackout')
+		self._start_program('blackout')
 		self.logger.info('Starting Program: {}'.format(self.current_program))
 		
 		data = [ColorObject(0,0,0) for i in range(self.num_pixels)]
 		while not self._check_for_task():
 			self._send_data(data)
-			sleep(.1)
+			self._hold_frame(.1)
 			
 		self.logger.info('Exiting Program: {}'.format(self.current_program))
 			
@@ -164,20 +686,26 @@ class BaseProgram(multiprocessing.Process):
 			(opt) green (int) - green value
 			(opt) blue (int) - blue value
 		'''
-		self._set_current_program('single_color')
+		self._start_program('single_color')
 		self.logger.info('Starting Program: {} with rgb = {}, {}, {}'.format(self.current_program, str(red), str(green), str(blue)))
 		
 		data = [ColorObject(red, green, blue) for i in range(self.num_pixels)]
 		while not self._check_for_task():
+			params = self._poll_parameters()
+			if params:
+				red = params.get('red', red)
+				green = params.get('green', green)
+				blue = params.get('blue', blue)
+				data = [ColorObject(red, green, blue) for i in range(self.num_pixels)]
+			
 			self._send_data(data)
-			sleep(.1)
+			self._hold_frame(.1)
 		
-		self.logger.info('Exiting Program: {}'.format(self.current_program))		
-		self.quit_blackout()
+		self.logger.info('Exiting Program: {}'.format(self.current_program))
 
 	def changing_color(self, dwell_time_ms=10000, transition_time_ms=3000, brightness_scale_pct=100):
 		'''Program that shifts randomly between a list of colors.'''	
-		self._set_current_program('changing_color')
+		self._start_program('changing_color')
 		self.logger.info('Starting Program: {} with dwell_time_ms={} and transition_time_ms={} and brightness_scale_pct={}'.format(self.current_program, str(dwell_time_ms), str(transition_time_ms), str(brightness_scale_pct)))
 		
 		# r, g, b, led pct
@@ -200,205 +728,489 @@ class BaseProgram(multiprocessing.Process):
 		]
 		
 		# scale the programs to control brightness
-		scale_factor = float(brightness_scale_pct) / float(100)
-		program_options = [(int(x[0]*scale_factor), int(x[1]*scale_factor), int(x[2]*scale_factor), x[3]) for x in raw_program_options]
+		program_options = self._scale_colors(raw_program_options, brightness_scale_pct)
+		
+		# timings can be changed while the program runs
+		settings = {'dwell_time_ms': dwell_time_ms, 'transition_time_ms': transition_time_ms}
+		
+		def poll_parameters():
+			'''Apply live parameter changes. Returns True if the colors were rescaled.'''
+			params = self._poll_parameters()
+			settings['dwell_time_ms'] = params.get('dwell_time_ms', settings['dwell_time_ms'])
+			settings['transition_time_ms'] = params.get('transition_time_ms', settings['transition_time_ms'])
+			
+			if 'brightness_scale_pct' in params:
+				program_options[:] = self._scale_colors(raw_program_options, params['brightness_scale_pct'])
+				return True
 			
+			return False
 		
-		# pick the first color
-		prev_program = random.choice(program_options)
-		self.logger.info(prev_program)
+		# pick the first color. Colors are tracked by index so they can be rescaled if the brightness changes.
+		prev_idx = random.choice(range(len(program_options)))
+		self.logger.info(program_options[prev_idx])
 		
 		while not self._check_for_task():
 			
 			# setup the data array for the color
-			data = [ColorObject(prev_program[0], prev_program[1], prev_program[2]) for i in range(self.num_pixels)]
+			data = [ColorObject(program_options[prev_idx][0], program_options[prev_idx][1], program_options[prev_idx][2]) for i in range(self.num_pixels)]
 			
-			# loop through the dwell time and send the color to the pixels
-			for i in range(0, dwell_time_ms, 100):
+			# loop through the dwell time and send the color to the pixels. Each color is held for at least a frame so
+			# that zero dwell and transition times still wait for the frame clock rather than spinning without a heartbeat.
+			dwell_elapsed_ms = 0
+			while True:
+				if poll_parameters():
+					data = [ColorObject(program_options[prev_idx][0], program_options[prev_idx][1], program_options[prev_idx][2]) for i in range(self.num_pixels)]
+				
 				self._send_data(data)
-				sleep(.1)
-				if self._check_for_task():
+				self._hold_frame(.1)
+				dwell_elapsed_ms += 100
+				if self._check_for_task() or dwell_elapsed_ms >= settings['dwell_time_ms']:
 					break
 			
 			# pick the next color
 			while True:
-				program = random.choice(program_options)
-				if program != prev_program:
+				idx = random.choice(range(len(program_options)))
+				if idx != prev_idx:
 					# if the random color is the same as the previous one, then keep repicking until it isn't
 					break
 			
-			self.logger.info(program)
+			self.logger.info(program_options[idx])
 			
 			# transition between colors over the transition_time_ms period
-			iter_count = transition_time_ms * self.base_multiplier / 10000
-			exited_normally = self._iterate_color_transition(prev_program, program, iter_count, data)
+			iter_count = settings['transition_time_ms'] * self.base_multiplier / 10000
+			
+			def rescaled_states():
+				if poll_parameters():
+					return program_options[prev_idx], program_options[idx]
+			
+			exited_normally = self._iterate_color_transition(program_options[prev_idx], program_options[idx], iter_count, data, rescaled_states)
 			if not exited_normally:
 				break
 			
 			
 			# prep for the next iteration
-			prev_program = program
+			prev_idx = idx
 
 			
-		self.logger.info('Exiting Program: {}'.format(self.current_program))		
-		self.quit_blackout()
+		self.logger.info('Exiting Program: {}'.format(self.current_program))
 		
-	def sleepy_time(self, multiplier=5):
+	def sleepy_time(self, multiplier=5, start_time=None):
 		'''Program that slowly goes from light on to dark.
 		
 		Args:
 			(opt) multiplier (int) - sets the total duration of the program. Completion is reached in roughly the number of minutes equal to the multiplier.
+			(opt) start_time (float) - wall clock time (epoch seconds) the program started at. Defaults to now.
 		'''
-		self._set_current_program('sleepy_time')
-		self.logger.info('Starting Program: {} with multiplier={}'.format(self.current_program, str(multiplier)))
+		self._start_program('sleepy_time')
+		self.logger.info('Starting Program: {} with multiplier={} and start_time={}'.format(self.current_program, str(multiplier), str(start_time)))
 		
-		# r, g, b, led pct, transition time ratio from this to next
-		program_sequence = [
-			(128,0,0,100,1),
-			(0,0,0,100,0)
-		]
-		
-		exited_normally = self._wakeup_core(program_sequence, multiplier, base_multiplier=600)
+		timeline = compile_timeline('sleepy_time', self.num_pixels, {'multiplier': multiplier})
+		exited_normally = self._play_timeline(timeline, start_time)
 				
 		self.logger.info('Exiting Program: {}'.format(self.current_program))
-		self.quit_blackout()
 		
 		return exited_normally
 
 		
-	def wakeup(self, multiplier=30):
+	def wakeup(self, multiplier=30, start_time=None):
 		'''
 		Program that simulates a sunrise sequence increasing in color, brightness, and pixel count throughout.
 		
 		Args:
 			(opt) multiplier (int) - sets the total duration of the sunrise. Full brightness is reached in roughly the number of minutes equal to the multiplier.
+			(opt) start_time (float) - wall clock time (epoch seconds) the sunrise started at. Defaults to now.
 		'''
-		self._set_current_program('wakeup')
-		self.logger.info('Starting Program: {} with multiplier={}'.format(self.current_program, str(multiplier)))
-		
-		# r, g, b, led pct, transition time ratio from this to next
-		program_sequence = [
-			(0,0,0,10,1),	# black
-			(0,0,10,15,1),	# dark blue
-			(2,0,15,20,1),	# purple
-			(7,0,10,25,1),	# reddish purple
-			(20,1,0,30,1),	# blood orange
-			(50,6,0,40,1),	# orange
-			(70,15,0,50,1),	# yellow
-			(70,15,2,60,2),	# warm white
-			(255,200,100,100,5), # white
-			(255,200,100,100,0)	# white
-		]
+		self._start_program('wakeup')
+		self.logger.info('Starting Program: {} with multiplier={} and start_time={}'.format(self.current_program, str(multiplier), str(start_time)))
 		
-		exited_normally = self._wakeup_core(program_sequence, multiplier)
+		timeline = compile_timeline('wakeup', self.num_pixels, {'multiplier': multiplier})
+		exited_normally = self._play_timeline(timeline, start_time)
 				
 		self.logger.info('Exiting Program: {}'.format(self.current_program))
-		self.quit_blackout()
 		
 		return exited_normally
 		
-	def _wakeup_core(self, program_sequence, multiplier, base_multiplier=60):
-		exited_normally = True
+	def kelvin_sunrise(self, multiplier=30, start_kelvin=1800, end_kelvin=6500, brightness_pct=100, start_time=None):
+		'''
+		Program that simulates a sunrise along a color temperature curve, rising in intensity from dark and then
+		holding the end color for a while like the wakeup program does.
+		
+		Args:
+			(opt) multiplier (int) - number of minutes the sunrise takes to reach full intensity
+			(opt) start_kelvin (int) - color temperature the sunrise starts at
+			(opt) end_kelvin (int) - color temperature the sunrise ends at
+			(opt) brightness_pct (int) - intensity at the end of the sunrise, from 0 to 100
+			(opt) start_time (float) - wall clock time (epoch seconds) the sunrise started at. Defaults to now.
+		'''
+		self._start_program('kelvin_sunrise')
+		self.logger.info('Starting Program: {} with multiplier={}, {}K to {}K, brightness_pct={} and start_time={}'.format(self.current_program, str(multiplier), str(start_kelvin), str(end_kelvin), str(brightness_pct), str(start_time)))
+		
+		timeline = compile_timeline('kelvin_sunrise', self.num_pixels, {'multiplier': multiplier, 'start_kelvin': start_kelvin, 'end_kelvin': end_kelvin, 'brightness_pct': brightness_pct})
+		exited_normally = self._play_timeline(timeline, start_time)
+		
+		self.logger.info('Exiting Program: {}'.format(self.current_program))
 		
-		data = [ColorObject(0,0,0) for x in range(0,self.num_pixels)]
-		for i in range(1, len(program_sequence)):
-			from_state = program_sequence[i-1]
-			to_state = program_sequence[i]
-			self.logger.info(str(i))
-			self.logger.info(from_state)
-			
-			iter_count = multiplier * base_multiplier * from_state[4]
-			self.logger.info("iter_count = " + str(iter_count))
-			exited_normally = self._iterate_color_transition(from_state, to_state, iter_count, data)
-			
-			if exited_normally == False or self._check_for_task():
-				exited_normally = False
-				break
-				
 		return exited_normally
-
-	def _iterate_color_transition(self, from_state, to_state, iter_count, data):
-		red_delta, green_delta, blue_delta, pixel_delta = self._calc_deltas(from_state, to_state)
-		self.logger.info("deltas: ")
-		self.logger.info((red_delta, green_delta, blue_delta, pixel_delta))
-		
-		for j in range(0, iter_count):
-			if iter_count % 10 == 0:
-				if self._check_for_task():
+		
+	def playlist(self, steps, loop=False, start_time=None):
+		'''
+		Program that runs other programs back to back, each for a set time, without a command or request between them.
+		Every step starts at a set time after start_time, so steps start on the frame they are due however long the
+		programs before them took to start, and a restarted playlist resumes at the step it was on. Timeline programs
+		are played locked to the start of their step.
+		
+		Args:
+			steps (list) - list of dicts with 'program', 'arg_dict' (program arguments) and 'duration_s'. A timeline
+				program's step lasts as long as the program, or duration_s if that is shorter. A step without a
+				duration_s (only allowed last, for a program that doesn't end) runs until another program is requested.
+			(opt) loop (boolean) - start again from the first step after the last one
+			(opt) start_time (float) - wall clock time (epoch seconds) the playlist started at. Defaults to now.
+		
+		Returns:
+			(boolean) - True if the last step ended, False if a new task interrupted the playlist
+		'''
+		if start_time is None:
+			start_time = self.clock.time()
+		
+		self.logger.info('Starting Program: playlist of {} with loop={} and start_time={}'.format(', '.join(x['program'] for x in steps), str(loop), str(start_time)))
+		
+		durations = [self._step_duration_s(x) for x in steps]
+		if loop and (None in durations or sum(durations) <= 0):
+			# a pass with no end, or that takes no time, would loop without ever showing anything new
+			loop = False
+		
+		if loop:
+			# skip whole passes that already ended, e.g. when resuming a looping playlist after a restart
+			period = sum(durations)
+			start_time += (max(0, self.clock.time() - start_time) // period) * period
+		
+		step_start = start_time
+		i = 0
+		while True:
+			step = steps[i]
+			step_end = None if durations[i] is None else step_start + durations[i]
+			
+			# steps that already ended are skipped, so a playlist resumed after a restart picks up where it was
+			if step_end is None or step_end > self.clock.time():
+				arg_dict = dict(step['arg_dict'])
+				if step['program'] in ProgramList.timeline_programs:
+					arg_dict['start_time'] = step_start
+				
+				self._step_deadline = step_end
+				try:
+					getattr(self, step['program'])(**arg_dict)
+				finally:
+					self._step_deadline = None
+				
+				if self._pending_task is not None or self._should_stop():
+					self.logger.info('Exiting Program: playlist')
 					return False
-			red = from_state[0] + self._calc_delta_influence(red_delta, iter_count, j)
-			green = from_state[1] + self._calc_delta_influence(green_delta, iter_count, j)
-			blue = from_state[2] + self._calc_delta_influence(blue_delta, iter_count, j)
-			pixel_count = int(round(float(from_state[3])/100.0*self.num_pixels)) + self._calc_delta_influence(pixel_delta, iter_count, j)
 			
+			if step_end is None:
+				# the last step ran until another program was requested
+				return False
 			
-			# set unused pixels to black
-			for idx in range(pixel_count, self.num_pixels):
-				data[idx] = ColorObject(0,0,0)
+			step_start = step_end
+			i += 1
+			if i == len(steps):
+				if not loop:
+					self.logger.info('Exiting Program: playlist')
+					return True
+				i = 0
+	
+	def _step_duration_s(self, step):
+		'''
+		Returns:
+			(float) - how long a playlist step runs for, or None if it runs until another program is requested
+		'''
+		duration_s = step.get('duration_s')
+		if step['program'] in ProgramList.timeline_programs:
+			timeline_s = compile_timeline(step['program'], self.num_pixels, step['arg_dict']).duration_s
+			if duration_s is None or duration_s > timeline_s:
+				duration_s = timeline_s
+		
+		return duration_s
+	
+	def compose_zones(self):
+		'''
+		Program that runs a separate program in each zone and shows them together. Every zone runs its own program
+		instance on a thread of its own, which copies its frames into the zone's slice of a shared frame. The shared
+		frame is sent to the strip once per frame, with the crossfade, brightness and dithering of the whole strip.
+		A command for a zone only preempts the program in that zone. A command for the whole strip ends them all.
+		'''
+		self._start_program('zones')
+		self.logger.info('Starting Program: {} with zones {}'.format(self.current_program, ', '.join(x.name for x in self.zones)))
+		
+		if self._zone_runners is None:
+			# kept for the life of the process, so composing zones again doesn't allocate a program for each zone again.
+			# Pixels outside every zone stay black.
+			self._zone_frame = [ColorObject(0,0,0)] * self.num_pixels
+			self._zone_runners = dict((zone.name, ZoneProgram(self.logger, zone, self._zone_frame, self.crossfade_frames * 100, self.exact_colors, self.clock)) for zone in self.zones)
+		
+		runners = self._zone_runners
+		for runner in runners.itervalues():
+			runner.start()
+		
+		while not self._check_for_task():
+			for name, task in self._zone_tasks.iteritems():
+				if name in runners:
+					task.zone = None
+					runners[name].queue.put_nowait(task)
+				else:
+					self.logger.error('Ignoring {} for unknown zone {}'.format(task.program, name))
+			self._zone_tasks = {}
 			
-			try:
-				# set used pixels to correct color
-				for k in range(0, pixel_count):
-					data[k] = ColorObject(red, green, blue)
-			except Exception as e:
-				self.logger.info(str(k))
-				self.logger.info(str(pixel_count))
-				self.logger.info(str(pixel_delta))
-				self.logger.info(str(self.num_pixels) + '\n')
-				
-				raise e
-				
-			self._send_data(data)
-			sleep(.1)
+			self._send_data(list(self._zone_frame))
+			self._hold_frame(FRAME_INTERVAL_S)
 		
-		return True
+		for runner in runners.itervalues():
+			runner.stop_event.set()
+		for runner in runners.itervalues():
+			runner.join(FRAME_INTERVAL_S * 2)
 		
+		self.logger.info('Exiting Program: {}'.format(self.current_program))
 	
-	def _calc_deltas(self, from_state, to_state):
+	def _play_timeline(self, timeline, start_time=None):
 		'''
-		Calculate deltas between one state and another
+		Play a timeline locked to the wall clock, so the frame shown is always the one for the time since start_time.
+		Nodes given the same start time show the same frame, and a start time in the past seeks into the timeline.
 		
 		Arguments:
-			from_state (list) - starting state
-			to_state (list) - ending state
+			timeline (Timeline) - the frames to play
+			(opt) start_time (float) - wall clock time (epoch seconds) of the first frame. Defaults to now.
 			
 		Returns:
-			tuple
-				red_delta (float) - delta in red
-				green_delta (float) - delta in green
-				blue_delta (float) - delta in blue
-				pixel_delta (float) - delta in pixel count
+			(boolean) - True if the timeline played to the end, False if a new task interrupted it
 		'''
-		red_delta = self._calc_delta(to_state[0], from_state[0])
-		green_delta = self._calc_delta(to_state[1], from_state[1])
-		blue_delta = self._calc_delta(to_state[2], from_state[2])
-		pixel_delta = (float(to_state[3])/100.0 * float(self.num_pixels)) - (float(from_state[3])/100.0 * float(self.num_pixels))
+		if start_time is None:
+			start_time = self.clock.time()
+		
+		start_index = max(0, timeline.frame_index_at(self.clock.time() - start_time))
+		self.logger.info('Playing {} frame timeline from frame {}'.format(timeline.frame_count, start_index))
+		
+		if self.render_worker is not None:
+			if not self.render_worker.is_alive():
+				self.logger.error('Render worker {} died with exit code {}'.format(self.render_worker.pid, self.render_worker.exitcode))
+				self._start_render_worker()
+			self.render_worker.render(timeline, start_index, self.exact_colors)
+		
+		finished = self._play_timeline_frames(timeline, start_time)
 		
-		return red_delta, green_delta, blue_delta, pixel_delta
+		if self.render_worker is not None:
+			# a new program preempted the timeline or it finished, so nothing rendered for it is needed any more
+			self.render_worker.cancel()
 		
-	def _calc_delta(self, to_item, from_item):
+		return finished
+	
+	def _play_timeline_frames(self, timeline, start_time):
+		'''See _play_timeline'''
+		# wait for a start time in the future
+		while self.clock.time() < start_time:
+			if self._check_for_task():
+				return False
+			self._beat()
+			self.clock.sleep(max(0, min(FRAME_INTERVAL_S, start_time - self.clock.time())))
+		
+		data = [ColorObject(0,0,0) for x in range(0,self.num_pixels)]
+		while True:
+			if self._check_for_task():
+				return False
+			
+			index = timeline.frame_index_at(self.clock.time() - start_time)
+			if index >= timeline.frame_count:
+				return True
+			
+			values = None
+			if self.render_worker is not None:
+				values = self.frame_ring.read(index)
+			
+			if values is None:
+				# not rendered ahead (e.g. the first frame), so render it here
+				self._fill_frame(data, timeline.frame_at_index(index, self.exact_colors))
+			else:
+				self._fill_frame_from_values(data, values)
+			
+			self._send_data(data)
+			
+			# sleep until the next frame is due rather than a fixed interval so frame time doesn't drift
+			self._hold_frame(start_time + (index + 1) * FRAME_INTERVAL_S - self.clock.time())
+	
+	def _start_render_worker(self):
+		self.render_worker = RenderWorker(self.logger, self.frame_ring)
+		self.render_worker.start()
+		self.logger.info('Started render worker {}'.format(self.render_worker.pid))
+
+	def _scale_colors(self, colors, brightness_scale_pct):
+		'''Scale a list of (r, g, b, led pct) colors by a brightness percentage'''
+		scale_factor = float(brightness_scale_pct) / float(100)
+		if self.exact_colors:
+			return [(x[0]*scale_factor, x[1]*scale_factor, x[2]*scale_factor, x[3]) for x in colors]
+		return [(int(x[0]*scale_factor), int(x[1]*scale_factor), int(x[2]*scale_factor), x[3]) for x in colors]
+	
+	def _iterate_color_transition(self, from_state, to_state, iter_count, data, poll_states=None):
 		'''
-		Calculate delta between two items
+		Transition the whole strip from one color to another.
 		
 		Arguments:
-			to_item (int/float) - end item
-			from_item (int/float) - starting item
-			
+			from_state (tuple) - starting (r, g, b, led pct)
+			to_state (tuple) - ending (r, g, b, led pct)
+			iter_count (int) - number of frames the transition takes
+			data (list[ColorObject]) - frame to fill
+			(opt) poll_states (function) - called every frame. Returns new (from_state, to_state) to carry on the
+				transition between, e.g. after a live brightness change, or None to leave them as they are.
+		
 		Returns:
-			(float) - delta between the items
+			(boolean) - True if the transition finished, False if a new task interrupted it
+		'''
+		timeline = Timeline([(from_state, to_state, iter_count)], self.num_pixels)
+		
+		for j in range(0, timeline.frame_count):
+			if self._check_for_task():
+				return False
+			
+			if poll_states is not None:
+				states = poll_states()
+				if states is not None:
+					timeline = Timeline([(states[0], states[1], iter_count)], self.num_pixels)
+			
+			self._fill_frame(data, timeline.frame_at_index(j, self.exact_colors))
+			self._send_data(data)
+			self._hold_frame(FRAME_INTERVAL_S)
+		
+		return True
+	
+	def _fill_frame(self, data, frame):
+		'''
+		Set the pixels of a frame from a timeline frame.
+		
+		Arguments:
+			data (list[ColorObject]) - frame to fill
+			frame (tuple) - (red, green, blue, pixel_count) as returned by Timeline.frame_at_index
 		'''
-		return float(to_item - from_item)
+		red, green, blue, pixel_count = frame
+		
+		# set unused pixels to black
+		for idx in range(pixel_count, self.num_pixels):
+			data[idx] = ColorObject(0,0,0)
 		
-	def _calc_delta_influence(self, delta, iter_count, j):
+		# set used pixels to correct color
+		color = ColorObject(red, green, blue)
+		for k in range(0, pixel_count):
+			data[k] = color
+	
+	def _fill_frame_from_values(self, data, values):
 		'''
-		Determine the influence of the delta for a given iteration.
+		Set the pixels of a frame from a frame rendered ahead.
 		
 		Arguments:
-			delta (float) - the delta to check
-			iter_count (int) - total number of iterations
-			j (int) - current value of the iteration
+			data (list[ColorObject]) - frame to fill
+			values (list[float]) - red, green and blue of each pixel in turn, as returned by FrameRing.read
+		'''
+		if not self.exact_colors:
+			# the ring stores every level as a float, but undithered frames are whole levels
+			values = [int(x) for x in values]
+		
+		color = None
+		for k in range(0, self.num_pixels):
+			red, green, blue = values[k*3:k*3 + 3]
+			if color is None or (color.r, color.g, color.b) != (red, green, blue):
+				color = ColorObject(red, green, blue)
+			data[k] = color
+
+class BaseProgram(ProgramRunner, multiprocessing.Process):
+	'''Runs the programs on the whole strip, in a process of its own (the LED process)'''
+	
+	def __init__(self, *args, **kwargs):
+		'''Takes the arguments of ProgramRunner'''
+		multiprocessing.Process.__init__(self)
+		self.daemon = True
+		
+		ProgramRunner.__init__(self, *args, **kwargs)
+	
+	def run(self):
+		if multiprocessing.current_process() is self:
+			# the web worker's threads may have held the logging locks when this process was forked from it
+			reset_logging_locks()
 			
-		Returns:
-			(int) - the portion of the delta to apply on this iteration
+			# replace the handlers inherited from the web worker, which would try to shut the worker down from in here
+			signal.signal(signal.SIGTERM, self._handle_stop_signal)
+			signal.signal(signal.SIGINT, self._handle_stop_signal)
+			self._owner_pid = os.getppid()
+			
+			# objects inherited from the web worker are shared copy-on-write, and a full garbage collection would touch
+			# all of them and copy the worker's heap into this process. Only collect the young generations, which hold
+			# the short-lived objects the frame loop allocates.
+			threshold0, threshold1, threshold2 = gc.get_threshold()
+			gc.set_threshold(threshold0, threshold1, NEVER_COLLECT_THRESHOLD)
+		
+		if self.frame_ring is not None:
+			# started before the strip is opened so the worker never holds the hardware
+			self._start_render_worker()
+		
+		self.strip = create_strip(self.strip_backend, self.num_pixels)
+		ProgramRunner.run(self)
+
+class ZoneProgram(ProgramRunner):
+	'''
+	Program runner for one zone, run on a thread of the LED process by BaseProgram.compose_zones. It runs the same
+	programs on the zone's pixels, but rather than driving the strip it copies each frame into the zone's slice of
+	the frame the compositor shows. It is made once and started again each time zones are composed.
+	'''
+	def __init__(self, logger, zone, frame, crossfade_ms, exact_colors, clock):
+		'''
+		Arguments:
+			zone (zones.Zone) - pixels the program runs on
+			frame (list[ColorObject]) - whole strip frame shared by every zone
+			crossfade_ms (int) - time over which each new program fades in, see BaseProgram
+			exact_colors (boolean) - keep fractional colors, for a compositor that dithers
+			clock (clock.SystemClock/clock.VirtualClock) - clock that frames are timed on
 		'''
-		return int(round(float(delta) * (float(j) / float(iter_count))))
\ No newline at end of file
+		super(ZoneProgram, self).__init__(logger, Queue(), zone.num_pixels, crossfade_ms, StripBackend.simulated, stop_event=threading.Event(), clock=clock)
+		self.zone = zone
+		self.frame = frame
+		self.exact_colors = exact_colors
+		self.thread = None
+		
+	def start(self):
+		'''Run on a thread, since the zone shares the LED process with the compositor and the other zones'''
+		if self.thread is not None:
+			# the last composition's thread was told to stop and checks every frame, so it is finishing if it hasn't
+			self.thread.join()
+		
+		# start from black with no commands left over from the last composition
+		self.stop_event.clear()
+		self._pending_task = None
+		while True:
+			try:
+				self.queue.get_nowait()
+			except Empty:
+				break
+		self.last_frame = [ColorObject(0,0,0) for i in range(self.num_pixels)]
+		self._fade_from = None
+		self.frame[self.zone.start:self.zone.end] = self.last_frame
+		
+		self.thread = threading.Thread(target=self.run, name='zone-{}'.format(self.zone.name))
+		self.thread.daemon = True
+		self.thread.start()
+		
+	def join(self, timeout=None):
+		self.thread.join(timeout)
+		
+	def _set_current_program(self, program):
+		# the current program file belongs to the whole strip
+		self.current_program = program
+		
+	def _show(self, data):
+		# a single slice assignment, so the compositor never copies out half a zone
+		self.frame[self.zone.start:self.zone.end] = data
+		self._showing = data
+		self._shown_at = self.clock.time()
+		
+	def _exit_gracefully(self):
+		# the compositor or the program taking over the whole strip decides what the zone's pixels show next
+		self._set_current_program("None")
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class InvalidProgramArgumentsException(Exception):
+	pass
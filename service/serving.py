@@ -0,0 +1,153 @@
+import threading
+from multiprocessing.pool import ThreadPool
+from multiprocessing import TimeoutError
+
+class ServingMode(object):
+	sync = 'sync'
+	threaded = 'threaded'
+	valid_modes = [sync, threaded]
+
+class BlockingIOPool(object):
+	'''
+	Bounded pool of threads for running blocking work (timer file reads/writes, crontab subprocesses, the
+	psutil process scan) off the request threads.
+
+	In sync mode there is only ever one request in flight, so work is simply run inline. In threaded mode the
+	pool bounds how many crontab subprocesses and file operations can run at once no matter how many clients
+	are connected, and lets fire-and-forget work run without holding up the response.
+	'''
+
+	def __init__(self, logger, mode, size=4, timeout_s=10):
+		'''
+		Initialize the pool
+
+		Arguments:
+			mode (string) - one of ServingMode.valid_modes
+			(opt) size (int) - maximum number of blocking operations running at once
+			(opt) timeout_s (int/float) - maximum time a request will wait for its blocking work
+		'''
+		if mode not in ServingMode.valid_modes:
+			raise ValueError('{} is not a valid serving mode'.format(mode))
+
+		self.logger = logger
+		self.mode = mode
+		self.size = size
+		self.timeout_s = timeout_s
+
+		self._pool = None
+		self._pool_lock = threading.Lock()
+
+	def _get_pool(self):
+		# the pool is created lazily so its threads belong to the process actually serving requests
+		# (gunicorn imports the app in the master before forking the worker when preloading)
+		with self._pool_lock:
+			if self._pool is None:
+				self.logger.info('Starting blocking I/O pool with {} threads'.format(self.size))
+				self._pool = ThreadPool(self.size)
+
+			return self._pool
+
+	def run(self, func, *args, **kwargs):
+		'''
+		Run a blocking function and wait for its result. Work still queued when the wait times out is cancelled, so
+		a caller told it timed out can safely retry, e.g. a timer write never lands after its client got a 503.
+
+		Raises:
+			IOPoolTimeout - the work did not start within timeout_s and will not run
+			IOPoolResultUnknown - the work started but did not complete within timeout_s, so it may still complete
+
+		Returns:
+			the return value of func. Exceptions raised by func are re-raised in the caller.
+		'''
+		if self.mode == ServingMode.sync:
+			return func(*args, **kwargs)
+
+		work = CancellableWork(func, args, kwargs)
+		async_result = self._get_pool().apply_async(work)
+		try:
+			return async_result.get(self.timeout_s)
+
+		except TimeoutError:
+			if work.cancel():
+				raise IOPoolTimeout('Blocking operation {} did not start within {} seconds and was cancelled'.format(func.__name__, self.timeout_s))
+
+			raise IOPoolResultUnknown('Blocking operation {} did not complete within {} seconds and may still complete'.format(func.__name__, self.timeout_s))
+
+	def submit(self, func, *args, **kwargs):
+		'''Run a blocking function without waiting for it. Errors are logged rather than raised.'''
+		if self.mode == ServingMode.sync:
+			self._run_and_log(func, args, kwargs)
+		else:
+			self._get_pool().apply_async(self._run_and_log, (func, args, kwargs))
+
+	def _run_and_log(self, func, args, kwargs):
+		try:
+			func(*args, **kwargs)
+		except Exception:
+			self.logger.error('Error in background operation {}'.format(func.__name__), exc_info=True)
+
+	def close(self, timeout_s=None):
+		'''
+		Stop accepting work and wait for running work to finish.
+
+		Arguments:
+			(opt) timeout_s (int/float) - longest to wait, e.g. so a hung crontab subprocess can't hold up shutting the
+				worker down. The pool's threads are daemon threads, so work still running then doesn't keep the process
+				alive. None waits as long as it takes.
+		'''
+		with self._pool_lock:
+			pool = self._pool
+			self._pool = None
+
+		if pool is None:
+			return
+
+		pool.close()
+		joiner = threading.Thread(target=pool.join, name='io-pool-close')
+		joiner.daemon = True
+		joiner.start()
+		joiner.join(timeout_s)
+		if joiner.is_alive():
+			self.logger.error('Blocking operations still running after {} seconds. Not waiting for them.'.format(timeout_s))
+
+
+class CancellableWork(object):
+	'''Blocking work queued on the pool, which can be cancelled up until it starts running'''
+
+	def __init__(self, func, args, kwargs):
+		self.func = func
+		self.args = args
+		self.kwargs = kwargs
+
+		self._lock = threading.Lock()
+		self._started = False
+		self._cancelled = False
+
+	def __call__(self):
+		with self._lock:
+			if self._cancelled:
+				return None
+
+			self._started = True
+
+		return self.func(*self.args, **self.kwargs)
+
+	def cancel(self):
+		'''
+		Returns:
+			(boolean) - True if the work was cancelled before it started, so it will never run. False if it had
+				already started.
+		'''
+		with self._lock:
+			if not self._started:
+				self._cancelled = True
+
+			return self._cancelled
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class IOPoolTimeout(Exception):
+	pass
+
+class IOPoolResultUnknown(IOPoolTimeout):
+	pass
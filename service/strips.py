@@ -0,0 +1,78 @@
+from time import time
+
+try:
+	import rpi_ws281x as rpi
+except ImportError:
+	# not on the Pi (tools, benchmarks), so only the simulated strip is available
+	rpi = None
+
+class StripBackend(object):
+	ws281x = 'ws281x'
+	simulated = 'simulated'
+	valid_backends = [ws281x, simulated]
+
+class SimulatedStrip(object):
+	'''
+	Stand-in for rpi_ws281x.PixelStrip that keeps the pixel values in memory instead of driving hardware.
+	Supports the subset of the PixelStrip interface the programs use.
+	'''
+
+	def __init__(self, num, pin=None, *args, **kwargs):
+		self.num = num
+		self.pixels = [0] * num
+		self.brightness = 255
+
+		# stats about what was shown
+		self.show_count = 0
+		self.last_show_time = None
+
+	def begin(self):
+		pass
+
+	def _cleanup(self):
+		pass
+
+	def numPixels(self):
+		return self.num
+
+	def setPixelColor(self, n, color):
+		self.pixels[n] = color
+
+	def setPixelColorRGB(self, n, red, green, blue):
+		self.pixels[n] = (red << 16) | (green << 8) | blue
+
+	def getPixelColor(self, n):
+		return self.pixels[n]
+
+	def setBrightness(self, brightness):
+		self.brightness = brightness
+
+	def getBrightness(self):
+		return self.brightness
+
+	def show(self):
+		self.show_count += 1
+		self.last_show_time = time()
+
+def create_strip(backend, num_pixels):
+	'''
+	Create and initialize a strip for the given backend.
+
+	Arguments:
+		backend (string) - one of StripBackend.valid_backends
+		num_pixels (int) - number of pixels on the strip
+
+	Returns:
+		PixelStrip or SimulatedStrip
+	'''
+	if backend == StripBackend.simulated:
+		strip = SimulatedStrip(num_pixels)
+	elif backend == StripBackend.ws281x:
+		if rpi is None:
+			raise ImportError('rpi_ws281x is required for the {} strip backend'.format(backend))
+		strip = rpi.PixelStrip(num_pixels, 10)
+	else:
+		raise ValueError('{} is not a valid strip backend'.format(backend))
+
+	strip.begin()
+	return strip
@@ -4,25 +4,119 @@ import logging
 import logging.handlers
 import json
 from datetime import datetime
-import multiprocessing
 import signal
-from time import sleep
+import socket
+from time import time
 
+import crontab
 import psutil
 
 from dateutil import parser
-from flask import Flask, request
+from flask import Flask, Response, request
 from flask_restful import Api, Resource, reqparse, inputs
 from werkzeug.exceptions import BadRequest
+from werkzeug.http import quote_etag
 
-from timer import Timer, Timers, TimerNotFound, InvalidTimerException
-from programs import BaseProgram, ProgramTask, ProgramList
+from alarmprep import AlarmPreparer
+from control import ControlServer
+from coordinator import Coordinator
+from timer import Timer, Timers, FireTimeIndex, TimerNotFound, InvalidTimerException
+from playlist import Playlist, Playlists, PlaylistNotFound, InvalidPlaylistException
+from preview import TimelinePreviews, PreviewFormat
+from programs import InvalidProgramArgumentsException, ProgramTask, ProgramList
+from kelvin import MIN_KELVIN, MAX_KELVIN
+from serving import BlockingIOPool, IOPoolResultUnknown, IOPoolTimeout, ServingMode
+from strips import StripBackend
+from watchdog import ProgramSupervisor, ProgramNotRunningException, UnknownZoneException
+from zones import parse_zones
 
 
 ########################### CONFIGURATION ###############################
 NUM_PIXELS = 69
+CROSSFADE_MS = 500
+
+# 'ws281x' drives the real strip over SPI, 'simulated' keeps the frames in memory (for running off the Pi)
+STRIP_BACKEND = os.environ.get('SUNRISE_STRIP_BACKEND', StripBackend.ws281x)
+
+# output frame rate for temporal dithering, which shows fades at the dim end in steps finer than one level by
+# re-sending each 100 ms frame with a varying rounding. 0 sends each frame once, rounded to whole levels.
+# Off by default: it sends 10x the frames at 100 Hz and has only been measured on the simulated strip.
+DITHER_HZ = int(os.environ.get('SUNRISE_DITHER_HZ', 0))
+
+# frames of timeline programs (wakeup, sleepy time) a render worker process renders ahead of the output, so the
+# LED process only copies out the frame due. 0 renders each frame in the LED process as it is sent.
+RENDER_AHEAD_FRAMES = 20
+
+# most current the strip may draw from its supply, in mA. Frames that would draw more are dimmed as a whole to fit.
+# 0 only estimates the current, which /status reports either way. The current one color channel of a pixel draws at
+# full level depends on the pixels, 20 mA being typical for ws2811/ws2812 pixels.
+POWER_BUDGET_MA = int(os.environ.get('SUNRISE_POWER_BUDGET_MA', 0))
+MA_PER_CHANNEL = float(os.environ.get('SUNRISE_MA_PER_CHANNEL', 20))
+
+# ranges of pixels that can each run a program of their own, as comma separated name:first-last pixel ranges
+# (e.g. 'left:0-34,right:35-68'). Programs sent to /zones/<name>/programs/<program> only run on their zone.
+ZONES = parse_zones(os.environ.get('SUNRISE_ZONES', ''), NUM_PIXELS)
+
+# the LED process is restarted if its frame loop hasn't made progress for this long
+WATCHDOG_STALL_TIMEOUT_S = 5
+WATCHDOG_CHECK_INTERVAL_S = 1
+
+# longest a shutdown or restart waits on the LED process to blank the strip and exit before it is killed
+LED_STOP_TIMEOUT_S = 0.5
+
+# crontab command the timers are mirrored into. Replaced with a stand-in when running off the Pi, e.g. by loadtest.py
+CRONTAB_COMMAND = os.environ.get('SUNRISE_CRONTAB_COMMAND')
+
+# ping the systemd watchdog while the LED process is healthy when the unit has WatchdogSec (and NotifyAccess=all) set
+SYSTEMD_WATCHDOG = 'WATCHDOG_USEC' in os.environ
+
 TIMER_FILE_NAME = 'timers.json'
 
+# saved playlists, run with /programs/playlist?playlistId=<id>
+PLAYLIST_FILE_NAME = 'playlists.json'
+
+# the last requested program, its arguments and start time, so a restarted service resumes it
+PROGRAM_STATE_FILE_NAME = 'program_state.json'
+MAX_NEXT_FIRES = 50
+
+# timer ids taken by routes under /timers, e.g. GET /timers/next would never reach a timer with id 'next'
+RESERVED_TIMER_IDS = ['next']
+
+# each alarm is validated this long before it fires: its command is built and checked, a sample of its frames checked
+# and the LED process checked, so problems are reported before wakeup time (see alarmprep.py). 0 turns it off.
+ALARM_PREP_LEAD_S = int(os.environ.get('SUNRISE_ALARM_PREP_LEAD_S', 600))
+ALARM_PREP_CHECK_INTERVAL_S = 10
+
+# 'sync' for one request at a time (gunicorn sync worker) or 'threaded' for concurrent requests
+# (gunicorn gthread worker or the development server) with blocking I/O moved to a bounded thread pool
+SERVING_MODE = os.environ.get('SUNRISE_SERVING_MODE', ServingMode.sync)
+IO_POOL_SIZE = 4
+IO_POOL_TIMEOUT_S = 10
+
+# longest shutdown waits for running blocking work, e.g. a hung crontab subprocess, before leaving it behind
+IO_POOL_CLOSE_TIMEOUT_S = 2
+
+# other sunrise nodes that /group requests are fanned out to, as comma separated host:port pairs
+# (e.g. '192.168.1.21:8081,192.168.1.22:8081')
+PEER_NODES = [x.strip() for x in os.environ.get('SUNRISE_PEER_NODES', '').split(',') if x.strip()]
+PEER_TIMEOUT_S = 2
+
+# the group endpoints only forward program commands, brightness, timer and playlist changes
+GROUP_PATH_PREFIXES = ['programs', 'timers', 'playlists', 'brightness']
+
+# timeline programs sent to the group without a start time are given one this far in the future so every node starts together
+GROUP_START_LEAD_S = 0.5
+
+# persistent TCP port taking line commands for interactive control (see control.py). 0 turns it off.
+CONTROL_PORT = int(os.environ.get('SUNRISE_CONTROL_PORT', 8082))
+
+# previews of timeline programs (/programs/<program>/preview) kept in memory, and the largest one that can be asked for
+PREVIEW_CACHE_SIZE = 32
+PREVIEW_DEFAULT_SAMPLES = 100
+MAX_PREVIEW_SAMPLES = 1000
+PREVIEW_DEFAULT_HEIGHT = 20
+MAX_PREVIEW_HEIGHT = 200
+
 ########################### MODULE SETUP ###############################
 # Setup logging handlers
 formatter = logging.Formatter('%(asctime)s %(levelname)s %(process)d [%(thread)d] %(funcName)s: %(message)s')
@@ -35,6 +129,12 @@ ch2 = logging.handlers.TimedRotatingFileHandler('../logs/sunrise.log', when='mid
 ch2.setLevel(logging.DEBUG)
 ch2.setFormatter(formatter)
 
+SINGLE_COLOR_ARGS_ERROR = "red, green, and blue values must be integers between 0 and 255."
+CHANGING_COLOR_ARGS_ERROR = "dwellTimeMs and transitionTimeMs values must be positive integers. brightnessScalePct must be between 0 and 100."
+MULTIPLIER_ARGS_ERROR = "if provided, 'multiplier' must be an integer greater than 0"
+START_TIME_ARGS_ERROR = "if provided, 'startTime' must be a time in epoch seconds and 'offsetS' must be a number of seconds greater than or equal to 0"
+KELVIN_SUNRISE_ARGS_ERROR = "if provided, 'multiplier' must be an integer greater than 0, 'startKelvin' and 'endKelvin' must be integers between {} and {} and 'brightnessPct' must be between 0 and 100.".format(MIN_KELVIN, MAX_KELVIN)
+
 CONTENT_TYPE_LIST = ['application/json', 'application/json;charset=utf-8', 'application/json; charset=utf-8', 'application/json;charset=UTF-8', 'application/json; charset=UTF-8']
 
 
@@ -45,33 +145,73 @@ app.logger.setLevel(logging.DEBUG)
 app.logger.addHandler(ch1)
 app.logger.addHandler(ch2)
 
-app.logger.info('Starting application')
+app.logger.info('Starting application in {} serving mode'.format(SERVING_MODE))
+
+if CRONTAB_COMMAND:
+	crontab.CRONCMD = CRONTAB_COMMAND
 api = Api(app, catch_all_404s=True)
 
-# queue for communicating with the subprocess
-QUEUE = multiprocessing.JoinableQueue()
+# pool for running blocking timer, cron and process scan work off the request threads
+IO_POOL = BlockingIOPool(app.logger, SERVING_MODE, IO_POOL_SIZE, IO_POOL_TIMEOUT_S)
 
-# Create program subprocess and start it running blackout program
-PROGRAM_PROCESS = BaseProgram(app.logger, QUEUE, NUM_PIXELS)
-PROGRAM_PROCESS.start()
-QUEUE.put_nowait(ProgramTask('blackout'))
-	
-def signal_handler(signal, frame):
-	app.logger.info('SIGINT received. Cleaning up children processes and exiting...')
-	QUEUE.put_nowait(ProgramTask('KILL'))
-	app.logger.info('Joining the queue to wait for items to finish processing')
-	QUEUE.join()
-	app.logger.info('Queue successfully joined!...attempting to join child process with timeout of 10 seconds')
+# pooled keep-alive connections to the peer nodes for group requests
+COORDINATOR = Coordinator(app.logger, PEER_NODES, PEER_TIMEOUT_S)
+
+# index of upcoming timer fire times shared by the /timers/next endpoint and anything scheduling ahead of alarms.
+# it is built on first use and kept current by the timer mutations made through this process.
+FIRE_INDEX = FireTimeIndex()
+
+# rendered previews of timeline programs, computed in this process so they never touch the strip
+PREVIEWS = TimelinePreviews(NUM_PIXELS, PREVIEW_CACHE_SIZE)
+
+# Create program subprocess, start it running the last requested program (or blackout) and restart it if it stalls or dies
+SUPERVISOR = ProgramSupervisor(app.logger, NUM_PIXELS, CROSSFADE_MS, STRIP_BACKEND, WATCHDOG_STALL_TIMEOUT_S, WATCHDOG_CHECK_INTERVAL_S, SYSTEMD_WATCHDOG, LED_STOP_TIMEOUT_S, PROGRAM_STATE_FILE_NAME, DITHER_HZ, RENDER_AHEAD_FRAMES, ZONES, POWER_BUDGET_MA, MA_PER_CHANNEL)
+SUPERVISOR.start()
+
+# low latency control channel for the app's color picker. Only one worker can hold the port.
+# build_program_task is defined further down, so it is looked up when a command arrives.
+CONTROL_SERVER = None
+if CONTROL_PORT:
 	try:
-		PROGRAM_PROCESS.join(10)
-		app.logger.info('Child process sucessfully joined or timed out')
-	except AttributeError:
-		pass
+		CONTROL_SERVER = ControlServer(app.logger, SUPERVISOR, lambda program, query_dict: build_program_task(program, query_dict), '0.0.0.0', CONTROL_PORT)
+		CONTROL_SERVER.start()
+	except socket.error:
+		app.logger.error('Could not listen for control commands on port {}'.format(CONTROL_PORT), exc_info=True)
+		CONTROL_SERVER = None
+
+# build_program_task and refresh_fire_index are defined further down, so they are looked up when an alarm is prepared
+ALARM_PREPARER = AlarmPreparer(app.logger, FIRE_INDEX, lambda: IO_POOL.run(refresh_fire_index), lambda program, query_dict: build_program_task(program, query_dict), SUPERVISOR, NUM_PIXELS, ALARM_PREP_LEAD_S, ALARM_PREP_CHECK_INTERVAL_S)
+if ALARM_PREP_LEAD_S:
+	ALARM_PREPARER.start()
+
+# gunicorn's own worker handlers, which are chained to once the LED process is down
+PREVIOUS_SIGNAL_HANDLERS = {}
 	
-	app.logger.info('Program exiting.')
-	sys.exit(0)
-		
-signal.signal(signal.SIGINT, signal_handler)
+def signal_handler(signum, frame):
+	'''
+	Stop the LED process before the worker exits. gunicorn sends workers SIGTERM to stop gracefully (systemctl stop,
+	worker restarts) and SIGINT or SIGQUIT to stop quickly, and a terminal sends SIGINT.
+	'''
+	app.logger.info('Signal {} received. Stopping the LED process and exiting...'.format(signum))
+	start = time()
+	if CONTROL_SERVER is not None:
+		CONTROL_SERVER.close()
+	ALARM_PREPARER.stop()
+	SUPERVISOR.stop()
+	
+	IO_POOL.close(IO_POOL_CLOSE_TIMEOUT_S)
+	COORDINATOR.close()
+	app.logger.info('Cleaned up in {:.3f} seconds. Program exiting.'.format(time() - start))
+	
+	previous_handler = PREVIOUS_SIGNAL_HANDLERS.get(signum)
+	if callable(previous_handler) and previous_handler is not signal.default_int_handler:
+		# let gunicorn finish shutting the worker down
+		previous_handler(signum, frame)
+	else:
+		sys.exit(0)
+
+for signum in [signal.SIGTERM, signal.SIGINT, signal.SIGQUIT]:
+	PREVIOUS_SIGNAL_HANDLERS[signum] = signal.signal(signum, signal_handler)
 
 
 #################### TIME ENDPOINTS #########################
@@ -111,21 +251,53 @@ class TimersAPI(Resource):
 		'''
 		Query for all of the existing timers.
 		
+		Supports If-None-Match against the store version ETag and an optional 'since' URL parameter
+		that limits the response to the timers added, changed or deleted after that store version. If the store's
+		version bookkeeping was started again after that version, 'resync' is true and every timer is returned.
+		
 		Returns:
 			JSON dict for Flask to send as response to client
 		'''
 		try:
 			app.logger.info('Handling GET request on /timers endpoint')
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timer_dict = timers_obj.read_timers_from_file()
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			
+			version = IO_POOL.run(timers_obj.get_store_version)
+			etag = str(version)
+			if request.if_none_match.contains_weak(etag):
+				app.logger.info('Timers unchanged since version {}'.format(etag))
+				return {}, 304, {'ETag': quote_etag(etag)}
+			
+			if 'since' in request.args:
+				try:
+					since = int(request.args['since'])
+					if since < 0:
+						raise ValueError
+				
+				except (ValueError, TypeError):
+					return { "error": "if provided, 'since' must be an integer greater than or equal to 0" }, 400
+				
+				version, timer_dict, deleted_list, resync = IO_POOL.run(timers_obj.get_changes_since, since)
+				etag = str(version)
+				resp_dict = {"version": version, "since": since, "deleted": deleted_list, "resync": resync}
+				
+			else:
+				# the version and timers are read as one snapshot, so the ETag matches the timers sent
+				version, timer_dict = IO_POOL.run(timers_obj.read_snapshot)
+				etag = str(version)
+				resp_dict = {"version": version}
 			
 			for timer_id in timer_dict.iterkeys():
 				timer_dict[timer_id] = timer_dict[timer_id].to_json()
 			
-			resp_dict = {"timers": timer_dict}
+			resp_dict["timers"] = timer_dict
 			app.logger.info(resp_dict)
 			
-			return resp_dict, 200
+			return resp_dict, 200, {'ETag': quote_etag(etag)}
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
 			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
@@ -156,20 +328,26 @@ class TimersAPI(Resource):
 			
 			app.logger.info(request.json)
 			
+			if request_dict['timerId'] in RESERVED_TIMER_IDS:
+				return {"error": "{} can't be used as a timer id".format(request_dict['timerId'])}, 400
+			
 			try:
 				arguments = request.json['arguments']
 			except KeyError:
 				arguments = None
 			
 			try:
-				timer = Timer(app.logger, request_dict['timerId'], request_dict['triggerHour'], request_dict['triggerMinute'], request.json['timerSchedule'], request_dict['programToLaunch'], request_dict['isEnabled'], arguments)
+				timer = IO_POOL.run(Timer, app.logger, request_dict['timerId'], request_dict['triggerHour'], request_dict['triggerMinute'], request.json['timerSchedule'], request_dict['programToLaunch'], request_dict['isEnabled'], arguments)
 			except InvalidTimerException as e:
 				return {"error": e.message}, 400
 			except KeyError as e:
 				return {"error": e.message}, 400
+			except IOPoolResultUnknown as e:
+				# making the timer only reads the crontab, so nothing has been changed yet
+				raise IOPoolTimeout(e.message)
 			
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timers_obj.add_or_modify_timer(timer)
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			IO_POOL.run(timers_obj.add_or_modify_timer, timer)
 			resp = timer.to_json()
 			
 			app.logger.info(resp)
@@ -179,6 +357,14 @@ class TimersAPI(Resource):
 			app.logger.info('Bad request caught by Flask')
 			raise
 			
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The timer change is still being applied and its result is unknown. Check GET /timers/<timerId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
@@ -192,13 +378,26 @@ class TimerAPI(Resource):
 		app.logger.info('Handling GET request on /timers/{} endpoint'.format(timer_id))
 		
 		try:
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timer = timers_obj.get_timer_by_id(timer_id)
-			return timer.to_json(), 200
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			
+			# the version is checked before the timer is loaded, so a 304 never parses the timer or reads the crontab
+			if_none_match = request.if_none_match
+			version, timer = IO_POOL.run(timers_obj.get_timer_if_changed, timer_id, lambda x: if_none_match.contains_weak(str(x)))
+			etag = str(version)
+			
+			if timer is None:
+				app.logger.info('Timer {} unchanged since version {}'.format(timer_id, etag))
+				return {}, 304, {'ETag': quote_etag(etag)}
+			
+			return timer.to_json(), 200, {'ETag': quote_etag(etag)}
 			
 		except TimerNotFound:
 			return {"error": "No timer found matching given id: {}".format(timer_id)}, 404
 			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
@@ -208,13 +407,21 @@ class TimerAPI(Resource):
 		app.logger.info('Handling DELETE request on /timers/{} endpoint'.format(timer_id))
 		
 		try:
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timers_obj.delete_timer(timer_id)		
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			IO_POOL.run(timers_obj.delete_timer, timer_id)
 			return {}, 204
 			
 		except TimerNotFound:
 			return {"error": "No timer found matching given id: {}".format(timer_id)}, 404
 		
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The timer deletion is still being applied and its result is unknown. Check GET /timers/<timerId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
@@ -227,13 +434,21 @@ class TimerEnableAPI(Resource):
 		app.logger.info('Handling GET request on /timers/{}/enable endpoint'.format(timer_id))
 		
 		try:
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timer = timers_obj.enable_timer(timer_id)
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			timer = IO_POOL.run(timers_obj.enable_timer, timer_id)
 			return timer.to_json(), 200
 			
 		except TimerNotFound:
 			return {"error": "No timer found matching given id: {}".format(timer_id)}, 404
 			
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The timer change is still being applied and its result is unknown. Check GET /timers/<timerId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
@@ -246,17 +461,205 @@ class TimerDisableAPI(Resource):
 		app.logger.info('Handling GET request on /timers/{}/disable endpoint'.format(timer_id))
 		
 		try:
-			timers_obj = Timers(app.logger, TIMER_FILE_NAME)
-			timer = timers_obj.disable_timer(timer_id)
+			timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+			timer = IO_POOL.run(timers_obj.disable_timer, timer_id)
 			return timer.to_json(), 200
 			
 		except TimerNotFound:
 			return {"error": "No timer found matching given id: {}".format(timer_id)}, 404
 			
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The timer change is still being applied and its result is unknown. Check GET /timers/<timerId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+@api.resource('/timers/next')
+class NextTimersAPI(Resource):
+	
+	def get(self):
+		'''
+		Get the next timer fires.
+		
+		URL parameters:
+			(opt) count (int) - number of fires to return, defaults to 1
+			(opt) after (string) - ISO8601 local time to search from, defaults to now
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling GET request on /timers/next endpoint')
+			
+			try:
+				count = int(request.args.get('count', 1))
+				if count < 1 or count > MAX_NEXT_FIRES:
+					raise ValueError
+				
+			except (ValueError, TypeError):
+				return { "error": "if provided, 'count' must be an integer between 1 and {}".format(MAX_NEXT_FIRES) }, 400
+			
+			try:
+				if 'after' in request.args:
+					after = parser.parse(request.args['after'])
+				else:
+					after = FIRE_INDEX.clock.now()
+				
+			except (ValueError, TypeError, OverflowError):
+				return { "error": "if provided, 'after' must be an ISO8601 date and time" }, 400
+			
+			IO_POOL.run(refresh_fire_index)
+			
+			fires = []
+			for fire_time, timer in FIRE_INDEX.next_fires(after, count):
+				fires.append({
+					"fireTime": datetime_to_string(fire_time),
+					"secondsUntil": int((fire_time - after).total_seconds()),
+					"timer": timer.to_json(),
+					"preparation": ALARM_PREPARER.result_for(timer.timer_id, fire_time)
+				})
+			
+			resp = {"after": datetime_to_string(after), "fires": fires}
+			app.logger.info(resp)
+			return resp, 200
+		
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
 
+#################### PLAYLIST ENDPOINTS #########################
+@api.resource('/playlists')
+class PlaylistsAPI(Resource):
+	'''API for managing playlists.'''
+	
+	def get(self):
+		'''Get all of the saved playlists'''
+		try:
+			app.logger.info('Handling GET request on /playlists endpoint')
+			playlists_obj = Playlists(app.logger, PLAYLIST_FILE_NAME)
+			playlist_dict = IO_POOL.run(playlists_obj.read_playlists_from_file)
+			
+			for playlist_id in playlist_dict.iterkeys():
+				playlist_dict[playlist_id] = playlist_dict[playlist_id].to_json()
+			
+			return {"playlists": playlist_dict}, 200
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+	
+	def post(self):
+		'''
+		Create or modify a playlist. It is run with GET /programs/playlist?playlistId=<id>, which timers can launch too.
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling POST request on /playlists endpoint')
+			
+			parser = reqparse.RequestParser(bundle_errors=True, trim=True)
+			parser.add_argument('Content-Type', choices=CONTENT_TYPE_LIST, location='headers', required=True)
+			parser.add_argument('playlistId', location='json', required=True)
+			parser.add_argument('loop', type=inputs.boolean, location='json', required=False)
+			request_dict = parser.parse_args()
+			
+			app.logger.info(request.json)
+			
+			try:
+				playlist = Playlist(request_dict['playlistId'], request.json.get('steps'), request_dict['loop'])
+				
+				# check the arguments of every step now rather than when the playlist is run
+				build_playlist_steps(playlist)
+				
+			except (InvalidPlaylistException, InvalidProgramArgumentsException) as e:
+				return {"error": e.message}, 400
+			
+			playlists_obj = Playlists(app.logger, PLAYLIST_FILE_NAME)
+			IO_POOL.run(playlists_obj.add_or_modify_playlist, playlist)
+			resp = playlist.to_json()
+			
+			app.logger.info(resp)
+			return resp, 200
+			
+		except BadRequest:
+			app.logger.info('Bad request caught by Flask')
+			raise
+			
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The playlist change is still being applied and its result is unknown. Check GET /playlists/<playlistId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+
+@api.resource('/playlists/<playlist_id>')
+class PlaylistAPI(Resource):
+	
+	def get(self, playlist_id):
+		'''Get a specific playlist'''
+		app.logger.info('Handling GET request on /playlists/{} endpoint'.format(playlist_id))
+		
+		try:
+			playlists_obj = Playlists(app.logger, PLAYLIST_FILE_NAME)
+			return IO_POOL.run(playlists_obj.get_playlist_by_id, playlist_id).to_json(), 200
+			
+		except PlaylistNotFound:
+			return {"error": "No playlist found matching given id: {}".format(playlist_id)}, 404
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+	
+	def delete(self, playlist_id):
+		'''Delete a playlist'''
+		app.logger.info('Handling DELETE request on /playlists/{} endpoint'.format(playlist_id))
+		
+		try:
+			playlists_obj = Playlists(app.logger, PLAYLIST_FILE_NAME)
+			IO_POOL.run(playlists_obj.delete_playlist, playlist_id)
+			return {}, 204
+			
+		except PlaylistNotFound:
+			return {"error": "No playlist found matching given id: {}".format(playlist_id)}, 404
+			
+		except IOPoolResultUnknown:
+			app.logger.error("Timed out waiting for a change that may still be applied", exc_info=True)
+			return { "status": "The playlist deletion is still being applied and its result is unknown. Check GET /playlists/<playlistId> before retrying." }, 202
+			
+		except IOPoolTimeout:
+			app.logger.error("Timed out waiting for blocking operation", exc_info=True)
+			return { "error": "Service busy, try again." }, 503
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+	
+
 #################### PROGRAM ENDPOINTS #########################
 @api.resource('/programs')
 class ProgramsAPI(Resource):	
@@ -289,96 +692,319 @@ class ProgramAPI(Resource):
 			if program not in ProgramList.valid_programs:
 				return {"error": "{} is not a recognized program".format(program)}, 404
 			
-			find_and_remove_orphaned_process(app.logger)
+			# in threaded mode the process scan runs in the background so the LED command is sent without waiting on it
+			IO_POOL.submit(find_and_remove_orphaned_process, app.logger)
 				
-			# get the dict of url arguments in case they are needed
-			query_dict = request.args.to_dict()
-			arg_dict = {}
+			try:
+				task = build_program_task(program, request.args.to_dict())
+			
+			except InvalidProgramArgumentsException as e:
+				return { "error": e.message }, 400
 			
-			if program == 'blackout':
-				QUEUE.put_nowait(ProgramTask('blackout'))
+			SUPERVISOR.send(task)
 				
-			elif program == 'single_color':
+			return {}, 200
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+			
+
+	
+	
+	
+@api.resource('/zones')
+class ZonesAPI(Resource):
+	'''API for listing the zones of the strip.'''
+	
+	def get(self):
+		'''Get the zones, their pixels and the program last requested in each'''
+		try:
+			app.logger.info('Handling GET request on /zones endpoint')
+			
+			return { "zones": SUPERVISOR.get_zones() }, 200
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+
+@api.resource('/zones/<zone>/programs/<program>')
+class ZoneProgramAPI(Resource):
+	
+	def get(self, zone, program):
+		'''
+		Run a program in one zone, leaving the programs in the other zones running.
+		
+		URL parameters:
+			the same as GET /programs/<program>
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling GET request on /zones/{}/programs/{} endpoint'.format(zone, program))
+			if program not in ProgramList.valid_programs:
+				return {"error": "{} is not a recognized program".format(program)}, 404
+			
+			try:
+				task = build_program_task(program, request.args.to_dict())
+			
+			except InvalidProgramArgumentsException as e:
+				return { "error": e.message }, 400
+			
+			task.zone = zone
+			try:
+				SUPERVISOR.send(task)
+			except UnknownZoneException as e:
+				return {"error": e.message}, 404
+			
+			return {}, 200
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+	
+	
+@api.resource('/programs/<program>/parameters')
+class ProgramParametersAPI(Resource):
+	'''API for adjusting the running program without restarting it.'''
+	
+	def get(self, program):
+		'''
+		Change parameters of the running program. They take effect on its next frame, without restarting it.
+		
+		URL parameters:
+			the same as starting the program: red, green and blue for single_color, and dwellTimeMs,
+			transitionTimeMs and brightnessScalePct for changing_color
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling GET request on /programs/{}/parameters endpoint'.format(program))
+			query_dict = request.args.to_dict()
+			
+			if program == 'single_color':
 				try:
-					if 'red' in query_dict:
-						arg_dict['red'] = int(query_dict['red'])
-						if arg_dict['red'] < 0 or arg_dict['red'] > 255:
-							raise ValueError
-						
-					if 'green' in query_dict:
-						arg_dict['green'] = int(query_dict['green'])
-						if arg_dict['green'] < 0 or arg_dict['green'] > 255:
-							raise ValueError
-					
-					if 'blue' in query_dict:
-						arg_dict['blue'] = int(query_dict['blue'])
-						if arg_dict['blue'] < 0 or arg_dict['blue'] > 255:
-							raise ValueError
-						
+					arg_dict = parse_single_color_args(query_dict)
 				except (KeyError, ValueError, TypeError):
-					return { "error": "red, green, and blue values must be integers between 0 and 255." }, 400
-					
-				QUEUE.put_nowait(ProgramTask('single_color', arg_dict))
-				
+					return { "error": SINGLE_COLOR_ARGS_ERROR }, 400
+			
 			elif program == 'changing_color':
 				try:
-					if 'dwellTimeMs' in query_dict:
-						arg_dict['dwell_time_ms'] = int(query_dict['dwellTimeMs'])
-						if arg_dict['dwell_time_ms'] < 0:
-							raise ValueError
-						
-					if 'transitionTimeMs' in query_dict:
-						arg_dict['transition_time_ms'] = int(query_dict['transitionTimeMs'])
-						if arg_dict['transition_time_ms'] < 0:
-							raise ValueError
-							
-					if 'brightnessScalePct' in query_dict:
-						arg_dict['brightness_scale_pct'] = int(query_dict['brightnessScalePct'])
-						if arg_dict['brightness_scale_pct'] < 0 or arg_dict['brightness_scale_pct'] > 100 :
-							raise ValueError
-				
+					arg_dict = parse_changing_color_args(query_dict)
 				except (KeyError, ValueError, TypeError):
-					return { "error": "dwellTimeMs and transitionTimeMs values must be positive integers. brightnessScalePct must be between 0 and 100." }, 400
-						
-				QUEUE.put_nowait(ProgramTask('changing_color', arg_dict))
+					return { "error": CHANGING_COLOR_ARGS_ERROR }, 400
 			
-			elif program == 'sleepy_time':
-				try:
-					if 'multiplier' in query_dict:
-						query_dict['multiplier'] = int(query_dict['multiplier'])
-						if query_dict['multiplier'] < 0:
-							raise ValueError
-				
-				except (ValueError, TypeError):
-					return { "error": "if provided, 'multiplier' must be an integer greater than 0" }, 400
-				
-				QUEUE.put_nowait(ProgramTask('sleepy_time', query_dict))
-				
-			elif program == 'wakeup':
-				try:
-					if 'multiplier' in query_dict:
-						query_dict['multiplier'] = int(query_dict['multiplier'])
-						if query_dict['multiplier'] < 0:
-							raise ValueError
-				
-				except (ValueError, TypeError):
-					return { "error": "if provided, 'multiplier' must be an integer greater than 0" }, 400
-				
-				QUEUE.put_nowait(ProgramTask('wakeup', query_dict))
+			else:
+				return {"error": "{} has no parameters that can be changed while it runs".format(program)}, 404
 			
+			try:
+				SUPERVISOR.update_parameters(program, arg_dict)
+			except ProgramNotRunningException as e:
+				return {"error": e.message}, 409
 			
-			elif program == 'wakeup_demo':
-				QUEUE.put_nowait(ProgramTask('wakeup', {'multiplier': 1}))
-				
 			return {}, 200
 			
 		except Exception:
 			app.logger.error("Error handling request", exc_info=True)
 			return { "error": "Error handling request." }, 500
 
+
+@api.resource('/programs/<program>/preview')
+class ProgramPreviewAPI(Resource):
+	'''API for previewing a timeline program without running it.'''
+	
+	def get(self, program):
+		'''
+		Render a downsampled preview of a timeline program, e.g. to show what a wakeup multiplier looks like before
+		saving a timer. The strip and the running program aren't affected.
+		
+		URL parameters:
+			the same as GET /programs/<program>, other than startTime and offsetS, plus
+			(opt) samples (int) - number of frames to sample, evenly spread over the program
+			(opt) format (string) - 'json' for the color and lit pixel count of each sample, or 'png' for an image
+				with a column per sample
+			(opt) height (int) - rows of the PNG, each showing a stretch of the strip
+		
+		Returns:
+			JSON dict for Flask to send as response to client, or the PNG image
+		'''
+		try:
+			app.logger.info('Handling GET request on /programs/{}/preview endpoint'.format(program))
+			if program not in ProgramList.valid_programs:
+				return {"error": "{} is not a recognized program".format(program)}, 404
+			
+			try:
+				task = build_program_task(program, request.args.to_dict())
+			except InvalidProgramArgumentsException as e:
+				return { "error": e.message }, 400
+			
+			if task.program not in ProgramList.timeline_programs:
+				return {"error": "{} has no timeline to preview".format(program)}, 404
+			
+			preview_format = request.args.get('format', PreviewFormat.json)
+			if preview_format not in PreviewFormat.all:
+				return { "error": "if provided, 'format' must be one of {}".format(', '.join(PreviewFormat.all)) }, 400
+			
+			try:
+				samples = int(request.args.get('samples', PREVIEW_DEFAULT_SAMPLES))
+				height = int(request.args.get('height', PREVIEW_DEFAULT_HEIGHT))
+				if samples < 1 or samples > MAX_PREVIEW_SAMPLES or height < 1 or height > MAX_PREVIEW_HEIGHT:
+					raise ValueError
+			except ValueError:
+				return { "error": "if provided, 'samples' must be an integer between 1 and {} and 'height' an integer between 1 and {}".format(MAX_PREVIEW_SAMPLES, MAX_PREVIEW_HEIGHT) }, 400
+			
+			preview = PREVIEWS.get(task.program, task.arg_dict, samples, preview_format, height)
+			if preview_format == PreviewFormat.png:
+				return Response(preview, mimetype='image/png')
+			
+			return preview, 200
 			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+
+@api.resource('/brightness')
+class BrightnessAPI(Resource):
+	'''API for the global brightness.'''
+	
+	def get(self):
+		'''
+		Get or set the global brightness, which scales every program and takes effect on the next frame.
+		
+		URL parameters:
+			(opt) brightnessPct (int) - brightness to set, from 0 to 100
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling GET request on /brightness endpoint')
+			
+			if 'brightnessPct' in request.args:
+				try:
+					brightness_pct = int(request.args['brightnessPct'])
+					if brightness_pct < 0 or brightness_pct > 100:
+						raise ValueError
+				except ValueError:
+					return { "error": "brightnessPct must be an integer between 0 and 100." }, 400
+				
+				SUPERVISOR.set_brightness_pct(brightness_pct)
+			
+			return {"brightnessPct": SUPERVISOR.get_brightness_pct()}, 200
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+
+	
+#################### STATUS ENDPOINTS #########################
+@api.resource('/status')
+class StatusAPI(Resource):
+	'''API for checking the health of the service.'''
+	
+	def get(self):
+		'''
+		Get the health of the LED process and the memory used by each process of the service.
+		
+		URL parameters:
+			(opt) framesSince (float) - only summarize the timing of frames sent at or after this time (epoch seconds)
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling GET request on /status endpoint')
+			
+			frames_since = None
+			if 'framesSince' in request.args:
+				try:
+					frames_since = float(request.args['framesSince'])
+				except ValueError:
+					return { "error": "if provided, 'framesSince' must be a time in epoch seconds" }, 400
+			
+			resp = {"renderer": SUPERVISOR.get_status(frames_since), "memory": get_memory_status(), "alarms": ALARM_PREPARER.to_json()}
+			app.logger.info(resp)
+			return resp, 200
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
 
+
+#################### GROUP ENDPOINTS #########################
+@api.resource('/group/<path:path>')
+class GroupAPI(Resource):
+	'''
+	API for sending the same program command or timer change to this node and all of its peer nodes at once,
+	e.g. GET /group/programs/blackout or POST /group/timers
+	'''
+	
+	def get(self, path):
+		return self._fan_out('GET', path)
 	
+	def post(self, path):
+		return self._fan_out('POST', path)
+	
+	def delete(self, path):
+		return self._fan_out('DELETE', path)
+	
+	def _fan_out(self, method, path):
+		'''
+		Forward a request to the peers and run it locally while they respond.
+		
+		Returns:
+			JSON dict for Flask to send as response to client
+		'''
+		try:
+			app.logger.info('Handling {} request on /group/{} endpoint'.format(method, path))
+			
+			if path.split('/')[0] not in GROUP_PATH_PREFIXES:
+				return {"error": "only {} requests can be sent to the group".format(', '.join(GROUP_PATH_PREFIXES))}, 404
+			
+			query_string = request.query_string
+			
+			# give timeline programs a shared start time so the nodes play them frame-locked
+			path_items = path.split('/')
+			if path_items[0] == 'programs' and len(path_items) > 1 and path_items[1] in ProgramList.clocked_programs and 'startTime' not in request.args:
+				start_param = 'startTime={:.3f}'.format(time() + GROUP_START_LEAD_S)
+				query_string = query_string + '&' + start_param if query_string else start_param
+			
+			full_path = '/' + path
+			if query_string:
+				full_path += '?' + query_string
+			
+			body = request.get_json(silent=True)
+			
+			pending = COORDINATOR.start_fan_out(method, full_path, body)
+			local_result = self._run_locally(method, full_path, body)
+			results = COORDINATOR.collect(pending)
+			results['local'] = local_result
+			
+			failed = sorted([node for node, result in results.iteritems() if 'error' in result or result['status'] >= 400])
+			resp = {"nodes": results, "failed": failed}
+			app.logger.info(resp)
+			
+			return resp, 200 if not failed else 502
+			
+		except Exception:
+			app.logger.error("Error handling request", exc_info=True)
+			return { "error": "Error handling request." }, 500
+	
+	def _run_locally(self, method, full_path, body):
+		start = time()
+		client = app.test_client()
+		if body is None:
+			resp = client.open(full_path, method=method)
+		else:
+			resp = client.open(full_path, method=method, data=json.dumps(body), content_type='application/json')
+		
+		payload = json.loads(resp.data) if resp.data else None
+		return {"status": resp.status_code, "response": payload, "elapsedMs": round((time() - start) * 1000.0, 1)}
 	
 	
 #################### STANDARD ENDPOINTS ###########################	
@@ -427,6 +1053,223 @@ def datetime_to_string(d_time):
 	return s_time
 	
 	
+def refresh_fire_index():
+	'''
+	Rebuild the fire time index if the timer store changed without going through this process's index
+	(e.g. on startup or after another worker modified the timers).
+	'''
+	timers_obj = Timers(app.logger, TIMER_FILE_NAME, fire_index=FIRE_INDEX)
+	with Timers._store_lock:
+		version = timers_obj.get_store_version()
+		if FIRE_INDEX.is_stale(version):
+			app.logger.info('Rebuilding fire time index at store version {}'.format(version))
+			FIRE_INDEX.rebuild(timers_obj.read_timers_from_file(), version)
+
+	
+def build_program_task(program, query_dict):
+	'''
+	Make the task for a program command from its URL parameters.
+	
+	Arguments:
+		program (string) - one of ProgramList.valid_programs
+		query_dict (dict) - URL parameters
+	
+	Raises:
+		InvalidProgramArgumentsException
+	
+	Returns:
+		(ProgramTask) - task to send to the LED process
+	'''
+	if program not in ProgramList.valid_programs:
+		raise InvalidProgramArgumentsException("{} is not a recognized program".format(program))
+	
+	arg_dict = {}
+	
+	if program == 'single_color':
+		try:
+			arg_dict = parse_single_color_args(query_dict)
+		except (KeyError, ValueError, TypeError):
+			raise InvalidProgramArgumentsException(SINGLE_COLOR_ARGS_ERROR)
+	
+	elif program == 'changing_color':
+		try:
+			arg_dict = parse_changing_color_args(query_dict)
+		except (KeyError, ValueError, TypeError):
+			raise InvalidProgramArgumentsException(CHANGING_COLOR_ARGS_ERROR)
+	
+	elif program in ['wakeup', 'sleepy_time']:
+		try:
+			if 'multiplier' in query_dict:
+				arg_dict['multiplier'] = int(query_dict['multiplier'])
+				if arg_dict['multiplier'] < 0:
+					raise ValueError
+		except (ValueError, TypeError):
+			raise InvalidProgramArgumentsException(MULTIPLIER_ARGS_ERROR)
+	
+	elif program == 'kelvin_sunrise':
+		try:
+			arg_dict = parse_kelvin_sunrise_args(query_dict)
+		except (ValueError, TypeError):
+			raise InvalidProgramArgumentsException(KELVIN_SUNRISE_ARGS_ERROR)
+	
+	elif program == 'wakeup_demo':
+		return ProgramTask('wakeup', {'multiplier': 1})
+	
+	elif program == 'playlist':
+		if 'playlistId' not in query_dict:
+			raise InvalidProgramArgumentsException("playlist needs the 'playlistId' of a saved playlist")
+		
+		try:
+			playlists_obj = Playlists(app.logger, PLAYLIST_FILE_NAME)
+			playlist = IO_POOL.run(playlists_obj.get_playlist_by_id, query_dict['playlistId'])
+		except PlaylistNotFound:
+			raise InvalidProgramArgumentsException("No playlist found matching given id: {}".format(query_dict['playlistId']))
+		
+		arg_dict = {'steps': build_playlist_steps(playlist), 'loop': playlist.loop}
+	
+	if program in ProgramList.clocked_programs:
+		try:
+			arg_dict['start_time'] = parse_start_time(query_dict)
+		except (ValueError, TypeError):
+			raise InvalidProgramArgumentsException(START_TIME_ARGS_ERROR)
+	
+	return ProgramTask(program, arg_dict)
+	
+	
+def build_playlist_steps(playlist):
+	'''
+	Make the steps the LED process runs for a playlist, checking the arguments of each one.
+	
+	Arguments:
+		playlist (Playlist) - playlist to run
+	
+	Raises:
+		InvalidProgramArgumentsException
+	
+	Returns:
+		(list) - list of dicts with the 'program', 'arg_dict' and 'duration_s' of each step, see BaseProgram.playlist
+	'''
+	steps = []
+	for i, step in enumerate(playlist.steps):
+		query_dict = dict((name, str(value)) for name, value in (step['arguments'] or {}).iteritems())
+		try:
+			task = build_program_task(step['program'], query_dict)
+		except InvalidProgramArgumentsException as e:
+			raise InvalidProgramArgumentsException("step {}: {}".format(i, e.message))
+		
+		# every step's start time is set by the playlist
+		task.arg_dict.pop('start_time', None)
+		steps.append({'program': task.program, 'arg_dict': task.arg_dict, 'duration_s': step['durationS']})
+	
+	return steps
+	
+	
+def parse_single_color_args(query_dict):
+	'''
+	Get the single_color program arguments from the URL parameters.
+	
+	Raises:
+		ValueError, TypeError
+	
+	Returns:
+		(dict) - program arguments
+	'''
+	arg_dict = {}
+	for color in ['red', 'green', 'blue']:
+		if color in query_dict:
+			arg_dict[color] = int(query_dict[color])
+			if arg_dict[color] < 0 or arg_dict[color] > 255:
+				raise ValueError
+	
+	return arg_dict
+	
+	
+def parse_changing_color_args(query_dict):
+	'''
+	Get the changing_color program arguments from the URL parameters.
+	
+	Raises:
+		ValueError, TypeError
+	
+	Returns:
+		(dict) - program arguments
+	'''
+	arg_dict = {}
+	if 'dwellTimeMs' in query_dict:
+		arg_dict['dwell_time_ms'] = int(query_dict['dwellTimeMs'])
+		if arg_dict['dwell_time_ms'] < 0:
+			raise ValueError
+		
+	if 'transitionTimeMs' in query_dict:
+		arg_dict['transition_time_ms'] = int(query_dict['transitionTimeMs'])
+		if arg_dict['transition_time_ms'] < 0:
+			raise ValueError
+			
+	if 'brightnessScalePct' in query_dict:
+		arg_dict['brightness_scale_pct'] = int(query_dict['brightnessScalePct'])
+		if arg_dict['brightness_scale_pct'] < 0 or arg_dict['brightness_scale_pct'] > 100 :
+			raise ValueError
+	
+	return arg_dict
+	
+	
+def parse_kelvin_sunrise_args(query_dict):
+	'''
+	Get the kelvin_sunrise program arguments, other than its start time, from the URL parameters.
+	
+	Raises:
+		ValueError, TypeError
+	
+	Returns:
+		(dict) - program arguments
+	'''
+	arg_dict = {}
+	if 'multiplier' in query_dict:
+		arg_dict['multiplier'] = int(query_dict['multiplier'])
+		if arg_dict['multiplier'] < 0:
+			raise ValueError
+	
+	for name, arg_name in [('startKelvin', 'start_kelvin'), ('endKelvin', 'end_kelvin')]:
+		if name in query_dict:
+			arg_dict[arg_name] = int(query_dict[name])
+			if arg_dict[arg_name] < MIN_KELVIN or arg_dict[arg_name] > MAX_KELVIN:
+				raise ValueError
+	
+	if 'brightnessPct' in query_dict:
+		arg_dict['brightness_pct'] = int(query_dict['brightnessPct'])
+		if arg_dict['brightness_pct'] < 0 or arg_dict['brightness_pct'] > 100:
+			raise ValueError
+	
+	return arg_dict
+	
+	
+def parse_start_time(query_dict):
+	'''
+	Get the start time for a timeline program from the URL parameters.
+	
+	Arguments:
+		query_dict (dict) - URL parameters, optionally with 'startTime' (epoch seconds) and 'offsetS' (seconds to seek into the program)
+		
+	Raises:
+		ValueError, TypeError
+		
+	Returns:
+		(float) - start time in epoch seconds, or None to start now
+	'''
+	if 'startTime' not in query_dict and 'offsetS' not in query_dict:
+		return None
+	
+	start_time = float(query_dict['startTime']) if 'startTime' in query_dict else time()
+	
+	if 'offsetS' in query_dict:
+		offset_s = float(query_dict['offsetS'])
+		if offset_s < 0:
+			raise ValueError
+		start_time -= offset_s
+	
+	return start_time
+	
+	
 def find_and_remove_orphaned_process(logger):
 	"""
 	When gunicorn restarts a worker, sometimes the program process owned by that worker doesn't get killed but is
@@ -455,8 +1298,51 @@ def find_and_remove_orphaned_process(logger):
 						logger.info('Found orphaned process with PID = {}. Terminating...'.format(str(p.pid)))
 						p.kill()
 		
+		
+def get_memory_status():
+	'''
+	Measure the memory of each process of the service: this web worker, the LED process, its render worker and, when
+	running under gunicorn, the gunicorn master.
+	
+	Returns:
+		(dict) - process -> RSS, USS (memory only that process uses) and PSS (its share of the memory it shares
+			with other processes) in MB, plus the USS and PSS totals
+	'''
+	worker = psutil.Process()
+	processes = {"worker": worker.pid, "renderer": SUPERVISOR.process.pid}
+	parent = worker.parent()
+	if parent is not None and 'gunicorn' in ' '.join(parent.cmdline()):
+		processes["master"] = parent.pid
+	
+	try:
+		for child in psutil.Process(SUPERVISOR.process.pid).children():
+			processes["renderWorker"] = child.pid
+	except psutil.NoSuchProcess:
+		pass
+	
+	resp = {"totalUssMb": 0.0, "totalPssMb": 0.0}
+	for name, pid in processes.iteritems():
+		try:
+			process = psutil.Process(pid)
+			
+			# USS and PSS come from /proc/<pid>/smaps, which is only available on Linux
+			info = process.memory_full_info()
+			resp[name] = {"pid": pid, "rssMb": round(info.rss / 1e6, 1), "ussMb": round(info.uss / 1e6, 1), "pssMb": round(info.pss / 1e6, 1)}
+			resp["totalUssMb"] += info.uss / 1e6
+			resp["totalPssMb"] += info.pss / 1e6
+		
+		except psutil.NoSuchProcess:
+			# the LED process died and hasn't been restarted yet
+			resp[name] = None
+		
+		except (psutil.AccessDenied, AttributeError):
+			resp[name] = {"pid": pid, "rssMb": round(process.memory_info().rss / 1e6, 1)}
+	
+	resp["totalUssMb"] = round(resp["totalUssMb"], 1)
+	resp["totalPssMb"] = round(resp["totalPssMb"], 1)
+	return resp
 	
 	
 ########################## INVOCATION #############################	
 if __name__ == "__main__":
-	app.run(host='0.0.0.0', port=8081)
\ No newline at end of file
+	app.run(host='0.0.0.0', port=8081, threaded=(SERVING_MODE == ServingMode.threaded))
\ No newline at end of file
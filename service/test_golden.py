@@ -0,0 +1,31 @@
+'''
+Check every program against its golden trace, so a change to the frames a program sends fails the suite.
+
+	python -m unittest test_golden
+'''
+import logging
+import unittest
+
+from trace_tool import GOLDEN_SCENARIOS, check_golden
+
+# matches the default of trace_tool.py golden --max-drift
+MAX_DRIFT_S = 1.0
+
+class GoldenTraceTest(unittest.TestCase):
+	'''One test per golden scenario, each run on the virtual clock by check_golden'''
+
+	@classmethod
+	def setUpClass(cls):
+		logging.basicConfig(level=logging.WARNING)
+
+def _make_test(name):
+	def test(self):
+		self.assertTrue(check_golden([name], max_drift_s=MAX_DRIFT_S), '{} no longer matches golden_traces/{}.trace'.format(name, name))
+	test.__doc__ = 'Frames sent by the {} scenario match its golden trace'.format(name)
+	return test
+
+for _name in GOLDEN_SCENARIOS:
+	setattr(GoldenTraceTest, 'test_' + _name, _make_test(_name))
+
+if __name__ == '__main__':
+	unittest.main()
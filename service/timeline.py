@@ -0,0 +1,134 @@
+import bisect
+
+# programs run on a 100 ms frame clock
+FRAME_INTERVAL_S = 0.1
+
+class Timeline(object):
+	'''
+	Deterministic frame sequence compiled from a list of color transitions.
+
+	Each frame is (red, green, blue, pixel_count) and depends only on its index, so a timeline can be played
+	from any point, e.g. by several nodes that share a start time or after a restart part way through.
+	'''
+
+	def __init__(self, segments, num_pixels):
+		'''
+		Compile a timeline
+
+		Arguments:
+			segments (list) - list of (from_state, to_state, iter_count) transitions where a state is
+				(r, g, b, led pct, ...) and iter_count is the number of frames the transition takes
+			num_pixels (int) - number of pixels on the strip
+		'''
+		self.num_pixels = num_pixels
+		self._segments = []
+		self._segment_starts = []
+
+		frame_count = 0
+		for from_state, to_state, iter_count in segments:
+			if iter_count <= 0:
+				continue
+
+			deltas = self._calc_deltas(from_state, to_state)
+			from_pixels = int(round(float(from_state[3])/100.0*self.num_pixels))
+			self._segment_starts.append(frame_count)
+			self._segments.append((from_state, deltas, from_pixels, iter_count))
+			frame_count += iter_count
+
+		self.frame_count = frame_count
+
+	@classmethod
+	def from_program_sequence(cls, program_sequence, multiplier, base_multiplier, num_pixels):
+		'''
+		Compile a timeline from a program sequence like the ones used by the wakeup program.
+
+		Arguments:
+			program_sequence (list) - list of (r, g, b, led pct, transition time ratio from this to next) states
+			multiplier (int) - program multiplier setting the overall duration
+			base_multiplier (int) - frames per unit of multiplier and transition time ratio
+			num_pixels (int) - number of pixels on the strip
+		'''
+		segments = []
+		for i in range(1, len(program_sequence)):
+			from_state = program_sequence[i-1]
+			segments.append((from_state, program_sequence[i], multiplier * base_multiplier * from_state[4]))
+
+		return cls(segments, num_pixels)
+
+	@property
+	def duration_s(self):
+		return self.frame_count * FRAME_INTERVAL_S
+
+	def frame_index_at(self, elapsed_s):
+		'''Index of the frame showing a given number of seconds into the timeline'''
+		# a frame's deadline may not divide exactly (0.3 / 0.1 is 2.999...), so waking right on it would show the
+		# previous frame again. Allow for the rounding error.
+		return int(elapsed_s / FRAME_INTERVAL_S + 1e-6)
+
+	def frame_at_index(self, index, exact=False):
+		'''
+		Get a frame of the timeline.
+
+		Arguments:
+			index (int) - frame index from 0 to frame_count - 1
+			(opt) exact (boolean) - return fractional colors rather than rounding them to whole levels, for dithering
+
+		Returns:
+			tuple
+				red (int/float), green (int/float), blue (int/float) - color of the lit pixels
+				pixel_count (int) - number of lit pixels
+		'''
+		segment_idx = bisect.bisect_right(self._segment_starts, index) - 1
+		from_state, deltas, from_pixels, iter_count = self._segments[segment_idx]
+		red_delta, green_delta, blue_delta, pixel_delta = deltas
+		j = index - self._segment_starts[segment_idx]
+
+		if exact:
+			fraction = float(j) / float(iter_count)
+			red = from_state[0] + red_delta * fraction
+			green = from_state[1] + green_delta * fraction
+			blue = from_state[2] + blue_delta * fraction
+		else:
+			red = from_state[0] + self._calc_delta_influence(red_delta, iter_count, j)
+			green = from_state[1] + self._calc_delta_influence(green_delta, iter_count, j)
+			blue = from_state[2] + self._calc_delta_influence(blue_delta, iter_count, j)
+
+		pixel_count = from_pixels + self._calc_delta_influence(pixel_delta, iter_count, j)
+
+		return red, green, blue, pixel_count
+
+	def _calc_deltas(self, from_state, to_state):
+		'''
+		Calculate deltas between one state and another
+
+		Arguments:
+			from_state (list) - starting state
+			to_state (list) - ending state
+
+		Returns:
+			tuple
+				red_delta (float) - delta in red
+				green_delta (float) - delta in green
+				blue_delta (float) - delta in blue
+				pixel_delta (float) - delta in pixel count
+		'''
+		red_delta = float(to_state[0] - from_state[0])
+		green_delta = float(to_state[1] - from_state[1])
+		blue_delta = float(to_state[2] - from_state[2])
+		pixel_delta = (float(to_state[3])/100.0 * float(self.num_pixels)) - (float(from_state[3])/100.0 * float(self.num_pixels))
+
+		return red_delta, green_delta, blue_delta, pixel_delta
+
+	def _calc_delta_influence(self, delta, iter_count, j):
+		'''
+		Determine the influence of the delta for a given iteration.
+
+		Arguments:
+			delta (float) - the delta to check
+			iter_count (int) - total number of iterations
+			j (int) - current value of the iteration
+
+		Returns:
+			(int) - the portion of the delta to apply on this iteration
+		'''
+		return int(round(float(delta) * (float(j) / float(iter_count))))
@@ -1,44 +1,76 @@
+import bisect
 import json
+import os
+import threading
+from datetime import timedelta
+from time import time
 
 from crontab import CronTab
 
+from clock import SystemClock
+
 from programs import ProgramList
 
 class Timers(object):
 	'''Object defining the collection of timers'''
 	
-	def __init__(self, logger, timer_file):
+	# serializes read-modify-write cycles on the timer and version files when requests are served from several threads
+	_store_lock = threading.RLock()
+	
+	def __init__(self, logger, timer_file, version_file=None, fire_index=None):
 		self.logger = logger
 		self.timer_file = timer_file
+		
+		# optional FireTimeIndex kept up to date as timers are added, changed and deleted
+		self.fire_index = fire_index
+		
+		# the version file tracks a monotonically increasing store version along with the version at which
+		# each timer was last changed or deleted so that clients can sync only what changed
+		if version_file is None:
+			self.version_file = os.path.splitext(timer_file)[0] + '_version.json'
+		else:
+			self.version_file = version_file
 	
 	def enable_timer(self, timer_id):
-		timer = self.get_timer_by_id(timer_id)
-		timer.is_enabled = True
-		self.add_or_modify_timer(timer)
+		with self._store_lock:
+			timer = self.get_timer_by_id(timer_id)
+			timer.is_enabled = True
+			self.add_or_modify_timer(timer)
 		
 		return timer
 		
 	def disable_timer(self, timer_id):
-		timer = self.get_timer_by_id(timer_id)
-		timer.is_enabled = False
-		self.add_or_modify_timer(timer)
+		with self._store_lock:
+			timer = self.get_timer_by_id(timer_id)
+			timer.is_enabled = False
+			self.add_or_modify_timer(timer)
 		
 		return timer
 	
 	def add_or_modify_timer(self, timer):
-		timer_dict = self.read_timers_from_file()
-		timer_dict[timer.timer_id] = timer
-		timer.save_to_cron()
-		self.write_timers_to_file(timer_dict)
+		with self._store_lock:
+			timer_dict = self.read_timers_from_file()
+			timer_dict[timer.timer_id] = timer
+			timer.save_to_cron()
+			self.write_timers_to_file(timer_dict)
+			version = self._record_change(timer.timer_id)
+			
+			if self.fire_index is not None:
+				self.fire_index.update(timer, version)
 		
 		return timer
 		
 	def delete_timer(self, timer_id):
-		timer = self.get_timer_by_id(timer_id)
-		timer_dict = self.read_timers_from_file()
-		timer_dict.pop(timer_id)
-		timer.delete_from_cron()
-		self.write_timers_to_file(timer_dict)
+		with self._store_lock:
+			timer = self.get_timer_by_id(timer_id)
+			timer_dict = self.read_timers_from_file()
+			timer_dict.pop(timer_id)
+			timer.delete_from_cron()
+			self.write_timers_to_file(timer_dict)
+			version = self._record_change(timer_id, deleted=True)
+			
+			if self.fire_index is not None:
+				self.fire_index.remove(timer_id, version)
 		
 	def read_timers_from_file(self):
 		'''
@@ -47,8 +79,7 @@ class Timers(object):
 		Returns:
 			timer_dict (dict) - dictionary of timers
 		'''
-		with open(self.timer_file, 'r') as f:
-			timer_dict = json.loads(f.read())
+		timer_dict = self._read_timer_json()
 			
 		for timer_id in timer_dict.iterkeys():
 			timer_dict[timer_id] = Timer.from_json(self.logger, timer_dict[timer_id])
@@ -56,6 +87,12 @@ class Timers(object):
 		return timer_dict
 		
 	
+	def _read_timer_json(self):
+		'''Returns (dict) - timer_id -> stored json of each timer, without making Timer objects'''
+		with self._store_lock:
+			with open(self.timer_file, 'r') as f:
+				return json.loads(f.read())
+	
 	def write_timers_to_file(self, timer_dict):
 		'''
 		Write all timers to the timer file.
@@ -66,8 +103,7 @@ class Timers(object):
 		for timer_id in timer_dict.iterkeys():
 			timer_dict[timer_id] = timer_dict[timer_id].to_storage_json()
 				
-		with open(self.timer_file, 'w') as f:
-			f.write(json.dumps(timer_dict, indent=4))
+		write_file_atomically(self.timer_file, json.dumps(timer_dict, indent=4))
 
 
 	def get_timer_by_id(self, timer_id):
@@ -90,6 +126,176 @@ class Timers(object):
 		
 		except KeyError:
 			raise TimerNotFound()
+	
+	def read_version_info(self):
+		'''
+		Read the version bookkeeping for the timer store.
+		
+		Returns:
+			(dict) - 'version' is the current store version, 'timers' maps timer_id to the version it was last
+				changed at, 'deleted' maps timer_id to the version it was deleted at and the optional 'resetAt' is
+				the version the bookkeeping was started again at after the version file was lost
+		'''
+		with self._store_lock:
+			try:
+				with open(self.version_file, 'r') as f:
+					return json.loads(f.read())
+			
+			except (IOError, ValueError):
+				return self._initial_version_info()
+	
+	def _initial_version_info(self):
+		'''
+		Version bookkeeping for a store without a usable version file. If there is no timer file yet the store starts
+		at version 0. Otherwise the version file was lost (or never written by an older release), so the store starts
+		again at the current time in ms. That is later than any version handed out before, even one counted up from
+		an earlier restart, so versions and ETags never go backwards. Every timer counts as changed at that version,
+		and clients syncing from before it are told to replace their whole list, since the timers deleted before then
+		aren't known.
+		
+		Returns:
+			(dict) - version bookkeeping, as from read_version_info
+		'''
+		try:
+			with open(self.timer_file, 'r') as f:
+				timer_ids = json.loads(f.read()).keys()
+		
+		except IOError:
+			return {'version': 0, 'timers': {}, 'deleted': {}}
+		
+		version = int(time() * 1000)
+		message = 'Timer version file {} is missing or unreadable. Starting again at version {}'.format(self.version_file, version)
+		if timer_ids:
+			self.logger.error(message)
+		else:
+			self.logger.info(message)
+		
+		version_info = {'version': version, 'timers': dict((timer_id, version) for timer_id in timer_ids), 'deleted': {}, 'resetAt': version}
+		write_file_atomically(self.version_file, json.dumps(version_info, indent=4))
+		
+		return version_info
+	
+	def read_snapshot(self):
+		'''
+		Read the store version and the timers together, so no change can land between the two.
+		
+		Returns:
+			tuple
+				version (int) - current store version
+				timer_dict (dict) - dictionary of timers at that version
+		'''
+		with self._store_lock:
+			return self.get_store_version(), self.read_timers_from_file()
+	
+	def get_timer_if_changed(self, timer_id, unchanged=None):
+		'''
+		Get a timer and the version it was last changed at, read as one snapshot. The version is checked first, so a
+		timer the client already has isn't loaded at all, and only the one timer is loaded otherwise.
+		
+		Arguments:
+			timer_id (string) - id of the desired timer
+			(opt) unchanged (function) - takes the timer's version and returns True if the client already has it
+			
+		Raises:
+			TimerNotFound
+			
+		Returns:
+			tuple
+				version (int) - store version the timer was last changed at
+				timer (Timer) - the timer, or None if unchanged returned True
+		'''
+		with self._store_lock:
+			timer_versions = self.read_version_info()['timers']
+			if timer_id not in timer_versions:
+				raise TimerNotFound()
+			
+			version = timer_versions[timer_id]
+			if unchanged is not None and unchanged(version):
+				return version, None
+			
+			timer_json = self._read_timer_json().get(timer_id)
+		
+		if timer_json is None:
+			raise TimerNotFound()
+		
+		return version, Timer.from_json(self.logger, timer_json)
+	
+	def get_store_version(self):
+		'''Returns the current version (int) of the timer store'''
+		return self.read_version_info()['version']
+	
+	def get_changes_since(self, since):
+		'''
+		Get the timers that were added, changed or deleted after a given store version.
+		
+		Arguments:
+			since (int) - store version the client last synced at
+			
+		Returns:
+			tuple
+				version (int) - current store version
+				changed_dict (dict) - dictionary of timers changed after since
+				deleted_list (list) - ids of timers deleted after since
+				resync (boolean) - the version bookkeeping was started again after since, so changed_dict holds every
+					timer and the client should replace its whole list with it
+		'''
+		# the version info and the timers are read under the store lock, so they always come from the same version
+		with self._store_lock:
+			version_info = self.read_version_info()
+			
+			changed_ids = [timer_id for timer_id, version in version_info['timers'].iteritems() if version > since]
+			deleted_list = [timer_id for timer_id, version in version_info['deleted'].iteritems() if version > since]
+			
+			changed_dict = {}
+			if changed_ids:
+				timer_dict = self.read_timers_from_file()
+				for timer_id in changed_ids:
+					if timer_id in timer_dict:
+						changed_dict[timer_id] = timer_dict[timer_id]
+		
+		return version_info['version'], changed_dict, deleted_list, since < version_info.get('resetAt', 0)
+	
+	def _record_change(self, timer_id, deleted=False):
+		'''
+		Bump the store version and record it against a changed or deleted timer.
+		
+		Arguments:
+			timer_id (string) - id of the timer that changed
+			(opt) deleted (boolean) - indicates that the timer was deleted rather than added or modified
+			
+		Returns:
+			(int) - the new store version
+		'''
+		version_info = self.read_version_info()
+		version_info['version'] += 1
+		
+		if deleted:
+			version_info['timers'].pop(timer_id, None)
+			version_info['deleted'][timer_id] = version_info['version']
+		else:
+			version_info['deleted'].pop(timer_id, None)
+			version_info['timers'][timer_id] = version_info['version']
+		
+		write_file_atomically(self.version_file, json.dumps(version_info, indent=4))
+		
+		return version_info['version']
+
+def write_file_atomically(path, contents):
+	'''
+	Replace a file's contents so readers see either the old or the new file, never a truncated or half written one.
+	The contents go to a temporary file next to it, which is then renamed over it.
+	
+	Arguments:
+		path (string) - file to write
+		contents (string) - new contents of the file
+	'''
+	temp_path = path + '.tmp'
+	with open(temp_path, 'w') as f:
+		f.write(contents)
+		f.flush()
+		os.fsync(f.fileno())
+	
+	os.rename(temp_path, path)
 
 class Timer(object):
 	'''Object defining a timer'''
@@ -296,25 +502,194 @@ class Timer(object):
 			job - the new or existing cron job to populate
 		'''
 		self.logger.info(self.to_storage_json())
-		arg_string = ''
+		arg_list = []
 		if self.arguments is not None:
-			arg_list = []
 			for name, value in self.arguments.iteritems():
 				arg_list.append(name + "=" + str(value))
+		
+		if self.program_to_launch in ProgramList.clocked_programs:
+			# start from the minute the timer fired rather than when the request lands so that the same timer on
+			# several nodes plays frame-locked. % has to be escaped in a crontab.
+			arg_list.append('startTime=$(( $(date +\\%s) / 60 * 60 ))')
+		
+		arg_string = ''
+		if arg_list:
 			arg_string = '?' + '&'.join(arg_list)
 			
 		job.comment = self.timer_id
 		job.enable(self.is_enabled)
-		job.command = 'curl localhost:8081/programs/{}{}'.format(self.program_to_launch, arg_string)
+		job.command = 'curl "localhost:8081/programs/{}{}"'.format(self.program_to_launch, arg_string)
 		job.minute.on(self.trigger_minute)
 		job.hour.on(self.trigger_hour)
 		job.dow.on(*self.timer_schedule)
 	
+	def launch_arguments(self, fire_time_s):
+		'''
+		URL parameters the crontab entry sends when the timer fires.
+		
+		Arguments:
+			fire_time_s (float) - time the timer fires at, in epoch seconds
+		
+		Returns:
+			(dict) - parameter name -> value
+		'''
+		arguments = dict(self.arguments or {})
+		if self.program_to_launch in ProgramList.clocked_programs:
+			# matches the start time the crontab entry computes, see set_cron_record
+			arguments['startTime'] = int(fire_time_s) / 60 * 60
+		
+		return arguments
+	
 	def delete_from_cron(self):
 		'''Delete the timer from the crontab'''
 		self.cron.remove_all(comment=self.timer_id)
 		self.cron.write()
 		
+class FireTimeIndex(object):
+	'''
+	Sorted index of the weekly fire times of all enabled timers.
+	
+	Fire times are stored as minute-of-week (Sunday 00:00 is 0, matching the cron day of week numbering) so
+	the next fires after any point in time are found with a binary search. Entries are updated incrementally
+	as timers change, and the index remembers the store version it reflects so it can be rebuilt if the
+	timer file was changed by someone else.
+	'''
+	minutes_per_week = 7 * 24 * 60
+	
+	def __init__(self, clock=None):
+		'''
+		Arguments:
+			(opt) clock (clock.SystemClock/clock.VirtualClock) - clock that fires are looked up from by default
+		'''
+		if clock is None:
+			self.clock = SystemClock()
+		else:
+			self.clock = clock
+		
+		self._lock = threading.RLock()
+		self._keys = []				# sorted minute-of-week fire times
+		self._timer_ids = []		# timer id for each entry in _keys
+		self._timers = {}			# timer_id -> Timer for every indexed timer
+		self.version = None			# store version the index reflects
+	
+	@classmethod
+	def minute_of_week(cls, dow, hour, minute):
+		'''
+		Convert a cron style day of week and time of day to minute-of-week.
+		
+		Arguments:
+			dow (int) - day of week with sunday as 0
+			hour (int) - hour of the day
+			minute (int) - minute of the hour
+		'''
+		return dow * 24 * 60 + hour * 60 + minute
+	
+	@classmethod
+	def datetime_to_minute_of_week(cls, d_time):
+		'''Convert a datetime to minute-of-week (seconds are dropped)'''
+		return cls.minute_of_week(d_time.isoweekday() % 7, d_time.hour, d_time.minute)
+	
+	def rebuild(self, timer_dict, version=None):
+		'''
+		Replace the index contents with a full set of timers.
+		
+		Arguments:
+			timer_dict (dict) - dictionary of timers keyed by timer_id
+			(opt) version (int) - store version the timers were read at
+		'''
+		with self._lock:
+			self._keys = []
+			self._timer_ids = []
+			self._timers = {}
+			for timer in timer_dict.itervalues():
+				self._insert(timer)
+			
+			self.version = version
+	
+	def update(self, timer, version=None):
+		'''Add or replace the fire times for a timer. Disabled timers are removed from the index.'''
+		with self._lock:
+			if self._follows(version):
+				self._remove(timer.timer_id)
+				self._insert(timer)
+				self.version = version
+	
+	def remove(self, timer_id, version=None):
+		'''Remove the fire times for a timer'''
+		with self._lock:
+			if self._follows(version):
+				self._remove(timer_id)
+				self.version = version
+	
+	def is_stale(self, version):
+		'''Returns boolean indicating if the index does not reflect the given store version'''
+		with self._lock:
+			return self.version is None or self.version != version
+	
+	def next_fires(self, after=None, count=1):
+		'''
+		Find the next timer fires strictly after a given time.
+		
+		Arguments:
+			(opt) after (datetime) - local time to search from. Defaults to the current time of the index's clock.
+			(opt) count (int) - number of fires to return
+			
+		Returns:
+			(list) - list of (fire_time, timer) tuples in firing order where fire_time is a datetime
+		'''
+		if after is None:
+			after = self.clock.now()
+		
+		with self._lock:
+			fires = []
+			if not self._keys:
+				return fires
+			
+			after_minute = self.datetime_to_minute_of_week(after)
+			week_start = after.replace(second=0, microsecond=0) - timedelta(minutes=after_minute)
+			
+			# cron fires at the start of the minute, so any fire in the current minute is not after the given time
+			idx = bisect.bisect_right(self._keys, after_minute)
+			weeks = 0
+			while len(fires) < count:
+				if idx == len(self._keys):
+					idx = 0
+					weeks += 1
+				
+				fire_time = week_start + timedelta(minutes=self._keys[idx] + weeks * self.minutes_per_week)
+				fires.append((fire_time, self._timers[self._timer_ids[idx]]))
+				idx += 1
+			
+			return fires
+	
+	def _follows(self, version):
+		# a change can only be applied incrementally on top of the version directly before it. Otherwise
+		# some change was missed, so the index is left to be rebuilt by the next refresh.
+		if version is None or (self.version is not None and version == self.version + 1):
+			return True
+		
+		self.version = None
+		return False
+	
+	def _insert(self, timer):
+		if not timer.is_enabled:
+			return
+		
+		self._timers[timer.timer_id] = timer
+		for dow in timer.timer_schedule:
+			key = self.minute_of_week(dow, timer.trigger_hour, timer.trigger_minute)
+			idx = bisect.bisect_right(self._keys, key)
+			self._keys.insert(idx, key)
+			self._timer_ids.insert(idx, timer.timer_id)
+	
+	def _remove(self, timer_id):
+		if self._timers.pop(timer_id, None) is None:
+			return
+		
+		keep = [i for i in range(len(self._keys)) if self._timer_ids[i] != timer_id]
+		self._keys = [self._keys[i] for i in keep]
+		self._timer_ids = [self._timer_ids[i] for i in keep]
+		
 #################### CUSTOM EXCEPTIONS ###########################	
 class TimerNotFound(Exception):
 	pass
@@ -0,0 +1,275 @@
+'''
+Record, compare and regression check the frame sequences programs send to the strip.
+
+Examples:
+	python trace_tool.py record wakeup --arg multiplier=1 --frames 900 --out wakeup.trace
+	python trace_tool.py diff golden_traces/wakeup.trace wakeup.trace
+	python trace_tool.py golden                 # check every golden trace
+	python trace_tool.py golden --update wakeup  # re-record a golden trace after an intended change
+	python trace_tool.py bench --dither-hz 100   # measure the cost and smoothness of temporal dithering
+	python trace_tool.py record wakeup --frames 29300 --virtual --out wakeup30.trace  # a full 30 minute wakeup in seconds
+	python trace_tool.py alarms timers.json --days 7  # the program commands a week of timer fires would send
+'''
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+from time import mktime, sleep, time
+
+from clock import VirtualClock
+from dither import TemporalDither
+
+from frametrace import TraceRecorder, read_trace, diff_traces, traces_match
+from programs import BaseProgram, ColorObject, ProgramTask
+from strips import StripBackend
+from timeline import FRAME_INTERVAL_S
+from timer import FireTimeIndex, Timers
+
+# matches the configuration in sunrise.py
+NUM_PIXELS = 69
+CROSSFADE_MS = 500
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden_traces')
+
+# name -> (task, frames to record, random seed)
+GOLDEN_SCENARIOS = {
+	'wakeup': (ProgramTask('wakeup', {'multiplier': 1}), 860, None),
+	'kelvin_sunrise': (ProgramTask('kelvin_sunrise', {'multiplier': 1}), 1000, None),
+	'sleepy_time': (ProgramTask('sleepy_time', {'multiplier': 1}), 620, None),
+	'single_color': (ProgramTask('single_color', {'red': 255, 'green': 120, 'blue': 30}), 30, None),
+	'changing_color': (ProgramTask('changing_color', {'dwell_time_ms': 1000, 'transition_time_ms': 1000, 'brightness_scale_pct': 50}), 160, 1234)
+}
+
+def record_program(task, filename, num_frames, seed=None, num_pixels=NUM_PIXELS, crossfade_ms=CROSSFADE_MS, dither_hz=0, clock=None):
+	'''
+	Run a program against a simulated strip and record the frames it sends.
+
+	Arguments:
+		task (ProgramTask) - program to run
+		filename (string) - trace file to write
+		num_frames (int) - number of frames to record
+		(opt) seed (int) - seed for the random color choices
+		(opt) dither_hz (int) - output frame rate for temporal dithering. Every output frame is recorded.
+		(opt) clock (clock.VirtualClock) - clock to run the program on. Defaults to the wall clock.
+	'''
+	logger = logging.getLogger('trace_tool')
+	recorder = TraceRecorder(filename, num_pixels, max_frames=num_frames)
+	queue = multiprocessing.JoinableQueue()
+	program = BaseProgram(logger, queue, num_pixels, crossfade_ms, StripBackend.simulated, recorder, dither_hz=dither_hz, clock=clock)
+
+	if seed is not None:
+		random.seed(seed)
+
+	queue.put_nowait(task)
+	runner = threading.Thread(target=program.run)
+	runner.daemon = True
+	runner.start()
+
+	while not recorder.is_full and runner.is_alive():
+		sleep(.05)
+
+	queue.put_nowait(ProgramTask('KILL'))
+	runner.join(5)
+	recorder.close()
+
+def parse_program_args(arg_list):
+	'''Convert a list of key=value strings to a program argument dict'''
+	arg_dict = {}
+	for item in arg_list or []:
+		name, value = item.split('=', 1)
+		try:
+			arg_dict[name] = int(value)
+		except ValueError:
+			arg_dict[name] = value
+
+	return arg_dict
+
+def check_golden(names, update=False, max_drift_s=None):
+	'''
+	Re-record golden scenarios and compare them to the golden traces.
+
+	Returns:
+		(boolean) - True if every checked scenario matched (always True when updating)
+	'''
+	all_match = True
+	for name in names:
+		task, num_frames, seed = GOLDEN_SCENARIOS[name]
+		golden_file = os.path.join(GOLDEN_DIR, name + '.trace')
+
+		# the programs see the same frame deadlines on a virtual clock, so they are checked without waiting for them
+		if update:
+			record_program(task, golden_file, num_frames, seed, clock=VirtualClock())
+			print('{}: recorded {} frames to {}'.format(name, num_frames, golden_file))
+			continue
+
+		handle, actual_file = tempfile.mkstemp(suffix='.trace')
+		os.close(handle)
+		try:
+			record_program(task, actual_file, num_frames, seed, clock=VirtualClock())
+			summary = diff_traces(read_trace(golden_file), read_trace(actual_file))
+		finally:
+			os.remove(actual_file)
+
+		match = traces_match(summary, max_drift_s)
+		all_match = all_match and match
+		print('{}: {}'.format(name, 'OK' if match else 'MISMATCH'))
+		print(json.dumps(summary, indent=4, sort_keys=True))
+
+	return all_match
+
+def benchmark_dither(dither_hz, duration_s, num_pixels=NUM_PIXELS):
+	'''
+	Run the dim start of the wakeup program against a simulated strip and measure what dithering costs and how
+	smooth the fade is. The light level seen is taken as the average of the output frames over each program frame.
+
+	Arguments:
+		dither_hz (int) - output frame rate. 0 measures the undithered output.
+		duration_s (int/float) - how much of the program to run
+
+	Returns:
+		(dict) - output frame rate, frames sent late, CPU time per output frame and share of a core used, time to
+			quantize a frame, and the number of distinct light levels and largest step between program frames
+	'''
+	output_hz = dither_hz or 1.0 / FRAME_INTERVAL_S
+	handle, trace_file = tempfile.mkstemp(suffix='.trace')
+	os.close(handle)
+	try:
+		cpu_start = sum(os.times()[:2])
+		record_program(ProgramTask('wakeup', {'multiplier': 1}), trace_file, int(duration_s * output_hz), num_pixels=num_pixels, dither_hz=dither_hz)
+		cpu_s = sum(os.times()[:2]) - cpu_start
+		frames = read_trace(trace_file)[1]
+	finally:
+		os.remove(trace_file)
+
+	intervals = [frames[i][0] - frames[i-1][0] for i in range(1, len(frames))]
+	elapsed_s = frames[-1][0] - frames[0][0]
+
+	# average the first pixel's channels over each program frame
+	windows = {}
+	for timestamp, pixels in frames:
+		windows.setdefault(int(timestamp / FRAME_INTERVAL_S), []).append(pixels[0:3])
+	levels = []
+	for index in sorted(windows):
+		shown = windows[index]
+		levels.append(tuple(round(sum(x[c] for x in shown) / float(len(shown)), 2) for c in range(3)))
+	steps = [max(abs(levels[i][c] - levels[i-1][c]) for c in range(3)) for i in range(1, len(levels))]
+
+	resp = {
+		"ditherHz": dither_hz,
+		"outputFrames": len(frames),
+		"outputHz": round((len(frames) - 1) / elapsed_s, 1),
+		"lateOutputFrames": len([x for x in intervals if x > 1.5 / output_hz]),
+		"cpuMsPerOutputFrame": round(cpu_s / len(frames) * 1000.0, 3),
+		"cpuPct": round(cpu_s / elapsed_s * 100.0, 1),
+		"distinctLevels": len(set(levels)),
+		"maxStepLevels": round(max(steps), 3)
+	}
+
+	if dither_hz > 0:
+		dither = TemporalDither(num_pixels)
+		frame = [ColorObject(1.3, 0.2, 10.7) for i in range(num_pixels)]
+		count = 1000
+		start = time()
+		for i in range(count):
+			dither.quantize(frame)
+		resp["quantizeMs"] = round((time() - start) / count * 1000.0, 3)
+
+	return resp
+
+def simulate_alarms(timer_file, days=7, start=None):
+	'''
+	Step a virtual clock through the fires of the timers in a timer file and list the program commands cron would
+	send for them, e.g. to check a week of alarms without waiting a week.
+
+	Arguments:
+		timer_file (string) - timer file as written by the service
+		(opt) days (int/float) - how long to simulate
+		(opt) start (float) - epoch seconds to start from. Defaults to now.
+
+	Returns:
+		(list[dict]) - fire time, timer id, program and URL parameters of every fire in order
+	'''
+	clock = VirtualClock(start)
+	fire_index = FireTimeIndex(clock)
+	fire_index.rebuild(Timers(logging.getLogger('trace_tool'), timer_file).read_timers_from_file())
+	end = clock.time() + days * 24 * 60 * 60
+
+	fires = []
+	while True:
+		upcoming = fire_index.next_fires()
+		if not upcoming:
+			break
+
+		fire_time, timer = upcoming[0]
+		if mktime(fire_time.timetuple()) > end:
+			break
+
+		clock.advance_to(mktime(fire_time.timetuple()))
+		fires.append({
+			"fireTime": fire_time.isoformat(),
+			"timerId": timer.timer_id,
+			"program": timer.program_to_launch,
+			"arguments": timer.launch_arguments(clock.time())
+		})
+
+	return fires
+
+
+if __name__ == '__main__':
+	arg_parser = argparse.ArgumentParser(description='Record and compare program frame traces')
+	subparsers = arg_parser.add_subparsers(dest='command')
+
+	record_parser = subparsers.add_parser('record', help='record a program to a trace file')
+	record_parser.add_argument('program')
+	record_parser.add_argument('--arg', action='append', help='program argument as name=value (repeatable)')
+	record_parser.add_argument('--frames', type=int, required=True, help='number of frames to record')
+	record_parser.add_argument('--seed', type=int, help='seed for the random color choices')
+	record_parser.add_argument('--out', required=True, help='trace file to write')
+	record_parser.add_argument('--dither-hz', type=int, default=0, help='output frame rate for temporal dithering')
+	record_parser.add_argument('--virtual', action='store_true', help='run on a virtual clock rather than waiting for every frame')
+
+	diff_parser = subparsers.add_parser('diff', help='summarize the differences between two traces')
+	diff_parser.add_argument('expected')
+	diff_parser.add_argument('actual')
+
+	golden_parser = subparsers.add_parser('golden', help='check programs against the golden traces')
+	golden_parser.add_argument('names', nargs='*', help='scenarios to check (default all)')
+	golden_parser.add_argument('--update', action='store_true', help='re-record the golden traces instead of checking them')
+	golden_parser.add_argument('--max-drift', type=float, default=1.0, help='largest tolerated timing drift in seconds')
+
+	bench_parser = subparsers.add_parser('bench', help='measure the cost and smoothness of temporal dithering on a simulated strip')
+	bench_parser.add_argument('--dither-hz', type=int, default=100, help='output frame rate to measure')
+	bench_parser.add_argument('--duration', type=float, default=12, help='seconds of the wakeup program to run')
+
+	alarms_parser = subparsers.add_parser('alarms', help='list the program commands the timers in a timer file would send')
+	alarms_parser.add_argument('timer_file')
+	alarms_parser.add_argument('--days', type=float, default=7, help='number of days to simulate')
+	alarms_parser.add_argument('--start', type=float, help='epoch seconds to start from (default now)')
+
+	args = arg_parser.parse_args()
+	logging.basicConfig(level=logging.WARNING)
+
+	if args.command == 'record':
+		clock = VirtualClock() if args.virtual else None
+		record_program(ProgramTask(args.program, parse_program_args(args.arg)), args.out, args.frames, args.seed, dither_hz=args.dither_hz, clock=clock)
+
+	elif args.command == 'diff':
+		summary = diff_traces(read_trace(args.expected), read_trace(args.actual))
+		print(json.dumps(summary, indent=4, sort_keys=True))
+		sys.exit(0 if traces_match(summary) else 1)
+
+	elif args.command == 'golden':
+		names = args.names or sorted(GOLDEN_SCENARIOS)
+		sys.exit(0 if check_golden(names, args.update, args.max_drift) else 1)
+
+	elif args.command == 'bench':
+		results = [benchmark_dither(0, args.duration), benchmark_dither(args.dither_hz, args.duration)]
+		print(json.dumps(results, indent=4, sort_keys=True))
+
+	elif args.command == 'alarms':
+		print(json.dumps(simulate_alarms(args.timer_file, args.days, args.start), indent=4, sort_keys=True))
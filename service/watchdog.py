@@ -0,0 +1,442 @@
+import gc
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+from time import time
+
+import psutil
+
+from forksafe import logging_locks_held
+from framering import FrameRing
+from frametiming import FrameTiming
+from power import PowerLimiter
+from programs import BaseProgram, CommandStats, LiveParameters, ProgramTask, ProgramList
+
+class ProgramSupervisor(object):
+	'''
+	Owns the LED process. Sends it tasks and watches the heartbeat its frame loop writes to shared memory.
+	If the process dies or its heartbeat goes stale it is killed and a fresh one is started running the last
+	requested program.
+
+	The last requested program is also saved to a state file so a restarted service resumes it. Timeline programs
+	have their start time pinned when requested, so they resume at the right frame.
+	'''
+
+	def __init__(self, logger, num_pixels, crossfade_ms, strip_backend, stall_timeout_s=5, check_interval_s=1, systemd_watchdog=False, stop_timeout_s=1, state_file=None, dither_hz=0, render_ahead_frames=0, zones=None, power_budget_ma=0, ma_per_channel=20.0):
+		'''
+		Initialize the supervisor
+
+		Arguments:
+			num_pixels (int) - number of pixels on the strip
+			crossfade_ms (int) - crossfade between programs, see BaseProgram
+			strip_backend (string) - one of StripBackend.valid_backends
+			(opt) stall_timeout_s (int/float) - heartbeat age at which the LED process is considered stalled
+			(opt) check_interval_s (int/float) - how often the heartbeat is checked
+			(opt) systemd_watchdog (boolean) - send WATCHDOG=1 to systemd while the LED process is healthy
+			(opt) stop_timeout_s (int/float) - longest a stop or restart waits on the LED process before killing it
+			(opt) state_file (string) - file the last requested program is saved to and resumed from
+			(opt) dither_hz (int) - output frame rate for temporal dithering, see BaseProgram. 0 turns it off.
+			(opt) render_ahead_frames (int) - how many frames of timeline programs a render worker process renders ahead
+				of the output. 0 renders every frame in the LED process as it is sent.
+			(opt) zones (list[zones.Zone]) - ranges of pixels that can each run a program of their own
+			(opt) power_budget_ma (int/float) - most current the strip may draw, in mA. Brighter frames are scaled down
+				to fit. 0 only estimates the current.
+			(opt) ma_per_channel (float) - current one color channel of a pixel draws at full level, in mA
+		'''
+		self.logger = logger
+		self.num_pixels = num_pixels
+		self.crossfade_ms = crossfade_ms
+		self.strip_backend = strip_backend
+		self.stall_timeout_s = stall_timeout_s
+		self.check_interval_s = check_interval_s
+		self.systemd_watchdog = systemd_watchdog and 'NOTIFY_SOCKET' in os.environ
+		self.stop_timeout_s = stop_timeout_s
+		self.state_file = state_file
+		self.dither_hz = dither_hz
+
+		self.queue = None
+		self.process = None
+		self.process_stop_event = None
+		self.heartbeat = multiprocessing.Value('d', 0.0, lock=False)
+		self.frame_timing = FrameTiming()
+		self.command_stats = CommandStats()
+		self.live_parameters = LiveParameters()
+
+		if render_ahead_frames > 0:
+			self.frame_ring = FrameRing(num_pixels, render_ahead_frames)
+		else:
+			self.frame_ring = None
+
+		self.power_limiter = PowerLimiter(num_pixels, ma_per_channel, budget_ma=power_budget_ma)
+
+		# the last program requested so a restarted process picks up where the old one was
+		self.last_task = ProgramTask('blackout')
+
+		# zone name -> last program requested for the zone since the last program for the whole strip
+		self.zones = zones or []
+		self.zone_tasks = {}
+
+		# set when last_task changes and cleared once it is saved, so the state file is written at most once a check
+		self._state_dirty = False
+
+		self.restart_count = 0
+		self.last_restart = None
+		self._pending_recovery = None
+
+		self._lock = threading.RLock()
+		self._stop_event = threading.Event()
+		self._monitor = None
+
+	def start(self):
+		'''Start the LED process running the program saved in the state file (or blackout) and begin monitoring it'''
+		with self._lock:
+			saved_task, saved_zone_tasks = self._load_state()
+			if saved_task is not None:
+				self.last_task = saved_task
+				self.zone_tasks = saved_zone_tasks
+				self.logger.info('Resuming {} with {}'.format(saved_task.program, saved_task.arg_dict))
+				for name, task in saved_zone_tasks.iteritems():
+					self.logger.info('Resuming {} with {} in zone {}'.format(task.program, task.arg_dict, name))
+
+			self._start_process()
+
+		self._monitor = threading.Thread(target=self._monitor_loop, name='program-watchdog')
+		self._monitor.daemon = True
+		self._monitor.start()
+
+	def send(self, task):
+		'''
+		Send a task to the LED process.
+
+		Arguments:
+			task (ProgramTask) - program to run, in the zone named by task.zone or on the whole strip
+
+		Raises:
+			UnknownZoneException - if task.zone isn't one of the zones
+		'''
+		if task.zone is not None and task.zone not in [x.name for x in self.zones]:
+			raise UnknownZoneException('{} is not a zone'.format(task.zone))
+
+		if task.program in ProgramList.clocked_programs and task.arg_dict.get('start_time') is None:
+			# pin the start time now so a restarted process resumes at the right frame instead of starting over
+			task.arg_dict['start_time'] = time()
+
+		with self._lock:
+			task.params_version = self.live_parameters.version.value
+			if task.zone is not None:
+				self.zone_tasks[task.zone] = task
+				self._state_dirty = True
+			elif task.program != 'KILL':
+				self.last_task = task
+				self.zone_tasks = {}
+				self._state_dirty = True
+			self.queue.put_nowait(task)
+
+	def update_parameters(self, program, params):
+		'''
+		Change parameters of the running program in place. The LED process picks them up on its next frame.
+
+		Arguments:
+			program (string) - program the parameters are for
+			params (dict) - parameter name -> value, see LiveParameters.program_parameters
+
+		Raises:
+			ProgramNotRunningException - if program isn't the last one requested for the whole strip
+		'''
+		with self._lock:
+			if self.last_task.program != program or self.zone_tasks:
+				raise ProgramNotRunningException('{} is not running'.format(program))
+
+			self.live_parameters.update(program, params)
+
+			# a restarted process starts the program with the parameters it had
+			self.last_task.arg_dict.update(params)
+			self._state_dirty = True
+
+	def get_brightness_pct(self):
+		return int(round(self.live_parameters.brightness.value * 100 / 255.0))
+
+	def set_brightness_pct(self, brightness_pct):
+		'''
+		Set the global brightness, applied by the strip to every program from the next frame.
+
+		Arguments:
+			brightness_pct (int) - brightness from 0 to 100
+		'''
+		self.live_parameters.brightness.value = int(round(brightness_pct * 255 / 100.0))
+
+	def stop(self):
+		'''Stop monitoring and shut the LED process down, blanking the strip. Safe to call more than once.'''
+		self._stop_event.set()
+
+		with self._lock:
+			if self.process is None or self.process.exitcode is not None:
+				return
+
+			start = time()
+			how = self._stop_process()
+			self.logger.info('LED process {} {} in {:.3f} seconds'.format(self.process.pid, how, time() - start))
+
+			self._save_state()
+
+	def get_zones(self):
+		'''
+		Returns:
+			(list[dict]) - each zone's pixels and the program last requested for it, if any
+		'''
+		with self._lock:
+			zones = []
+			for zone in self.zones:
+				task = self.zone_tasks.get(zone.name)
+				zones.append(dict(zone.to_json(), lastRequestedProgram=task.program if task is not None else None))
+
+			return zones
+
+	def check_output(self, max_frame_age_s=1):
+		'''
+		Check the LED process is ready to run a program: alive, with a fresh heartbeat, showing frames on the strip and,
+		when frames are rendered ahead, with a render worker.
+
+		Arguments:
+			(opt) max_frame_age_s (int/float) - longest since the last frame was shown for the output to count as running
+
+		Returns:
+			(list[string]) - problems found. Empty if there are none.
+		'''
+		with self._lock:
+			if not self.process.is_alive():
+				return ['LED process {} is not running'.format(self.process.pid)]
+
+			problems = []
+			heartbeat_age_s = time() - self.heartbeat.value
+			if heartbeat_age_s > self.stall_timeout_s:
+				problems.append('LED process {} has not made progress for {:.1f} seconds'.format(self.process.pid, heartbeat_age_s))
+
+			# every program, blackout included, shows a frame at least every 100 ms
+			frame_times = self.frame_timing.recent_times()
+			if not frame_times or time() - frame_times[-1] > max_frame_age_s:
+				problems.append('no frame has been shown on the strip for more than {} seconds'.format(max_frame_age_s))
+
+			if self.frame_ring is not None:
+				try:
+					if not psutil.Process(self.process.pid).children():
+						problems.append('render worker is not running, so frames will be rendered in the LED process')
+				except psutil.NoSuchProcess:
+					problems.append('LED process {} is not running'.format(self.process.pid))
+
+			return problems
+
+	def get_status(self, frames_since=None):
+		'''
+		Arguments:
+			(opt) frames_since (float) - only summarize the timing of frames sent at or after this time
+
+		Returns:
+			(dict) - health of the LED process, its restart history, its recent frame timing, how many of the
+				commands sent to it were started or coalesced, how many frames were rendered ahead in time and the
+				current its frames draw
+		'''
+		with self._lock:
+			return {
+				"pid": self.process.pid,
+				"alive": self.process.is_alive(),
+				"heartbeatAgeS": round(time() - self.heartbeat.value, 3),
+				"stallTimeoutS": self.stall_timeout_s,
+				"restartCount": self.restart_count,
+				"lastRestart": self.last_restart,
+				"lastRequestedProgram": self.last_task.program,
+				"zones": self.get_zones(),
+				"frameTiming": self.frame_timing.summary(frames_since),
+				"commands": self.command_stats.to_json(),
+				"brightnessPct": self.get_brightness_pct(),
+				"renderAhead": self.frame_ring.to_json() if self.frame_ring is not None else None,
+				"power": self.power_limiter.to_json()
+			}
+
+	def _start_process(self):
+		# a process that was killed may have died holding the queue's lock, so every process gets a fresh queue
+		self.queue = multiprocessing.JoinableQueue()
+		self.process_stop_event = multiprocessing.Event()
+		self.heartbeat.value = time()
+		# collect first so everything the LED process inherits is in the oldest generation, which it never collects
+		gc.collect()
+		self.process = BaseProgram(self.logger, self.queue, self.num_pixels, self.crossfade_ms, self.strip_backend, heartbeat=self.heartbeat, stop_event=self.process_stop_event, frame_timing=self.frame_timing, command_stats=self.command_stats, live_parameters=self.live_parameters, dither_hz=self.dither_hz, frame_ring=self.frame_ring, zones=self.zones, power_limiter=self.power_limiter)
+		# forked from the web worker, whose request, pool and monitor threads keep running. The queue and stop event
+		# are new and unused, and multiprocessing resets their thread state in the child, so the logging locks are the
+		# only ones another thread could be holding. They are held across the fork and replaced in the child.
+		with logging_locks_held():
+			self.process.start()
+		self.queue.put_nowait(self.last_task)
+		for task in self.zone_tasks.itervalues():
+			self.queue.put_nowait(task)
+		self.logger.info('Started LED process {} running {}'.format(self.process.pid, self.last_task.program))
+
+	def _restart_process(self, reason):
+		self.logger.error('LED process {} {}. Restarting it with program {}'.format(self.process.pid, reason, self.last_task.program))
+		detected_at = time()
+
+		if self.process.exitcode is None:
+			self._stop_process()
+
+		self._start_process()
+		self.restart_count += 1
+		self.last_restart = {"reason": reason, "time": detected_at, "recoveryS": None}
+		self._pending_recovery = detected_at
+
+	def _stop_process(self):
+		'''
+		Stop the LED process within stop_timeout_s. It is asked to stop with its stop event, which it checks every frame,
+		and if it doesn't exit in time it is sent SIGTERM and finally SIGKILL.
+
+		Returns:
+			(string) - how the process was stopped
+		'''
+		# nothing left on the queue matters, so don't let its feeder thread hold up the service exiting
+		self.queue.cancel_join_thread()
+
+		self.process_stop_event.set()
+		self.process.join(self.stop_timeout_s * 0.6)
+		if self.process.exitcode is not None:
+			return 'stopped'
+
+		self.logger.error('LED process {} did not stop in time. Terminating it.'.format(self.process.pid))
+		self.process.terminate()
+		self.process.join(self.stop_timeout_s * 0.2)
+		if self.process.exitcode is not None:
+			return 'terminated'
+
+		self.logger.error('LED process {} ignored SIGTERM. Killing it.'.format(self.process.pid))
+		os.kill(self.process.pid, signal.SIGKILL)
+		self.process.join(self.stop_timeout_s * 0.2)
+		return 'killed'
+
+	def _check(self):
+		with self._lock:
+			if self._stop_event.is_set():
+				# shutting down, so the LED process is expected to go away
+				return False
+
+			heartbeat_age_s = time() - self.heartbeat.value
+
+			if not self.process.is_alive():
+				self._restart_process('died with exit code {}'.format(self.process.exitcode))
+				return False
+
+			if heartbeat_age_s > self.stall_timeout_s:
+				self._restart_process('stalled for {:.1f} seconds'.format(heartbeat_age_s))
+				return False
+
+			if self._pending_recovery is not None and self.heartbeat.value > self._pending_recovery:
+				# recovery is complete once the new process has started beating
+				self.last_restart['recoveryS'] = round(self.heartbeat.value - self._pending_recovery, 3)
+				self.logger.info('LED process recovered {} seconds after the failure was detected'.format(self.last_restart['recoveryS']))
+				self._pending_recovery = None
+
+			return True
+
+	def _load_state(self):
+		'''
+		Returns:
+			tuple
+				task (ProgramTask) - the program saved in the state file, or None if there isn't a usable one
+				zone_tasks (dict) - zone name -> the program saved for the zone
+		'''
+		if self.state_file is None or not os.path.exists(self.state_file):
+			return None, {}
+
+		try:
+			with open(self.state_file, 'r') as f:
+				state = json.load(f)
+
+			task = self._task_from_state(state)
+			zone_tasks = {}
+			for name, zone_state in state.get('zones', {}).iteritems():
+				if name in [x.name for x in self.zones]:
+					zone_tasks[str(name)] = self._task_from_state(zone_state, str(name))
+				else:
+					self.logger.error('Not resuming {} in zone {}, which is no longer configured'.format(zone_state.get('program'), name))
+
+			return task, zone_tasks
+
+		except (IOError, ValueError, KeyError, AttributeError) as e:
+			self.logger.error('Ignoring unreadable program state file {}: {}'.format(self.state_file, str(e)))
+			return None, {}
+
+	def _task_from_state(self, state, zone=None):
+		'''
+		Raises:
+			ValueError, KeyError, AttributeError
+
+		Returns:
+			(ProgramTask) - task for a program and arguments saved in the state file
+		'''
+		if state['program'] not in ProgramList.valid_programs:
+			raise ValueError('unknown program {}'.format(state['program']))
+
+		return ProgramTask(str(state['program']), dict((str(k), v) for k, v in state['arguments'].iteritems()), zone)
+
+	def _save_state(self):
+		'''Save the last requested program if it changed since it was last saved'''
+		if self.state_file is None or not self._state_dirty:
+			return
+
+		with self._lock:
+			state = {"program": self.last_task.program, "arguments": dict(self.last_task.arg_dict), "savedAt": time()}
+			if self.zone_tasks:
+				state["zones"] = dict((name, {"program": task.program, "arguments": dict(task.arg_dict)}) for name, task in self.zone_tasks.iteritems())
+			self._state_dirty = False
+
+		try:
+			# write then rename so a crash part way through never leaves a truncated file
+			temp_file = self.state_file + '.tmp'
+			with open(temp_file, 'w') as f:
+				f.write(json.dumps(state, indent=4))
+			os.rename(temp_file, self.state_file)
+
+		except (IOError, OSError):
+			self.logger.error('Error saving program state', exc_info=True)
+			self._state_dirty = True
+
+	def _monitor_loop(self):
+		while not self._stop_event.wait(self.check_interval_s):
+			try:
+				healthy = self._check()
+				if healthy and self.systemd_watchdog:
+					sd_notify('WATCHDOG=1')
+
+				self._save_state()
+
+			except Exception:
+				self.logger.error('Error checking LED process health', exc_info=True)
+
+def sd_notify(state):
+	'''
+	Send a state notification to systemd (see sd_notify(3)) without depending on the systemd python bindings.
+
+	Arguments:
+		state (string) - notification such as 'READY=1' or 'WATCHDOG=1'
+	'''
+	address = os.environ.get('NOTIFY_SOCKET')
+	if not address:
+		return
+
+	if address.startswith('@'):
+		# abstract namespace socket
+		address = '\0' + address[1:]
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+	try:
+		sock.sendto(state, address)
+	finally:
+		sock.close()
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class ProgramNotRunningException(Exception):
+	pass
+
+class UnknownZoneException(Exception):
+	pass
@@ -0,0 +1,66 @@
+class Zone(object):
+	'''Named range of pixels on the strip that runs a program of its own'''
+
+	def __init__(self, name, start, end):
+		'''
+		Arguments:
+			name (string) - name the zone is addressed by, e.g. in /zones/<name>/programs/<program>
+			start (int) - first pixel of the zone
+			end (int) - pixel after the last pixel of the zone
+		'''
+		self.name = name
+		self.start = start
+		self.end = end
+
+	@property
+	def num_pixels(self):
+		return self.end - self.start
+
+	def to_json(self):
+		return {
+			"name": self.name,
+			"firstPixel": self.start,
+			"lastPixel": self.end - 1
+		}
+
+def parse_zones(spec, num_pixels):
+	'''
+	Parse zone definitions.
+
+	Arguments:
+		spec (string) - comma separated name:first-last pixel ranges, inclusive, e.g. 'left:0-34,right:35-68'
+		num_pixels (int) - number of pixels on the strip
+
+	Raises:
+		InvalidZoneException
+
+	Returns:
+		(list[Zone]) - zones in pixel order
+	'''
+	zones = []
+	for item in [x.strip() for x in spec.split(',') if x.strip()]:
+		try:
+			name, pixel_range = [x.strip() for x in item.split(':')]
+			first, last = [int(x) for x in pixel_range.split('-')]
+		except ValueError:
+			raise InvalidZoneException('{} is not a zone definition like left:0-34'.format(item))
+
+		if not name or first < 0 or last < first or last >= num_pixels:
+			raise InvalidZoneException('zone {} must be a name and a range of pixels between 0 and {}'.format(item, num_pixels - 1))
+
+		if name in [x.name for x in zones]:
+			raise InvalidZoneException('zone {} is defined more than once'.format(name))
+
+		zones.append(Zone(name, first, last + 1))
+
+	zones.sort(key=lambda x: x.start)
+	for i in range(1, len(zones)):
+		if zones[i].start < zones[i-1].end:
+			raise InvalidZoneException('zones {} and {} overlap'.format(zones[i-1].name, zones[i].name))
+
+	return zones
+
+
+#################### CUSTOM EXCEPTIONS ###########################
+class InvalidZoneException(Exception):
+	pass